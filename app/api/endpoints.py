@@ -2,18 +2,24 @@
 API endpoints for the Alzheimer's Disease Analysis Database.
 """
 
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pathlib import Path
-from app.models.schemas import AskRequest, JobResponse, JobResult
-from app.services.job_service import JobService
+from typing import Optional
+import time
+from app.models.schemas import AskRequest, JobResponse, JobResult, JobStatus
+from app.services.job_events import etag_matches, job_etag, job_events, parse_last_event_id
+from app.services.job_service import JobService, job_service
+from app.services.privacy_budget import PrivacyBudgetExceeded, privacy_budget
+from app.services.query_auditor import query_auditor
+from app.services.question_router import question_router
 from app.core.config import settings
 
 router = APIRouter()
 
 # Dependency
 def get_job_service() -> JobService:
-    return JobService()
+    return job_service
 
 @router.post("/ask", response_model=JobResponse)
 async def ask_question(
@@ -34,7 +40,9 @@ async def ask_question(
             question=request.question,
             dataset_id=request.dataset_id,
             outputs=request.outputs,
-            privacy_level=request.privacy_level
+            privacy_level=request.privacy_level,
+            user_id=request.user_id,
+            epsilon=request.epsilon
         )
         
         return JobResponse(
@@ -43,29 +51,134 @@ async def ask_question(
             message=f"分析工作已建立成功！問題：{request.question}"
         )
         
+    except PrivacyBudgetExceeded as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/result/{job_id}", response_model=JobResult)
 async def get_job_result(
     job_id: str,
+    wait: float = Query(0, ge=0, allow_inf_nan=False, description="Seconds to wait for a state change (long-poll)"),
+    if_none_match: Optional[str] = Header(None),
     job_service: JobService = Depends(get_job_service)
 ):
     """
     Get job status and results.
     
+    With ``wait`` the request is held, without blocking the server, until the
+    job state differs from the ``If-None-Match`` ETag (or from the state at
+    request time), the job finishes or the timeout expires. An unchanged
+    state is answered with 304 and no body.
+    
     Args:
         job_id: Job identifier
+        wait: Long-poll timeout in seconds (capped by settings.long_poll_max_seconds)
+        if_none_match: ETag of the state the client already has
         
     Returns:
-        Job result with status and artifacts
+        Job result with status and artifacts, with an ETag header
     """
     job_result = job_service.get_job_status(job_id)
     
     if not job_result:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return job_result
+    body = job_result.model_dump_json().encode("utf-8")
+    etag = initial = job_etag(body)
+    deadline = time.monotonic() + min(wait, settings.long_poll_max_seconds)
+    last_id = job_events.last_id(job_id)
+    while job_result.status not in (JobStatus.COMPLETED, JobStatus.FAILED) and \
+            (etag_matches(if_none_match, etag) if if_none_match else etag == initial):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await job_events.wait_async(job_id, last_id, remaining)
+        last_id = job_events.last_id(job_id)
+        job_result = job_service.get_job_status(job_id)
+        if not job_result:
+            raise HTTPException(status_code=404, detail="Job not found")
+        body = job_result.model_dump_json().encode("utf-8")
+        etag = job_etag(body)
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    job_service: JobService = Depends(get_job_service)
+):
+    """
+    Stream job status transitions, log lines and artifacts as Server-Sent Events.
+    
+    Args:
+        job_id: Job identifier
+        
+    Returns:
+        ``text/event-stream`` that ends after the final status; resumes after
+        the ``Last-Event-ID`` header (or ``last_event_id`` query parameter)
+    """
+    if not job_service.get_job_status(job_id) and not job_events.exists(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    last_id = parse_last_event_id(request.headers.get("last-event-id") or request.query_params.get("last_event_id"))
+    
+    async def stream(last_id: int):
+        yield "retry: 3000\n\n"
+        while True:
+            events = await job_events.wait_async(job_id, last_id, settings.sse_keepalive_seconds)
+            for event in events:
+                yield event.to_sse()
+                last_id = event.id
+            if not events:
+                if job_events.is_closed(job_id) or await request.is_disconnected():
+                    break
+                # Comment line keeps idle connections open through proxies
+                yield ": keep-alive\n\n"
+    
+    return StreamingResponse(stream(last_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/router/stats")
+async def get_router_stats():
+    """
+    Get fast-path router statistics.
+    
+    Returns:
+        Hit ratio and estimated latency saved by answering from the cohort cube
+    """
+    return question_router.stats()
+
+@router.get("/privacy/budget/{user_id}")
+async def get_privacy_budget(user_id: str):
+    """
+    Get a user's differential-privacy budget.
+    
+    Args:
+        user_id: User identifier
+        
+    Returns:
+        Total, spent and remaining epsilon
+    """
+    return privacy_budget.summary(user_id)
+
+@router.get("/privacy/audit/{user_id}")
+async def get_query_audit(user_id: str):
+    """
+    Get a user's query-audit history size.
+    
+    Args:
+        user_id: User identifier
+        
+    Returns:
+        Number of audited queries and stored populations
+    """
+    return query_auditor.summary(user_id)
 
 @router.get("/files/{job_id}/{filename}")
 async def get_job_file(
@@ -0,0 +1,268 @@
+"""
+FHIR REST endpoints (read, search-type with _include/_revinclude, Patient $everything,
+terminology operations and Bulk Data $export) over the converted resources.
+"""
+
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import FileResponse, Response
+import numpy as np
+from app.core.config import settings
+from app.services.bulk_export import bulk_export_service
+from app.services.fhir_store import FHIRStore, InvalidSearch, get_fhir_store, parse_instants
+from app.utils.terminology import Terminology, get_terminology
+
+router = APIRouter()
+
+FHIR_JSON = "application/fhir+json"
+FHIR_NDJSON = "application/fhir+ndjson"
+
+# 不屬於搜尋條件的控制參數
+CONTROL_PARAMS = {"_count", "_offset", "_format", "_include", "_revinclude"}
+
+# $export 接受的 _outputFormat
+NDJSON_FORMATS = {FHIR_NDJSON, "application/ndjson", "ndjson"}
+
+
+def _outcome(status_code: int, code: str, diagnostics: str) -> Response:
+    body = {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": code, "diagnostics": diagnostics}]
+    }
+    return Response(json.dumps(body, ensure_ascii=False), status_code=status_code, media_type=FHIR_JSON)
+
+
+def _page_link(base: str, params: List[Tuple[str, str]], offset: int, count: int) -> str:
+    return f"{base}?{urlencode(params + [('_offset', offset), ('_count', count)])}"
+
+
+def _bundle(request: Request, path: str, params: List[Tuple[str, str]], total: int,
+            entries: List[Tuple[str, str, bytes, str]], offset: int, count: int) -> bytes:
+    """
+    Assemble a searchset Bundle around the stored resource bytes without re-encoding them.
+
+    Args:
+        path: Search path below ``/fhir`` used for the paging links
+        entries: ``(resource_type, id, JSON bytes, search mode)`` per entry
+    """
+    base = f"{str(request.base_url).rstrip('/')}/fhir"
+    links = [("self", _page_link(f"{base}/{path}", params, offset, count))]
+    if offset + count < total:
+        links.append(("next", _page_link(f"{base}/{path}", params, offset + count, count)))
+    if offset > 0:
+        links.append(("previous", _page_link(f"{base}/{path}", params, max(offset - count, 0), count)))
+
+    head = json.dumps({
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": total,
+        "link": [{"relation": relation, "url": url} for relation, url in links],
+    }, ensure_ascii=False).encode("utf-8")
+    items = b",".join(
+        b'{"fullUrl":' + json.dumps(f"{base}/{resource_type}/{resource_id}").encode("utf-8")
+        + b',"resource":' + raw + b',"search":{"mode":"' + mode.encode("ascii") + b'"}}'
+        for resource_type, resource_id, raw, mode in entries
+    )
+    return head[:-1] + b',"entry":[' + items + b"]}"
+
+
+def _paging(request: Request) -> Tuple[int, int]:
+    """``_count`` and ``_offset`` clamped to the configured page size (ValueError if not integers)."""
+    count = int(request.query_params.get("_count", settings.fhir_page_size))
+    offset = int(request.query_params.get("_offset", 0))
+    return min(max(count, 0), settings.fhir_max_page_size), max(offset, 0)
+
+
+@router.get("/metadata")
+async def capability_statement():
+    """Return the CapabilityStatement written by the converter."""
+    path = Path(settings.fhir_resource_dir) / "metadata.json"
+    if not path.exists():
+        return _outcome(404, "not-found", "CapabilityStatement has not been generated")
+    return Response(path.read_bytes(), media_type=FHIR_JSON)
+
+
+def _kick_off(request: Request, level: str) -> Response:
+    """Validate a $export kick-off request and start the job (202 + Content-Location)."""
+    if "respond-async" not in request.headers.get("prefer", ""):
+        return _outcome(400, "invalid", "$export requires the header 'Prefer: respond-async'")
+    output_format = request.query_params.get("_outputFormat")
+    if output_format and output_format not in NDJSON_FORMATS:
+        return _outcome(400, "not-supported", f"Unsupported _outputFormat: {output_format}")
+
+    types = [t.strip() for t in request.query_params.get("_type", "").split(",") if t.strip()]
+    since = None
+    if request.query_params.get("_since"):
+        since = parse_instants([request.query_params["_since"]])[0]
+        if np.isnat(since):
+            return _outcome(400, "invalid", f"Invalid _since instant: {request.query_params['_since']}")
+
+    try:
+        job_id = bulk_export_service.kick_off(level, types, since, str(request.url))
+    except ValueError as e:
+        return _outcome(400, "not-supported", str(e))
+    status_url = f"{str(request.base_url).rstrip('/')}/fhir/bulkstatus/{job_id}"
+    return Response(status_code=202, headers={"Content-Location": status_url})
+
+
+@router.get("/$export")
+async def system_export(request: Request):
+    """Bulk Data system-level export kick-off."""
+    return _kick_off(request, "system")
+
+
+@router.get("/Patient/$export")
+async def patient_export(request: Request):
+    """Bulk Data Patient-level export kick-off (all resources in the Patient compartment)."""
+    return _kick_off(request, "patient")
+
+
+@router.get("/bulkstatus/{job_id}")
+async def export_status(job_id: str, request: Request):
+    """Export job status: 202 with X-Progress while running, 200 with the manifest when complete."""
+    job = bulk_export_service.get(job_id)
+    if job is None:
+        return _outcome(404, "not-found", f"Export job {job_id} not found")
+    if job.status == "in-progress":
+        return Response(status_code=202, headers={"X-Progress": job.progress or "queued", "Retry-After": "2"})
+    if job.status == "error":
+        return _outcome(500, "exception", job.error or "Export failed")
+    file_base_url = f"{str(request.base_url).rstrip('/')}/fhir/bulkfiles"
+    return Response(json.dumps(bulk_export_service.manifest(job, file_base_url), ensure_ascii=False),
+                    media_type="application/json")
+
+
+@router.delete("/bulkstatus/{job_id}")
+async def cancel_export(job_id: str):
+    """Cancel an export job or delete its completed files."""
+    if not bulk_export_service.cancel(job_id):
+        return _outcome(404, "not-found", f"Export job {job_id} not found")
+    return Response(status_code=202)
+
+
+@router.get("/bulkfiles/{job_id}/{file_name}")
+async def export_file(job_id: str, file_name: str):
+    """Serve one gzip NDJSON output file of a completed export."""
+    path = bulk_export_service.file_path(job_id, file_name)
+    if path is None or not path.exists():
+        return _outcome(404, "not-found", f"Export file {file_name} not found")
+    return FileResponse(path, media_type=FHIR_NDJSON, headers={"Content-Encoding": "gzip"})
+
+
+def _parameters(body: dict) -> Response:
+    return Response(json.dumps(body, ensure_ascii=False), media_type=FHIR_JSON)
+
+
+@router.get("/CodeSystem/$lookup")
+async def code_system_lookup(system: str, code: str, terminology: Terminology = Depends(get_terminology)):
+    """CodeSystem ``$lookup``: display and designations of one code."""
+    result = terminology.lookup(system, code)
+    if result is None:
+        return _outcome(404, "not-found", f"Code {code} not found in {system}")
+    return _parameters(result)
+
+
+@router.get("/CodeSystem/$validate-code")
+async def code_system_validate_code(url: str, code: str, display: Optional[str] = None,
+                                    terminology: Terminology = Depends(get_terminology)):
+    """CodeSystem ``$validate-code`` (``url`` is the CodeSystem url)."""
+    try:
+        return _parameters(terminology.validate_code(code, system=url, display=display))
+    except KeyError:
+        return _outcome(404, "not-found", f"CodeSystem {url} not found")
+
+
+@router.get("/ValueSet/$validate-code")
+async def value_set_validate_code(url: str, code: str, system: Optional[str] = None, display: Optional[str] = None,
+                                  terminology: Terminology = Depends(get_terminology)):
+    """ValueSet ``$validate-code``."""
+    try:
+        return _parameters(terminology.validate_code(code, system=system, url=url, display=display))
+    except KeyError:
+        return _outcome(404, "not-found", f"ValueSet {url} not found")
+
+
+@router.get("/ValueSet/$expand")
+async def value_set_expand(url: str, filter: Optional[str] = None, offset: int = 0, count: Optional[int] = None,
+                           terminology: Terminology = Depends(get_terminology)):
+    """ValueSet ``$expand`` with optional text ``filter`` and ``offset``/``count`` paging."""
+    try:
+        return _parameters(terminology.expand(url, filter, max(offset, 0), count))
+    except KeyError:
+        return _outcome(404, "not-found", f"ValueSet {url} not found")
+
+
+@router.get("/Patient/{resource_id}/$everything")
+async def patient_everything(resource_id: str, request: Request, store: FHIRStore = Depends(get_fhir_store)):
+    """
+    Patient ``$everything``: the patient and every resource that references it.
+
+    Served from the reverse-reference index, so the cost grows with the
+    result rather than with the store. ``_type`` restricts the returned
+    types; ``_count``/``_offset`` page the result.
+    """
+    found = store.everything("Patient", resource_id)
+    if not found:
+        return _outcome(404, "not-found", f"Patient/{resource_id} not found")
+    types = {t.strip() for t in request.query_params.get("_type", "").split(",") if t.strip()}
+    if types:
+        found = [item for item in found if item[0] in types]
+    try:
+        count, offset = _paging(request)
+    except ValueError:
+        return _outcome(400, "invalid", "_count and _offset must be integers")
+
+    params = [(name, value) for name, value in request.query_params.multi_items() if name not in CONTROL_PARAMS]
+    entries = [(t, i, raw, "match") for t, i, raw in found[offset:offset + count]]
+    body = _bundle(request, f"Patient/{resource_id}/$everything", params, len(found), entries, offset, count)
+    return Response(body, media_type=FHIR_JSON)
+
+
+@router.get("/{resource_type}")
+async def search_type(resource_type: str, request: Request, store: FHIRStore = Depends(get_fhir_store)):
+    """
+    Search one resource type and return a paged searchset Bundle.
+
+    Query parameters are the search parameters of the CapabilityStatement
+    plus ``_id``; ``_count`` and ``_offset`` page the results.
+    ``_include``/``_revinclude`` (``<Type>:<param>[:<Target>]``) add the
+    resources referenced by / referencing the current page.
+    """
+    params = [(name, value) for name, value in request.query_params.multi_items() if name not in CONTROL_PARAMS]
+    try:
+        count, offset = _paging(request)
+    except ValueError:
+        return _outcome(400, "invalid", "_count and _offset must be integers")
+
+    try:
+        positions = store.search(resource_type, params)
+        page = positions[offset:offset + count]
+        included = []
+        for spec in request.query_params.getlist("_include"):
+            included.extend(store.included(resource_type, page, spec))
+        for spec in request.query_params.getlist("_revinclude"):
+            included.extend(store.revincluded(resource_type, page, spec))
+    except InvalidSearch as e:
+        return _outcome(400, "not-supported", str(e))
+
+    entries = [(resource_type, i, raw, "match") for i, raw in store.entries(resource_type, page)]
+    seen = {(t, i) for t, i, _, _ in entries}
+    for item in included:
+        if item[:2] not in seen:
+            seen.add(item[:2])
+            entries.append((*item, "include"))
+    include_params = [(name, value) for name, value in request.query_params.multi_items() if name in ("_include", "_revinclude")]
+    body = _bundle(request, resource_type, params + include_params, len(positions), entries, offset, count)
+    return Response(body, media_type=FHIR_JSON)
+
+
+@router.get("/{resource_type}/{resource_id}")
+async def read(resource_type: str, resource_id: str, store: FHIRStore = Depends(get_fhir_store)):
+    """Return one resource by id."""
+    raw = store.read(resource_type, resource_id)
+    if raw is None:
+        return _outcome(404, "not-found", f"{resource_type}/{resource_id} not found")
+    return Response(raw, media_type=FHIR_JSON)
@@ -26,9 +26,38 @@ class Settings(BaseSettings):
     # Dataset Configuration
     dataset_path: str = "/data/alzheimers_cohort_v1"
     artifact_dir: str = "/app/artifacts"
+    cube_path: str = "/data/alzheimers_cohort_v1/cohort_cube.npz"
+    fhir_resource_dir: str = "fhir/resources"  # per-file <Type>/<id>.json tree
+    fhir_ndjson_dir: str = "fhir/ndjson"  # packed shards, preferred when present
+    fhir_page_size: int = 50
+    fhir_max_page_size: int = 1000
+    bulk_export_dir: str = "/app/artifacts/bulk_export"  # $export NDJSON.gz output
+    
+    # Job Events Configuration
+    job_event_history: int = 1000  # events kept per job for Last-Event-ID replay
+    sse_keepalive_seconds: float = 15.0  # comment line sent on idle event streams
+    long_poll_max_seconds: float = 30.0  # upper bound for the wait= parameter of job result endpoints
     
     # Privacy Configuration
     k_anonymity: int = 10
+    small_cell_method: str = "suppress"  # "suppress" (with complementary suppression) or "round"
+    sensitive_attribute: str = "失智程度"  # attribute protected by l-diversity / t-closeness
+    l_diversity: int = 3
+    l_diversity_kind: str = "distinct"  # "distinct" or "entropy"
+    t_closeness: float = 0.3  # max Earth Mover's Distance to the overall distribution
+    pseudonym_secret: Optional[str] = None
+    pseudonym_map_path: Optional[str] = None  # encrypted token cache reused across runs
+    
+    # Differential Privacy Configuration
+    dp_mechanism: str = "laplace"  # "laplace" or "gaussian"
+    dp_epsilon: float = 0.5  # default spend per query
+    dp_delta: float = 1e-6  # gaussian mechanism only
+    dp_user_budget: float = 10.0  # total epsilon per user
+    privacy_budget_path: str = "/app/privacy/budget.sqlite3"
+    query_audit_action: str = "reject"  # "reject" or "noise" for answers open to differencing
+    
+    # Question Router Configuration
+    router_confidence_threshold: float = 0.6
     
     # LLM Configuration
     anthropic_api_key: Optional[str] = None
@@ -41,6 +70,8 @@ class Settings(BaseSettings):
     # Sandbox Configuration
     sandbox_image: str = "dementia-sandbox:latest"
     sandbox_timeout: int = 300  # 5 minutes
+    duckdb_threads: int = 4
+    duckdb_memory_limit: str = "384MB"  # below the container mem_limit; larger queries spill to disk
     
     # Security Configuration
     max_code_length: int = 10000
@@ -9,6 +9,7 @@ from pathlib import Path
 import time
 
 from app.api.endpoints import router
+from app.api import fhir
 from app.core.config import settings
 
 # Create FastAPI app
@@ -41,6 +42,9 @@ async def add_process_time_header(request: Request, call_next):
 # Include API router
 app.include_router(router, prefix="/api/v1", tags=["analysis"])
 
+# FHIR REST API over the converted resources
+app.include_router(fhir.router, prefix="/fhir", tags=["fhir"])
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -2,7 +2,7 @@
 Pydantic schemas for API requests and responses.
 """
 
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 from pydantic import BaseModel, Field
 from datetime import datetime
 from enum import Enum
@@ -12,6 +12,9 @@ class PrivacyLevel(str, Enum):
     PUBLIC = "public"
     AGGREGATED = "aggregated"
     K_ANONYMOUS = "k_anonymous"
+    L_DIVERSE = "l_diverse"
+    T_CLOSE = "t_close"
+    DIFFERENTIAL_PRIVACY = "differential_privacy"
 
 class OutputType(str, Enum):
     """Types of outputs that can be generated."""
@@ -20,12 +23,23 @@ class OutputType(str, Enum):
     CODE = "code"
     EXPLANATION = "explanation"
 
+class QueryIntent(BaseModel):
+    """Structured intent parsed from a natural language question."""
+    measure: Optional[Literal["count", "percentage"]] = Field(None, description="Requested measure")
+    dimensions: List[str] = Field(default=[], description="Cube dimensions to group by")
+    filters: Dict[str, List[str]] = Field(default={}, description="Dimension labels to restrict to")
+    chart_type: Optional[Literal["line", "bar", "grouped_bar", "pie"]] = Field(None, description="Requested chart type")
+    unsupported: List[str] = Field(default=[], description="Keywords the cube cannot answer")
+    confidence: float = Field(0.0, description="Parse confidence between 0 and 1")
+
 class AskRequest(BaseModel):
     """Request model for /ask endpoint."""
     question: str = Field(..., description="User's analysis question")
     dataset_id: str = Field(default="alzheimers_cohort_v1", description="Dataset identifier")
     outputs: List[OutputType] = Field(default=[OutputType.PLOT, OutputType.TABLE], description="Desired output types")
     privacy_level: PrivacyLevel = Field(default=PrivacyLevel.K_ANONYMOUS, description="Privacy protection level")
+    user_id: str = Field(default="anonymous", description="User identifier for privacy budget accounting")
+    epsilon: Optional[float] = Field(None, gt=0, description="Privacy budget to spend (differential_privacy only)")
 
 class JobResponse(BaseModel):
     """Response model for job creation."""
@@ -0,0 +1,151 @@
+"""
+FHIR Bulk Data ``$export`` jobs.
+
+An export runs in a background thread: every requested resource type is
+streamed from the resource store into one gzip NDJSON file in a single
+pass (resources are written as they are selected, so memory does not
+grow with the export). The status endpoint reports progress and, once
+complete, the manifest listing the files.
+"""
+
+import gzip
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from app.core.config import settings
+from app.services.fhir_store import FHIRStore, get_fhir_store
+
+EXPORT_LEVELS = ("system", "patient")
+
+# 每次從資源庫取出並寫入的資源數
+EXPORT_BATCH_SIZE = 1000
+
+# Patient 層級匯出只包含 Patient compartment 內的資源類型
+PATIENT_COMPARTMENT_TYPES = ("Patient", "Condition", "Observation")
+
+
+class ExportJob:
+    """State of one bulk export."""
+
+    def __init__(self, job_id: str, level: str, types: List[str], since: Optional[np.datetime64], request_url: str):
+        self.job_id = job_id
+        self.level = level
+        self.types = types
+        self.since = since
+        self.request_url = request_url
+        self.transaction_time = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        self.status = "in-progress"  # in-progress, completed, error, cancelled
+        self.progress = ""
+        self.outputs: List[Dict] = []
+        self.error: Optional[str] = None
+        self.cancelled = threading.Event()
+
+
+class BulkExportService:
+    """Kick off, track, cancel and serve ``$export`` jobs."""
+
+    def __init__(self, output_dir: Optional[str] = None, store_provider: Callable[[], FHIRStore] = get_fhir_store):
+        self.output_dir = Path(output_dir or settings.bulk_export_dir)
+        self.store_provider = store_provider
+        self.jobs: Dict[str, ExportJob] = {}
+        self._lock = threading.Lock()
+
+    def kick_off(self, level: str, types: Optional[List[str]] = None, since: Optional[np.datetime64] = None,
+                 request_url: str = "") -> str:
+        """
+        Start an export job in the background.
+
+        Args:
+            level: ``system`` (every resource) or ``patient`` (the Patient compartment)
+            types: Resource types to export (default: every available type)
+            since: Only export resources updated after this UTC instant
+            request_url: Kick-off URL, echoed in the manifest
+
+        Returns:
+            Job ID
+        """
+        if level not in EXPORT_LEVELS:
+            raise ValueError(f"Unknown export level: {level}")
+        store = self.store_provider()
+        available = [t for t in store.resource_types if level == "system" or t in PATIENT_COMPARTMENT_TYPES]
+        if types:
+            unknown = [t for t in types if t not in available]
+            if unknown:
+                raise ValueError(f"Resource types not available for {level} export: {', '.join(unknown)}")
+        job = ExportJob(str(uuid.uuid4()), level, list(types or available), since, request_url)
+        with self._lock:
+            self.jobs[job.job_id] = job
+        threading.Thread(target=self._run, args=(job, store), daemon=True).start()
+        return job.job_id
+
+    def _run(self, job: ExportJob, store: FHIRStore):
+        job_dir = self.output_dir / job.job_id
+        try:
+            job_dir.mkdir(parents=True, exist_ok=True)
+            for done, resource_type in enumerate(job.types):
+                positions = store.changed_since(resource_type, job.since)
+                if job.level == "patient":
+                    positions = np.intersect1d(positions, store.compartment(resource_type), assume_unique=True)
+                job.progress = f"{done}/{len(job.types)} resource types ({resource_type})"
+
+                file_name = f"{resource_type}.ndjson.gz"
+                with gzip.open(job_dir / file_name, "wb", compresslevel=6) as f:
+                    for start in range(0, len(positions), EXPORT_BATCH_SIZE):
+                        if job.cancelled.is_set():
+                            return
+                        f.writelines(raw + b"\n" for _, raw in store.entries(resource_type, positions[start:start + EXPORT_BATCH_SIZE]))
+                if len(positions):
+                    job.outputs.append({"type": resource_type, "file": file_name, "count": len(positions)})
+                else:
+                    (job_dir / file_name).unlink()
+            job.progress = f"{len(job.types)}/{len(job.types)} resource types"
+            job.status = "completed"
+        except Exception as e:
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            if job.cancelled.is_set():
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def manifest(self, job: ExportJob, file_base_url: str) -> Dict:
+        """Completion manifest as defined by the Bulk Data spec."""
+        return {
+            "transactionTime": job.transaction_time,
+            "request": job.request_url,
+            "requiresAccessToken": False,
+            "output": [
+                {"type": o["type"], "url": f"{file_base_url}/{job.job_id}/{o['file']}", "count": o["count"]}
+                for o in job.outputs
+            ],
+            "error": []
+        }
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job (or delete a finished one) and remove its files."""
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+        if job is None:
+            return False
+        job.cancelled.set()
+        job.status = "cancelled"
+        shutil.rmtree(self.output_dir / job_id, ignore_errors=True)
+        return True
+
+    def file_path(self, job_id: str, file_name: str) -> Optional[Path]:
+        """Path of a completed job's output file, or None."""
+        job = self.get(job_id)
+        if job is None or job.status != "completed" or file_name not in {o["file"] for o in job.outputs}:
+            return None
+        return self.output_dir / job_id / file_name
+
+
+# Global bulk export service instance
+bulk_export_service = BulkExportService()
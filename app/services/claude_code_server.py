@@ -6,9 +6,11 @@ import os
 import hashlib
 import requests
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from app.models.schemas import OutputType, PrivacyLevel
 from app.core.config import settings
+from app.services.cohort_cube import UNKNOWN
+from app.services.question_router import question_router
 
 class ClaudeCodeServer:
     """Claude Code Server 服務"""
@@ -55,6 +57,17 @@ class ClaudeCodeServer:
 4. 使用 pandas, matplotlib, openpyxl 等庫
 5. 將圖表保存到 /artifacts/ 目錄
 6. 返回可執行的 Python 程式碼
+
+若問題只需要彙總統計，可改為回傳 SQL 模式的 JSON（不要包含其他文字）：
+{{"sql": "SELECT ...", "chart": {{"type": "line|bar|pie", "x": "欄位", "y": "欄位", "title": "標題"}}}}
+SQL 只能是單一 SELECT，且結果必須是彙總（GROUP BY 搭配 COUNT/SUM/AVG 等），不可輸出逐筆明細或 SELECT *。
+隱私等級為 l_diverse 或 t_close 時，含失智程度（severity）的結果須為「維度 + 單一人數欄」的長表，釋出前會合併或移除敏感值不夠多樣的類別，其他形式將不予釋出。
+SQL 在 DuckDB 中執行，可用的 views：
+- patients：完整世代資料（含 year 分區欄位，民國年）
+- patients_<民國年>：單一年度資料，例如 patients_113
+- observations(id, subject, code, display, value_quantity, value_string, last_updated)：FHIR 扁平化觀察值
+- conditions(id, subject, code, severity, severity_code, last_updated)：FHIR 扁平化診斷
+- patient_views(id, gender, age_group, last_updated)：FHIR 扁平化病患（subject 對應 patient_views.id）
         """.strip()
         
         # 發送請求到 Claude Code Server
@@ -75,6 +88,21 @@ class ClaudeCodeServer:
             # 生成程式碼雜湊
             code_hash = hashlib.sha256(code.encode()).hexdigest()
             
+            sql_spec = self._parse_sql_spec(code)
+            if sql_spec is not None:
+                return {
+                    'code': code,
+                    'code_hash': code_hash,
+                    'question': question,
+                    'outputs': outputs,
+                    'privacy_level': privacy_level,
+                    'language': 'sql',
+                    'sql': sql_spec['sql'],
+                    'chart': sql_spec.get('chart'),
+                    'libraries': ['duckdb'],
+                    'source': 'claude_code_server'
+                }
+            
             return {
                 'code': code,
                 'code_hash': code_hash,
@@ -88,18 +116,31 @@ class ClaudeCodeServer:
         else:
             raise Exception(f"Claude Code Server 回應錯誤: {response.status_code}")
     
+    def _parse_sql_spec(self, code: str) -> Optional[Dict[str, Any]]:
+        """解析 SQL 模式的回應（{"sql": ..., "chart": ...}），否則回傳 None"""
+        stripped = code.strip()
+        if not stripped.startswith('{'):
+            return None
+        try:
+            spec = json.loads(stripped)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(spec, dict) or not isinstance(spec.get('sql'), str):
+            return None
+        return spec
+    
     def _generate_default_code(self, question: str, outputs: List[OutputType], privacy_level: PrivacyLevel) -> Dict[str, Any]:
         """生成預設程式碼用於演示"""
         
-        # 根據問題類型生成不同的程式碼
-        if "折線圖" in question or "趨勢" in question:
-            code = self._generate_trend_chart_code(question, outputs, privacy_level)
-        elif "分布" in question or "統計" in question:
-            code = self._generate_distribution_code(question, outputs, privacy_level)
-        elif "比較" in question or "對比" in question:
-            code = self._generate_comparison_code(question, outputs, privacy_level)
-        else:
-            code = self._generate_general_analysis_code(question, outputs, privacy_level)
+        # 根據問題解析出的圖表類型生成不同的程式碼
+        templates = {
+            "line": self._generate_trend_chart_code,
+            "bar": self._generate_distribution_code,
+            "grouped_bar": self._generate_comparison_code,
+        }
+        intent = question_router.parse(question)
+        generate = templates.get(intent.chart_type, self._generate_general_analysis_code)
+        code = generate(question, outputs, privacy_level)
         
         # 生成程式碼雜湊
         code_hash = hashlib.sha256(code.encode()).hexdigest()
@@ -121,22 +162,22 @@ class ClaudeCodeServer:
 # 隱私等級: {privacy_level}
 # 輸出類型: {', '.join(outputs)}
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
-
-# 讀取 Excel 資料
-df = pd.read_excel('{settings.dataset_path}/patients.xlsx')
 
-# 資料預處理
-df['diagnosis_date'] = pd.to_datetime(df['diagnosis_date'])
-df['year'] = df['diagnosis_date'].dt.year
+# 讀取預先彙總的世代資料立方體（不讀取個案層級資料）
+cube = np.load('{settings.cube_path}')
+dims = [str(d) for d in cube['dims']]
+axis = dims.index('intake_year')
 
-# 按年份統計病患數量
-yearly_counts = df.groupby('year').size().reset_index(name='patient_count')
+# 按收案年份 roll-up 病患數量
+counts = cube['counts'].sum(axis=tuple(i for i in range(len(dims)) if i != axis))
+yearly_counts = pd.DataFrame({{'year': cube['labels_intake_year'], 'patient_count': counts}})
+yearly_counts = yearly_counts[(yearly_counts['year'] != '{UNKNOWN}') & (yearly_counts['patient_count'] > 0)]
 
 # 隱私保護
-if "{privacy_level.value}" == "k_anonymous":
+if "{privacy_level.value}" in ("k_anonymous", "l_diverse", "t_close"):
     # 確保 k-匿名性 (k={settings.k_anonymity})
     if len(yearly_counts) < {settings.k_anonymity}:
         yearly_counts = pd.DataFrame()
@@ -201,25 +242,24 @@ else:
 # 隱私等級: {privacy_level}
 # 輸出類型: {', '.join(outputs)}
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-# 讀取 Excel 資料
-df = pd.read_excel('{settings.dataset_path}/patients.xlsx')
-
-# 基本統計
-summary_stats = df.describe()
+# 讀取預先彙總的世代資料立方體（不讀取個案層級資料）
+cube = np.load('{settings.cube_path}')
+dims = [str(d) for d in cube['dims']]
+axis = dims.index('age_group')
 
-# 年齡分布
-age_distribution = df['age'].value_counts().sort_index()
+# 年齡分布（立方體已依年齡段分組）
+counts = cube['counts'].sum(axis=tuple(i for i in range(len(dims)) if i != axis))
+age_distribution = pd.Series(counts, index=cube['labels_age_group'])
+age_distribution = age_distribution[age_distribution.index != '{UNKNOWN}']
 
 # 隱私保護
-if "{privacy_level.value}" == "k_anonymous":
-    if len(df) < {settings.k_anonymity}:
-        age_distribution = pd.Series()
-    else:
-        # 年齡分組以確保隱私
-        age_distribution = df.groupby(pd.cut(df['age'], bins=10)).size()
+if "{privacy_level.value}" in ("k_anonymous", "l_diverse", "t_close"):
+    # 抑制低於 k 的小格 (k={settings.k_anonymity})
+    age_distribution = age_distribution[age_distribution >= {settings.k_anonymity}]
 
 # 生成輸出
 '''
@@ -276,7 +316,7 @@ gender_comparison = df['gender'].value_counts()
 education_comparison = df['education_years'].value_counts().sort_index()
 
 # 隱私保護
-if "{privacy_level.value}" == "k_anonymous":
+if "{privacy_level.value}" in ("k_anonymous", "l_diverse", "t_close"):
     if len(df) < {settings.k_anonymity}:
         gender_comparison = pd.Series()
         education_comparison = pd.Series()
@@ -350,7 +390,7 @@ print(f"欄位: {{list(df.columns)}}")
 summary_stats = df.describe()
 
 # 隱私保護
-if "{privacy_level.value}" == "k_anonymous":
+if "{privacy_level.value}" in ("k_anonymous", "l_diverse", "t_close"):
     if len(df) < {settings.k_anonymity}:
         summary_stats = pd.DataFrame()
     else:
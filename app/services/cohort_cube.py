@@ -0,0 +1,290 @@
+"""
+Pre-aggregated cohort cube for answering common count questions without row-level data.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.utils.dates import AGE_BINS, AGE_LABELS, parse_ages, year_of
+
+UNKNOWN = "未知"
+
+# 立方體維度與其來源欄位（依序嘗試，支援原始中文欄位與範例資料集欄位）
+CUBE_DIMENSIONS: Dict[str, List[str]] = {
+    "intake_year": ["收案日期", "diagnosis_date"],
+    "age_group": ["生日/年齡", "年齡", "age"],
+    "gender": ["性別", "gender"],
+    "severity": ["失智程度", "cdr_score"],
+    "apoe": ["APOE", "apoe_genotype"],
+    "diagnosis": ["失智症診斷", "diagnosis"],
+}
+
+GENDER_MAP = {"男": "男", "女": "女", "M": "男", "F": "女", "male": "男", "female": "女"}
+
+# 有自然順序的維度，標籤依此排序（其餘依字典序）
+DIMENSION_ORDER: Dict[str, List[str]] = {
+    "age_group": AGE_LABELS,
+    "severity": ["極輕度失智", "輕度失智", "中度失智", "重度失智"],
+}
+
+SEVERITY_MAP = {
+    "0.5": "極輕度失智",
+    "1": "輕度失智",
+    "2": "中度失智",
+    "3": "重度失智",
+    "極輕度": "極輕度失智",
+    "輕度": "輕度失智",
+    "中度": "中度失智",
+    "重度": "重度失智",
+}
+
+
+def _normalize_intake_year(series: pd.Series) -> pd.Series:
+    """Extract the Gregorian intake year, converting ROC years (e.g. 0110/10/29)."""
+    return year_of(series).astype("string")
+
+
+def _normalize_age_group(series: pd.Series) -> pd.Series:
+    """Bucket numeric ages into the age bands used across the project."""
+    return parse_ages(series).pipe(pd.cut, bins=AGE_BINS, labels=AGE_LABELS, right=False).astype("string")
+
+
+def _normalize_gender(series: pd.Series) -> pd.Series:
+    return series.astype("string").str.strip().map(GENDER_MAP)
+
+
+def _normalize_severity(series: pd.Series) -> pd.Series:
+    values = series.astype("string").str.replace(r"\s+", "", regex=True)
+    # cdr_score 之類的數值欄位會變成 "1.0"，先去掉多餘的小數位
+    values = values.str.replace(r"^(\d)\.0$", r"\1", regex=True)
+    return values.replace(SEVERITY_MAP)
+
+
+def _normalize_apoe(series: pd.Series) -> pd.Series:
+    values = series.astype("string").str.replace(r"\s|[Ee]", "", regex=True)
+    return values.where(values.str.fullmatch(r"\d/\d").fillna(False))
+
+
+def _normalize_diagnosis(series: pd.Series) -> pd.Series:
+    values = series.astype("string").str.strip()
+    return values.where(values != "")
+
+
+NORMALIZERS = {
+    "intake_year": _normalize_intake_year,
+    "age_group": _normalize_age_group,
+    "gender": _normalize_gender,
+    "severity": _normalize_severity,
+    "apoe": _normalize_apoe,
+    "diagnosis": _normalize_diagnosis,
+}
+
+
+def _resolve_column(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
+    for col in candidates:
+        if col in df.columns:
+            return col
+    return None
+
+
+class CohortCube:
+    """
+    Dense count cube over the cohort's common analysis dimensions.
+
+    Cells hold patient counts for each combination of dimension labels. Cells
+    with ``0 < count < k`` are flagged as small cells so callers can suppress
+    them before release. Queries (slice, dice, roll-up) operate on the numpy
+    array only and never touch row-level data.
+
+    Cells count cohort rows; a patient enrolled in several yearly files
+    contributes several rows. ``max_contribution`` records the most rows any
+    one patient contributes, which is the sensitivity of every histogram
+    derived from the cube (used to calibrate differential-privacy noise).
+    """
+
+    def __init__(self, dims: Sequence[str], labels: Dict[str, np.ndarray], counts: np.ndarray, k: Optional[int] = None,
+                 max_contribution: int = 1):
+        self.dims = list(dims)
+        self.labels = {dim: np.asarray(labels[dim]) for dim in self.dims}
+        self.counts = counts
+        self.k = settings.k_anonymity if k is None else k
+        self.max_contribution = max_contribution
+        self._index = {dim: {label: i for i, label in enumerate(self.labels[dim])} for dim in self.dims}
+        self._cells: Optional[Tuple[np.ndarray, Tuple[np.ndarray, ...]]] = None
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, dims: Sequence[str] = None, k: Optional[int] = None,
+                       patient_keys: Optional[pd.Series] = None) -> "CohortCube":
+        """
+        Build a cube from row-level cohort data.
+
+        Args:
+            df: Row-level cohort DataFrame (original Chinese or sample schema)
+            dims: Dimensions to materialize (default: all of CUBE_DIMENSIONS)
+            k: Small-cell threshold (default from settings)
+            patient_keys: Linked patient key of every row (missing: a patient of its own);
+                without it every row is assumed to be a different patient
+
+        Returns:
+            CohortCube with one axis per dimension
+        """
+        dims = list(dims or CUBE_DIMENSIONS.keys())
+        codes = []
+        labels = {}
+
+        for dim in dims:
+            col = _resolve_column(df, CUBE_DIMENSIONS[dim])
+            if col is None:
+                values = pd.Series(UNKNOWN, index=df.index, dtype="string")
+            else:
+                values = NORMALIZERS[dim](df[col]).fillna(UNKNOWN)
+            dim_codes, dim_labels = pd.factorize(values, sort=True)
+            dim_labels = np.asarray(dim_labels, dtype=str)
+            if dim in DIMENSION_ORDER:
+                rank = {label: i for i, label in enumerate(DIMENSION_ORDER[dim])}
+                order = np.argsort([rank.get(label, len(rank)) for label in dim_labels], kind="stable")
+                remap = np.empty_like(order)
+                remap[order] = np.arange(len(order))
+                dim_codes, dim_labels = remap[dim_codes], dim_labels[order]
+            codes.append(dim_codes)
+            labels[dim] = dim_labels
+
+        max_contribution = 1
+        if patient_keys is not None and patient_keys.notna().any():
+            max_contribution = int(patient_keys.dropna().value_counts().max())
+
+        shape = tuple(len(labels[dim]) for dim in dims)
+        if len(df) == 0:
+            return cls(dims, labels, np.zeros(shape, dtype=np.int64), k, max_contribution)
+
+        flat = np.ravel_multi_index(codes, shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        return cls(dims, labels, counts, k, max_contribution)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CohortCube":
+        """Load a cube saved with :meth:`save`."""
+        with np.load(path, allow_pickle=False) as data:
+            dims = [str(dim) for dim in data["dims"]]
+            labels = {dim: data[f"labels_{dim}"] for dim in dims}
+            # 舊版立方體未記錄每位病患的最大列數
+            max_contribution = int(data["max_contribution"]) if "max_contribution" in data.files else 1
+            return cls(dims, labels, data["counts"], int(data["k"]), max_contribution)
+
+    def save(self, path: Union[str, Path]):
+        """Save the cube as a compressed ``.npz`` archive."""
+        arrays = {f"labels_{dim}": self.labels[dim] for dim in self.dims}
+        np.savez_compressed(
+            path,
+            dims=np.asarray(self.dims, dtype=str),
+            counts=self.counts,
+            k=np.asarray(self.k),
+            max_contribution=np.asarray(self.max_contribution),
+            **arrays
+        )
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    @property
+    def small_cells(self) -> np.ndarray:
+        """Boolean mask of cells below the k threshold (empty cells excluded)."""
+        return (self.counts > 0) & (self.counts < self.k)
+
+    def _axis(self, dim: str) -> int:
+        if dim not in self.dims:
+            raise KeyError(f"Unknown cube dimension: {dim}")
+        return self.dims.index(dim)
+
+    def slice(self, dim: str, value: str) -> "CohortCube":
+        """Fix one dimension to a single label and drop it from the cube."""
+        axis = self._axis(dim)
+        index = self._index[dim][str(value)]
+        dims = [d for d in self.dims if d != dim]
+        return CohortCube(dims, self.labels, np.take(self.counts, index, axis=axis), self.k, self.max_contribution)
+
+    def dice(self, **filters: Sequence[str]) -> "CohortCube":
+        """Restrict dimensions to subsets of their labels."""
+        counts = self.counts
+        labels = dict(self.labels)
+        for dim, values in filters.items():
+            axis = self._axis(dim)
+            if isinstance(values, str):
+                values = [values]
+            index = [self._index[dim][str(v)] for v in values if str(v) in self._index[dim]]
+            counts = np.take(counts, index, axis=axis)
+            labels[dim] = self.labels[dim][index]
+        return CohortCube(self.dims, labels, counts, self.k, self.max_contribution)
+
+    def rollup(self, dims: Sequence[str] = ()) -> "CohortCube":
+        """Aggregate away every dimension not listed in ``dims``."""
+        keep = [d for d in self.dims if d in dims]
+        for dim in dims:
+            self._axis(dim)
+        axes = tuple(i for i, d in enumerate(self.dims) if d not in keep)
+        return CohortCube(keep, self.labels, self.counts.sum(axis=axes), self.k, self.max_contribution)
+
+    def populations(self, filters: Dict[str, Sequence[str]], dims: Sequence[str], rows: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Non-empty cells of this cube that each row of a diced and rolled-up table covers.
+
+        Args:
+            filters: Dimension labels the table was diced to
+            dims: Dimensions the table was rolled up to
+            rows: Released rows (one column per dimension in ``dims``)
+
+        Returns:
+            Tuple of (boolean matrix with one row per table row and one column
+            per non-empty cell, patient count of each non-empty cell)
+        """
+        if self._cells is None:
+            cells = np.flatnonzero(self.counts)
+            self._cells = (cells, np.unravel_index(cells, self.counts.shape))
+        cells, coords = self._cells
+
+        covered = np.ones(len(cells), dtype=bool)
+        for dim, values in filters.items():
+            if isinstance(values, str):
+                values = [values]
+            index = [self._index[dim][str(v)] for v in values if str(v) in self._index[dim]]
+            covered &= np.isin(coords[self._axis(dim)], index)
+
+        masks = np.repeat(covered[None, :], len(rows), axis=0)
+        for dim in dims:
+            row_index = np.array([self._index[dim].get(str(v), -1) for v in rows[dim]], dtype=np.int64)
+            masks &= coords[self._axis(dim)][None, :] == row_index[:, None]
+        return masks, self.counts.ravel()[cells]
+
+    def to_frame(self, drop_empty: bool = True) -> pd.DataFrame:
+        """
+        Flatten the cube into a long table.
+
+        Args:
+            drop_empty: Drop zero-count cells
+
+        Returns:
+            DataFrame with one column per dimension plus ``count`` and ``suppressed``
+        """
+        if self.dims:
+            grid = pd.MultiIndex.from_product([self.labels[d] for d in self.dims], names=self.dims)
+            frame = grid.to_frame(index=False)
+        else:
+            frame = pd.DataFrame(index=[0])
+        frame["count"] = np.ravel(self.counts)
+        frame["suppressed"] = np.ravel(self.small_cells)
+        if drop_empty:
+            frame = frame[frame["count"] > 0].reset_index(drop=True)
+        return frame
+
+
+@lru_cache(maxsize=1)
+def load_default_cube() -> Optional[CohortCube]:
+    """Load the cube at ``settings.cube_path`` once per process, if it exists."""
+    path = Path(settings.cube_path)
+    if not path.exists():
+        return None
+    return CohortCube.load(path)
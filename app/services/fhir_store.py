@@ -0,0 +1,382 @@
+"""
+In-memory FHIR resource store with inverted search indexes.
+
+Resources are loaded once (from packed NDJSON shards when available,
+otherwise from the per-file ``<Type>/<id>.json`` tree), reloaded only after
+a conversion rewrites them, and kept as compact JSON bytes. Every supported search parameter has an inverted index from
+token to a sorted array of resource positions, so a search is a few
+dict probes plus array unions/intersections and never scans resources.
+Token parameters accept the ``:text`` and ``:in`` modifiers, which are
+resolved to ``system|code`` tokens through the terminology indexes.
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.utils.fhir_manifest import MANIFEST_FILE
+from app.utils.fhir_references import REFERENCES_FILE, ReferenceIndex
+from app.utils.ndjson_store import INDEX_SUFFIX, NDJSONStore, dumps
+from app.utils.terminology import Terminology, get_terminology
+
+
+class InvalidSearch(ValueError):
+    """Raised for unsupported search parameters or resource types."""
+
+
+def _gender(resource: Dict) -> List[str]:
+    gender = resource.get("gender")
+    return [gender] if gender else []
+
+
+def _subject(resource: Dict) -> List[str]:
+    reference = (resource.get("subject") or {}).get("reference")
+    return [reference] if reference else []
+
+
+def _code(resource: Dict) -> List[str]:
+    tokens = []
+    for coding in (resource.get("code") or {}).get("coding", []):
+        code = coding.get("code")
+        if code:
+            tokens.append(code)
+            if coding.get("system"):
+                tokens.append(f"{coding['system']}|{code}")
+    return tokens
+
+
+# 各資源類型支援的搜尋參數：名稱 -> (取出索引值的函式, 參考的目標類型)
+SEARCH_PARAMS: Dict[str, Dict[str, Tuple[Callable[[Dict], List[str]], Optional[str]]]] = {
+    "Patient": {"gender": (_gender, None)},
+    "Condition": {"subject": (_subject, "Patient"), "code": (_code, None)},
+    "Observation": {"subject": (_subject, "Patient"), "code": (_code, None)},
+}
+
+# token 參數支援的修飾詞（經由術語服務轉成 system|code）
+TOKEN_MODIFIERS = {"text", "in"}
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+def parse_instants(values: Sequence[Optional[str]]) -> np.ndarray:
+    """Parse FHIR instants to UTC ``datetime64``; times without an offset are taken as UTC."""
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format="ISO8601", errors="coerce")
+    return parsed.dt.tz_localize(None).to_numpy(dtype="datetime64[us]")
+
+
+class FHIRStore:
+    """
+    Read and search-type access over a fixed set of FHIR resources.
+
+    Later versions of a resource id replace earlier ones; indexes are
+    built once after loading.
+
+    Args:
+        resources: Resource dicts or ``(resource_type, id, JSON bytes)``
+        terminology: Resolves ``:text``/``:in`` searches (default: :func:`get_terminology`)
+        references: Reference index persisted by the converter (default: built from the resources)
+    """
+
+    def __init__(self, resources: Iterable[Union[Dict, Tuple[str, str, bytes]]] = (),
+                 terminology: Optional[Terminology] = None, references: Optional[ReferenceIndex] = None):
+        self.terminology = terminology or get_terminology()
+        pending: Dict[str, Dict[str, bytes]] = {}
+        for item in resources:
+            if isinstance(item, dict):
+                item = (item["resourceType"], item["id"], dumps(item))
+            resource_type, resource_id, raw = item
+            pending.setdefault(resource_type, {})[resource_id] = raw
+
+        self._raw: Dict[str, List[bytes]] = {}
+        self._ids: Dict[str, List[str]] = {}
+        self._positions: Dict[str, Dict[str, int]] = {}
+        self._indexes: Dict[str, Dict[str, Dict[str, np.ndarray]]] = {}
+        self._last_updated: Dict[str, np.ndarray] = {}
+        self.references = references or ReferenceIndex()
+        # 轉換時已寫出參照索引則直接沿用，不再逐一解析資源
+        record = None if references is not None else self.references
+        for resource_type, by_id in pending.items():
+            self._raw[resource_type] = list(by_id.values())
+            self._ids[resource_type] = list(by_id)
+            self._positions[resource_type] = {resource_id: i for i, resource_id in enumerate(by_id)}
+            self._indexes[resource_type], self._last_updated[resource_type] = self._build_indexes(
+                resource_type, self._raw[resource_type], record
+            )
+
+    @staticmethod
+    def _build_indexes(resource_type: str, raws: List[bytes],
+                       references: Optional[ReferenceIndex]) -> Tuple[Dict[str, Dict[str, np.ndarray]], np.ndarray]:
+        """Inverted indexes of the search parameters and ``meta.lastUpdated`` (UTC) per position; records references if given."""
+        params = SEARCH_PARAMS.get(resource_type, {})
+        postings: Dict[str, Dict[str, List[int]]] = {name: {} for name in params}
+        stamps = []
+        for position, raw in enumerate(raws):
+            resource = json.loads(raw)
+            stamps.append((resource.get("meta") or {}).get("lastUpdated"))
+            if references is not None:
+                references.add(resource)
+            for name, (extract, _) in params.items():
+                for token in extract(resource):
+                    postings[name].setdefault(token, []).append(position)
+        # 同一資源可能產生重複的索引值，np.unique 去重並排序
+        indexes = {
+            name: {token: np.unique(np.asarray(found, dtype=np.int32)) for token, found in tokens.items()}
+            for name, tokens in postings.items()
+        }
+        return indexes, parse_instants(stamps)
+
+    @classmethod
+    def from_ndjson(cls, path: Union[str, Path]) -> "FHIRStore":
+        """Load every resource type of a packed NDJSON store (and its reference index, if persisted)."""
+        with NDJSONStore(path) as store:
+            return cls(
+                ((resource_type, resource_id, raw)
+                 for resource_type in store.resource_types()
+                 for resource_id, raw in store.iter_raw(resource_type)),
+                references=cls._load_references(path),
+            )
+
+    @classmethod
+    def from_directory(cls, path: Union[str, Path]) -> "FHIRStore":
+        """Load a ``<Type>/<id>.json`` resource tree (and its reference index, if persisted)."""
+        def resources():
+            for type_dir in sorted(p for p in Path(path).iterdir() if p.is_dir()):
+                for file_path in sorted(type_dir.glob("*.json")):
+                    with open(file_path, encoding="utf-8") as f:
+                        yield json.load(f)
+        return cls(resources(), references=cls._load_references(path))
+
+    @staticmethod
+    def _load_references(path: Union[str, Path]) -> Optional[ReferenceIndex]:
+        references_path = Path(path) / REFERENCES_FILE
+        return ReferenceIndex.load(references_path) if references_path.exists() else None
+
+    @property
+    def resource_types(self) -> List[str]:
+        return list(self._raw)
+
+    def count(self, resource_type: str) -> int:
+        return len(self._raw.get(resource_type, ()))
+
+    def read(self, resource_type: str, resource_id: str) -> Optional[bytes]:
+        """Stored JSON bytes of one resource, or None if absent."""
+        position = self._positions.get(resource_type, {}).get(resource_id)
+        return None if position is None else self._raw[resource_type][position]
+
+    def _tokens(self, modifier: str, value: str) -> List[str]:
+        """``system|code`` tokens of a ``:text`` (display or designation) or ``:in`` (ValueSet url) value."""
+        if modifier == "text":
+            return self.terminology.text_tokens(value)
+        if value not in self.terminology.value_sets:
+            raise InvalidSearch(f"Unknown ValueSet: {value}")
+        return self.terminology.tokens(value)
+
+    def _match(self, resource_type: str, name: str, values: str) -> np.ndarray:
+        """Positions matching any of the comma-separated values of one parameter."""
+        if name == "_id":
+            positions = self._positions.get(resource_type, {})
+            found = [positions[v] for v in values.split(",") if v in positions]
+            return np.unique(np.asarray(found, dtype=np.int32))
+
+        name, _, modifier = name.partition(":")
+        _, target = SEARCH_PARAMS[resource_type][name]
+        index = self._indexes[resource_type].get(name, {})
+        matches = []
+        for value in values.split(","):
+            value = value.strip()
+            if modifier:
+                matches.extend(index.get(token, _EMPTY) for token in self._tokens(modifier, value))
+                continue
+            if target and "/" not in value:
+                value = f"{target}/{value}"
+            elif value.startswith("|"):
+                value = value[1:]
+            matches.append(index.get(value, _EMPTY))
+        if not matches:
+            return _EMPTY
+        return matches[0] if len(matches) == 1 else np.unique(np.concatenate(matches))
+
+    def search(self, resource_type: str, params: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """
+        Positions of the resources matching every search parameter.
+
+        Args:
+            resource_type: FHIR resource type
+            params: ``(name, value)`` pairs; a comma inside a value means OR,
+                repeated or different parameters mean AND
+
+        Returns:
+            Sorted array of resource positions
+        """
+        if resource_type not in SEARCH_PARAMS and resource_type not in self._raw:
+            raise InvalidSearch(f"Unsupported resource type: {resource_type}")
+        supported = SEARCH_PARAMS.get(resource_type, {})
+        for name, _ in params:
+            base, _, modifier = name.partition(":")
+            if name != "_id" and base not in supported:
+                raise InvalidSearch(f"Unsupported search parameter for {resource_type}: {name}")
+            if modifier and (modifier not in TOKEN_MODIFIERS or supported[base][1] is not None):
+                raise InvalidSearch(f"Unsupported modifier for {resource_type}.{base}: {modifier}")
+
+        result = None
+        for name, value in params:
+            matched = self._match(resource_type, name, value)
+            result = matched if result is None else np.intersect1d(result, matched, assume_unique=True)
+            if not len(result):
+                break
+        if result is None:
+            return np.arange(self.count(resource_type), dtype=np.int32)
+        return result
+
+    def changed_since(self, resource_type: str, since: Optional[np.datetime64]) -> np.ndarray:
+        """
+        Positions of resources updated after ``since`` (all positions if None).
+
+        Resources without a parseable ``meta.lastUpdated`` are always included.
+        """
+        stamps = self._last_updated.get(resource_type)
+        if stamps is None:
+            return _EMPTY
+        if since is None:
+            return np.arange(len(stamps), dtype=np.int32)
+        return np.flatnonzero(np.isnat(stamps) | (stamps > since)).astype(np.int32)
+
+    def compartment(self, resource_type: str, compartment: str = "Patient") -> np.ndarray:
+        """Positions of resources in any ``compartment`` (the compartment resources themselves, or those whose subject references one)."""
+        if resource_type == compartment:
+            return np.arange(self.count(resource_type), dtype=np.int32)
+        subjects = self._indexes.get(resource_type, {}).get("subject", {})
+        found = [positions for reference, positions in subjects.items() if reference.startswith(f"{compartment}/")]
+        return np.unique(np.concatenate(found)) if found else _EMPTY
+
+    def everything(self, resource_type: str, resource_id: str) -> List[Tuple[str, str, bytes]]:
+        """
+        The resource and every resource that references it, via the reverse-reference index.
+
+        Returns:
+            ``(resource_type, id, JSON bytes)`` with the focal resource first; empty if it does not exist
+        """
+        raw = self.read(resource_type, resource_id)
+        if raw is None:
+            return []
+        found = [(resource_type, resource_id, raw)]
+        for key in self.references.referencing(f"{resource_type}/{resource_id}"):
+            source_type, source_id = key.split("/", 1)
+            source_raw = self.read(source_type, source_id)
+            if source_raw is not None:
+                found.append((source_type, source_id, source_raw))
+        return found
+
+    def included(self, resource_type: str, positions: Sequence[int], include: str) -> List[Tuple[str, str, bytes]]:
+        """
+        Resources referenced by the given ones through a search parameter (``_include``).
+
+        Args:
+            include: ``<SourceType>:<param>[:<TargetType>]``, e.g. ``Observation:subject``
+        """
+        source_type, name, target = self._include_spec(include)
+        if source_type != resource_type:
+            return []
+        extract, _ = SEARCH_PARAMS[source_type][name]
+        found, seen = [], set()
+        for resource_id, raw in self.entries(resource_type, positions):
+            for reference in extract(json.loads(raw)):
+                target_type, _, target_id = reference.partition("/")
+                if reference in seen or (target and target_type != target):
+                    continue
+                seen.add(reference)
+                target_raw = self.read(target_type, target_id)
+                if target_raw is not None:
+                    found.append((target_type, target_id, target_raw))
+        return found
+
+    def revincluded(self, resource_type: str, positions: Sequence[int], revinclude: str) -> List[Tuple[str, str, bytes]]:
+        """
+        Resources that reference the given ones through a search parameter (``_revinclude``).
+
+        Args:
+            revinclude: ``<SourceType>:<param>[:<TargetType>]``, e.g. ``Observation:subject``
+        """
+        source_type, name, target = self._include_spec(revinclude)
+        if target and target != resource_type:
+            return []
+        index = self._indexes.get(source_type, {}).get(name, {})
+        ids = self._ids.get(resource_type, [])
+        matched = [index[f"{resource_type}/{ids[i]}"] for i in positions if f"{resource_type}/{ids[i]}" in index]
+        if not matched:
+            return []
+        return [(source_type, source_id, raw) for source_id, raw in self.entries(source_type, np.unique(np.concatenate(matched)))]
+
+    def _include_spec(self, spec: str) -> Tuple[str, str, Optional[str]]:
+        parts = spec.split(":")
+        if len(parts) not in (2, 3) or parts[1] not in SEARCH_PARAMS.get(parts[0], {}):
+            raise InvalidSearch(f"Unsupported include: {spec}")
+        if SEARCH_PARAMS[parts[0]][parts[1]][1] is None:
+            raise InvalidSearch(f"{parts[0]}:{parts[1]} is not a reference parameter")
+        return parts[0], parts[1], parts[2] if len(parts) == 3 else None
+
+    def entries(self, resource_type: str, positions: Iterable[int]) -> List[Tuple[str, bytes]]:
+        """``(id, JSON bytes)`` of the resources at the given positions."""
+        ids, raws = self._ids.get(resource_type, []), self._raw.get(resource_type, [])
+        return [(ids[i], raws[i]) for i in positions]
+
+
+def _signature(paths: Iterable[Path]) -> Tuple[Tuple[str, int, int], ...]:
+    """``(path, mtime_ns, size)`` of the existing paths a loaded store depends on."""
+    signature = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _store_source() -> Tuple[Optional[str], Tuple]:
+    """Where the store would be loaded from, and the signature that changes when a conversion rewrites it."""
+    ndjson_dir = Path(settings.fhir_ndjson_dir)
+    indexes = sorted(ndjson_dir.glob(f"*{INDEX_SUFFIX}")) if ndjson_dir.exists() else []
+    if indexes:
+        return "ndjson", _signature(indexes + [ndjson_dir / MANIFEST_FILE, ndjson_dir / REFERENCES_FILE])
+    resource_dir = Path(settings.fhir_resource_dir)
+    if resource_dir.exists():
+        # 逐檔輸出以改名寫入，資料夾的 mtime 會隨之變更
+        type_dirs = sorted(p for p in resource_dir.iterdir() if p.is_dir())
+        return "directory", _signature([resource_dir / MANIFEST_FILE, resource_dir / REFERENCES_FILE] + type_dirs)
+    return None, ()
+
+
+_store_lock = threading.Lock()
+_store_cache: Dict[str, object] = {}
+
+
+def get_fhir_store() -> FHIRStore:
+    """
+    The converted resources (NDJSON shards preferred).
+
+    The store is loaded once and reloaded when the NDJSON indexes, resource
+    directories or manifest change, so a rerun of the converter is served
+    (and exported with ``_since``) without restarting the server.
+    """
+    source, signature = _store_source()
+    with _store_lock:
+        if _store_cache.get("signature") != (source, signature):
+            if source == "ndjson":
+                store = FHIRStore.from_ndjson(settings.fhir_ndjson_dir)
+            elif source == "directory":
+                store = FHIRStore.from_directory(settings.fhir_resource_dir)
+            else:
+                store = FHIRStore()
+            _store_cache.update(signature=(source, signature), store=store)
+        return _store_cache["store"]
+
+
+def reload_fhir_store() -> FHIRStore:
+    """Drop the loaded store and load the resources again."""
+    with _store_lock:
+        _store_cache.clear()
+    return get_fhir_store()
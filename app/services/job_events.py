@@ -0,0 +1,188 @@
+"""
+Fan-out hub for job progress events (status transitions, log lines, artifacts).
+
+Every job has one append-only, bounded event log. Publishing appends an
+event once and wakes the waiting subscribers; each subscriber only keeps
+the id of the last event it has seen and reads new events from the shared
+log, so a publish costs O(1) per subscriber and nothing is copied into
+per-subscriber queues. Event ids increase per job and double as SSE ids,
+so a reconnecting client resumes with ``Last-Event-ID``.
+
+Both the threaded Flask server (:meth:`JobEventHub.wait`) and the asyncio
+FastAPI app (:meth:`JobEventHub.wait_async`) can wait on the same hub; the
+same waits back the ``wait=`` long-poll of the job result endpoints, which
+also answer ``If-None-Match`` with 304 via :func:`job_etag`.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+# 代表工作結束的狀態；送出後事件串流即關閉
+TERMINAL_STATUSES = {"completed", "failed", "success", "error"}
+
+
+class JobEvent:
+    """One event of a job's stream."""
+
+    __slots__ = ("id", "event", "data", "time")
+
+    def __init__(self, id: int, event: str, data: Dict[str, Any]):
+        self.id = id
+        self.event = event
+        self.data = data
+        self.time = time.time()
+
+    def to_sse(self) -> str:
+        """Server-Sent Events wire format."""
+        return f"id: {self.id}\nevent: {self.event}\ndata: {json.dumps(self.data, ensure_ascii=False, default=str)}\n\n"
+
+
+class _Channel:
+    def __init__(self, history: int):
+        self.events: deque = deque(maxlen=history)
+        self.next_id = 1
+        self.closed = False
+        self.condition = threading.Condition()
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class JobEventHub:
+    """
+    Per-job event logs with thread- and asyncio-safe waiting.
+
+    Args:
+        history: Events kept per job (older ones cannot be replayed)
+    """
+
+    def __init__(self, history: Optional[int] = None):
+        self.history = history or settings.job_event_history
+        self._channels: Dict[str, _Channel] = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, job_id: str, create: bool = False) -> Optional[_Channel]:
+        with self._lock:
+            channel = self._channels.get(job_id)
+            if channel is None and create:
+                channel = self._channels[job_id] = _Channel(self.history)
+            return channel
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> JobEvent:
+        """
+        Append an event and wake every subscriber of the job.
+
+        A ``status`` event with a terminal status closes the stream.
+        """
+        channel = self._channel(job_id, create=True)
+        with channel.condition:
+            item = JobEvent(channel.next_id, event, data)
+            channel.next_id += 1
+            channel.events.append(item)
+            if event == "status" and data.get("status") in TERMINAL_STATUSES:
+                channel.closed = True
+            channel.condition.notify_all()
+            waiters, channel.async_waiters = channel.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return item
+
+    def exists(self, job_id: str) -> bool:
+        return self._channel(job_id) is not None
+
+    def is_closed(self, job_id: str) -> bool:
+        channel = self._channel(job_id)
+        return channel is not None and channel.closed
+
+    def last_id(self, job_id: str) -> int:
+        """Id of the job's latest event (0 if none)."""
+        channel = self._channel(job_id)
+        return 0 if channel is None else channel.next_id - 1
+
+    @staticmethod
+    def _after(channel: _Channel, last_id: int) -> List[JobEvent]:
+        # 事件 id 連續遞增，可直接由 id 算出在環狀緩衝區中的位置
+        if not channel.events or last_id >= channel.events[-1].id:
+            return []
+        start = max(last_id + 1 - channel.events[0].id, 0)
+        return [channel.events[i] for i in range(start, len(channel.events))]
+
+    def events_after(self, job_id: str, last_id: int = 0) -> List[JobEvent]:
+        """Retained events with an id greater than ``last_id``."""
+        channel = self._channel(job_id)
+        if channel is None:
+            return []
+        with channel.condition:
+            return self._after(channel, last_id)
+
+    def wait(self, job_id: str, last_id: int, timeout: float) -> List[JobEvent]:
+        """Block until there are events after ``last_id``, the stream closes or ``timeout`` expires."""
+        channel = self._channel(job_id, create=True)
+        with channel.condition:
+            channel.condition.wait_for(lambda: channel.closed or self._after(channel, last_id), timeout)
+            return self._after(channel, last_id)
+
+    async def wait_async(self, job_id: str, last_id: int, timeout: float) -> List[JobEvent]:
+        """Asyncio counterpart of :meth:`wait` (does not block the event loop)."""
+        channel = self._channel(job_id, create=True)
+        loop = asyncio.get_running_loop()
+        with channel.condition:
+            events = self._after(channel, last_id)
+            if events or channel.closed:
+                return events
+            future = loop.create_future()
+            channel.async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with channel.condition:
+                if (loop, future) in channel.async_waiters:
+                    channel.async_waiters.remove((loop, future))
+        return self.events_after(job_id, last_id)
+
+    def discard(self, job_id: str):
+        """Drop a job's events (e.g. when the job is deleted)."""
+        with self._lock:
+            channel = self._channels.pop(job_id, None)
+        if channel is not None:
+            with channel.condition:
+                channel.closed = True
+                channel.condition.notify_all()
+                waiters, channel.async_waiters = channel.async_waiters, []
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_wake, future)
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """``Last-Event-ID`` header (or query parameter) as an int; 0 when missing or invalid."""
+    try:
+        return max(int(value), 0) if value else 0
+    except ValueError:
+        return 0
+
+
+def job_etag(body: bytes) -> str:
+    """Strong ETag of a serialized job state."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag`` (``*``, lists and weak tags supported)."""
+    if not if_none_match:
+        return False
+    # If-None-Match 採弱比較：忽略 W/ 前綴
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+# 全域事件中心（Flask 與 FastAPI 服務共用同一實作）
+job_events = JobEventHub()
@@ -3,12 +3,18 @@ Job management service for handling analysis requests.
 """
 
 import uuid
+import time
 import hashlib
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, Any, Optional
-from app.models.schemas import JobStatus, JobResult, AuditLog
+from app.models.schemas import JobStatus, JobResult, AuditLog, OutputType, PrivacyLevel
 from app.services.claude_code_server import ClaudeCodeServer
+from app.services.job_events import job_events
+from app.services.privacy_budget import privacy_budget
+from app.services.question_router import question_router
 from app.services.sandbox_service import SandboxService
+from app.utils.privacy import sanitize_artifacts
 from app.core.config import settings
 
 class JobService:
@@ -20,7 +26,8 @@ class JobService:
         # self.sandbox_service = SandboxService()
         self.jobs: Dict[str, JobResult] = {}
     
-    def create_job(self, question: str, dataset_id: str, outputs: list, privacy_level: str) -> str:
+    def create_job(self, question: str, dataset_id: str, outputs: list, privacy_level: str,
+                   user_id: str = "anonymous", epsilon: Optional[float] = None) -> str:
         """
         Create a new analysis job.
         
@@ -29,12 +36,27 @@ class JobService:
             dataset_id: Dataset identifier
             outputs: Desired output types
             privacy_level: Privacy protection level
+            user_id: User identifier for privacy budget accounting
+            epsilon: Privacy budget to spend (differential_privacy only)
             
         Returns:
             Job ID
+            
+        Raises:
+            ValueError: If a non-public question cannot be answered from aggregates
+            PrivacyBudgetExceeded: If the user's remaining budget is too small
         """
         job_id = str(uuid.uuid4())
         
+        if privacy_level != PrivacyLevel.PUBLIC:
+            # Only cube answers can be audited against differencing (or noised); the LLM path cannot
+            if not question_router.is_answerable(question_router.parse(question), outputs):
+                raise ValueError(f"{PrivacyLevel(privacy_level).value} level only supports questions answerable from pre-computed aggregates")
+        if privacy_level == PrivacyLevel.DIFFERENTIAL_PRIVACY:
+            # Noisy answers are only served from pre-computed histograms; charge before running
+            epsilon = epsilon or settings.dp_epsilon
+            privacy_budget.charge(user_id, epsilon, job_id)
+        
         # Create job record
         job = JobResult(
             job_id=job_id,
@@ -47,9 +69,10 @@ class JobService:
         )
         
         self.jobs[job_id] = job
+        self._publish_status(job_id)
         
         # Process job asynchronously
-        self._process_job(job_id, question, outputs, privacy_level)
+        self._process_job(job_id, question, outputs, privacy_level, epsilon, user_id)
         
         return job_id
     
@@ -65,13 +88,39 @@ class JobService:
         """
         return self.jobs.get(job_id)
     
-    def _process_job(self, job_id: str, question: str, outputs: list, privacy_level: str):
+    def _publish_status(self, job_id: str):
+        """Publish the job's current status (and error, if any) to its event stream."""
+        job = self.jobs[job_id]
+        data = {"status": job.status.value}
+        if job.error:
+            data["error"] = job.error
+        job_events.publish(job_id, "status", data)
+    
+    def _log(self, job_id: str, message: str):
+        """Publish a log line to the job's event stream."""
+        job_events.publish(job_id, "log", {"message": message, "time": datetime.utcnow().isoformat()})
+    
+    def _process_job(self, job_id: str, question: str, outputs: list, privacy_level: str, epsilon: Optional[float] = None,
+                     user_id: str = "anonymous"):
         """Process job asynchronously."""
         try:
             # Update status
             self.jobs[job_id].status = JobStatus.PROCESSING
+            self._publish_status(job_id)
+            started = time.perf_counter()
+            
+            # Fast path: answer directly from the cohort cube when possible
+            artifacts_dir = Path(settings.artifact_dir) / job_id
+            fast_result = question_router.answer(question, outputs, privacy_level, artifacts_dir, epsilon, user_id, job_id)
+            if fast_result is not None:
+                self._log(job_id, "Answered from the cohort cube")
+                self._complete_job(job_id, question, fast_result['code_hash'], privacy_level, fast_result['artifacts'])
+                return
+            if privacy_level != PrivacyLevel.PUBLIC:
+                raise ValueError(f"{PrivacyLevel(privacy_level).value} level only supports questions answerable from pre-computed aggregates")
             
             # Generate code using Claude Code Server
+            self._log(job_id, "Generating analysis code")
             code_result = self.claude_code_server.generate_code(question, outputs, privacy_level)
             code = code_result['code']
             code_hash = code_result['code_hash']
@@ -80,7 +129,10 @@ class JobService:
             self.jobs[job_id].code_hash = code_hash
             
             # 暫時模擬 sandbox 執行結果
-            # result = self.sandbox_service.execute_code(code, job_id)
+            # if code_result.get('language') == 'sql':
+            #     result = self.sandbox_service.execute_sql(code_result['sql'], code_result.get('chart'), job_id)
+            # else:
+            #     result = self.sandbox_service.execute_code(code, job_id)
             
             # 模擬成功執行
             mock_artifacts = []
@@ -93,23 +145,39 @@ class JobService:
             if OutputType.EXPLANATION in outputs:
                 mock_artifacts.append("explanation.txt")
             
-            # Update job with results
-            self.jobs[job_id].status = JobStatus.COMPLETED
-            self.jobs[job_id].artifacts = mock_artifacts
-            self.jobs[job_id].completed_at = datetime.utcnow()
-            
-            # Generate output hash
-            output_hash = self._generate_output_hash(mock_artifacts)
-            self.jobs[job_id].output_hash = output_hash
-            
-            # Create audit log
-            self._create_audit_log(job_id, question, code_hash, privacy_level, output_hash)
+            question_router.record_fallback(time.perf_counter() - started)
+            self._complete_job(job_id, question, code_hash, privacy_level, mock_artifacts)
                 
         except Exception as e:
             # Update job with error
             self.jobs[job_id].status = JobStatus.FAILED
             self.jobs[job_id].error = str(e)
             self.jobs[job_id].completed_at = datetime.utcnow()
+            self._publish_status(job_id)
+    
+    def _complete_job(self, job_id: str, question: str, code_hash: str, privacy_level: str, artifacts: list):
+        """Protect tabular artifacts, mark job as completed and write the audit log."""
+        # Mandatory small-cell suppression, regardless of what the generated code did
+        suppression = sanitize_artifacts(Path(settings.artifact_dir) / job_id, privacy_level)
+        if any(report.get("primary") or report.get("removed") or report.get("diversity") for report in suppression.values()):
+            print(f"Small-cell suppression for job {job_id}: {suppression}")
+        
+        self.jobs[job_id].code_hash = code_hash
+        self.jobs[job_id].artifacts = artifacts
+        for name in artifacts:
+            job_events.publish(job_id, "artifact", {"name": name, "url": f"/api/v1/files/{job_id}/{name}"})
+        
+        # Generate output hash
+        output_hash = self._generate_output_hash(artifacts)
+        self.jobs[job_id].output_hash = output_hash
+        
+        # Create audit log
+        self._create_audit_log(job_id, question, code_hash, privacy_level, output_hash)
+        
+        # 完成狀態最後送出，訂閱者收到時所有產出與雜湊都已就緒
+        self.jobs[job_id].status = JobStatus.COMPLETED
+        self.jobs[job_id].completed_at = datetime.utcnow()
+        self._publish_status(job_id)
     
     def _generate_output_hash(self, artifacts: list) -> str:
         """Generate hash for output artifacts."""
@@ -136,3 +204,8 @@ class JobService:
         if job_id in self.jobs:
             self.sandbox_service.cleanup_artifacts(job_id)
             del self.jobs[job_id]
+            job_events.discard(job_id)
+
+
+# Global service instance shared by all requests (jobs and their events live in memory)
+job_service = JobService()
@@ -0,0 +1,107 @@
+"""
+Persistent per-user differential-privacy budget ledger.
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Union
+from app.core.config import settings
+
+
+class PrivacyBudgetExceeded(Exception):
+    """Raised when a charge would take a user over their epsilon budget."""
+
+
+class PrivacyBudgetLedger:
+    """
+    Epsilon spending per user, stored in SQLite.
+
+    :meth:`charge` checks the remaining budget and records the spend in one
+    ``BEGIN IMMEDIATE`` transaction, so concurrent jobs (threads or worker
+    processes sharing the file) can never overspend.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, budget: Optional[float] = None):
+        self.path = Path(path or settings.privacy_budget_path)
+        self.budget = settings.dp_user_budget if budget is None else budget
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS ledger ("
+                "user_id TEXT NOT NULL, job_id TEXT, epsilon REAL NOT NULL, created_at TEXT NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS ledger_user ON ledger (user_id)")
+            self._initialized = True
+        return con
+
+    def spent(self, user_id: str) -> float:
+        """Total epsilon spent by a user."""
+        con = self._connect()
+        try:
+            row = con.execute("SELECT COALESCE(SUM(epsilon), 0) FROM ledger WHERE user_id = ?", (user_id,)).fetchone()
+            return float(row[0])
+        finally:
+            con.close()
+
+    def remaining(self, user_id: str) -> float:
+        """Epsilon a user can still spend."""
+        return max(self.budget - self.spent(user_id), 0.0)
+
+    def charge(self, user_id: str, epsilon: float, job_id: Optional[str] = None) -> float:
+        """
+        Atomically check and record a spend.
+
+        Args:
+            user_id: User identifier
+            epsilon: Budget to spend
+            job_id: Job the spend is for (recorded for auditing)
+
+        Returns:
+            Remaining budget after the charge
+
+        Raises:
+            PrivacyBudgetExceeded: If the charge does not fit in the remaining budget
+        """
+        if epsilon <= 0:
+            raise ValueError("epsilon must be positive")
+        with self._lock:
+            con = self._connect()
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                row = con.execute("SELECT COALESCE(SUM(epsilon), 0) FROM ledger WHERE user_id = ?", (user_id,)).fetchone()
+                spent = float(row[0])
+                if spent + epsilon > self.budget + 1e-9:
+                    con.execute("ROLLBACK")
+                    raise PrivacyBudgetExceeded(
+                        f"Privacy budget exhausted for user {user_id}: spent {spent:.3f} of {self.budget:.3f}, requested {epsilon:.3f}"
+                    )
+                con.execute(
+                    "INSERT INTO ledger (user_id, job_id, epsilon, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, job_id, epsilon, datetime.utcnow().isoformat())
+                )
+                con.execute("COMMIT")
+                return self.budget - spent - epsilon
+            finally:
+                con.close()
+
+    def summary(self, user_id: str) -> Dict[str, float]:
+        """Budget, spend and remaining epsilon for a user."""
+        spent = self.spent(user_id)
+        return {
+            'user_id': user_id,
+            'budget': self.budget,
+            'spent': spent,
+            'remaining': max(self.budget - spent, 0.0)
+        }
+
+
+# Global ledger instance (the SQLite file is opened on first use)
+privacy_budget = PrivacyBudgetLedger()
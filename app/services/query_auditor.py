@@ -0,0 +1,183 @@
+"""
+Per-user query auditing against differencing attacks.
+
+Every released aggregate covers a population of cohort-cube cells. The
+auditor keeps, per user, the populations already released as packed
+bitsets over the cube's non-empty cells, and flags a new aggregate whose
+population differs from an earlier one by fewer than k (but more than
+zero) patients: subtracting the two answers would reveal that small group.
+Noisy answers to flagged populations are stored too and replayed on later
+queries, so asking again cannot average the noise away.
+"""
+
+import threading
+from typing import Dict, Optional
+import numpy as np
+from app.core.config import settings
+
+AUDIT_ACTIONS = ("reject", "noise")
+
+
+class QueryRejected(Exception):
+    """Raised when a query could be differenced against a user's earlier answers."""
+
+
+class _History:
+    """Released populations of one user, as rows of a growable packed bit matrix."""
+
+    def __init__(self, n_cells: int, universe: tuple):
+        self.universe = universe
+        self.n_cells = n_cells
+        self.bits = np.zeros((16, (n_cells + 7) // 8), dtype=np.uint8)
+        self.sizes = np.zeros(16, dtype=np.float64)
+        self.count = 0
+        self.queries = 0
+        self.noisy: Dict[bytes, float] = {}
+
+    def append(self, masks: np.ndarray, sizes: np.ndarray):
+        needed = self.count + len(masks)
+        if needed > len(self.bits):
+            capacity = max(needed, 2 * len(self.bits))
+            self.bits = np.resize(self.bits, (capacity, self.bits.shape[1]))
+            self.sizes = np.resize(self.sizes, capacity)
+        self.bits[self.count:needed] = np.packbits(masks, axis=1)
+        self.sizes[self.count:needed] = sizes
+        self.count = needed
+
+
+class QueryAuditor:
+    """
+    Pairwise differencing audit over each user's released populations.
+
+    Candidate pairs are found from population sizes alone and only those
+    are compared bit by bit, so a check stays in the millisecond range
+    after thousands of earlier answers.
+    """
+
+    def __init__(self, k: Optional[int] = None, action: Optional[str] = None):
+        self.k = settings.k_anonymity if k is None else k
+        self.action = action or settings.query_audit_action
+        if self.action not in AUDIT_ACTIONS:
+            raise ValueError(f"Unknown audit action: {self.action}")
+        self._users: Dict[str, _History] = {}
+        self._lock = threading.Lock()
+
+    def _history(self, user_id: str, weights: np.ndarray) -> _History:
+        # 立方體重建後儲存格編號不再相同，舊紀錄無法比較
+        universe = (len(weights), int(weights.sum()))
+        history = self._users.get(user_id)
+        if history is None or history.universe != universe:
+            history = self._users[user_id] = _History(len(weights), universe)
+        return history
+
+    def _differences(self, history: _History, masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Symmetric-difference sizes between earlier populations and new ones.
+
+        Two populations whose sizes differ by k or more cannot have a
+        symmetric difference below k, so only the pairs passing that size
+        test are compared exactly (XOR of their bitsets, weighted by the cell
+        counts). Other pairs are reported as ``inf``.
+        """
+        sizes = history.sizes[:history.count]
+        new_sizes = masks @ weights
+        diff = np.full((history.count, len(masks)), np.inf)
+        prior_index, new_index = np.nonzero(np.abs(sizes[:, None] - new_sizes[None, :]) < self.k)
+        if len(prior_index):
+            packed = np.packbits(masks, axis=1)
+            xor = np.unpackbits(history.bits[prior_index] ^ packed[new_index], axis=1, count=history.n_cells)
+            diff[prior_index, new_index] = xor @ weights
+        return diff
+
+    def _flags(self, diff: np.ndarray) -> np.ndarray:
+        return ((diff > 0.5) & (diff < self.k - 0.5)).any(axis=0)
+
+    def audit(self, user_id: str, masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Flag new populations that differ from an earlier one by fewer than k patients.
+
+        Args:
+            user_id: User identifier
+            masks: Boolean matrix, one row per released aggregate, one column per cube cell
+            weights: Patient count of each cube cell
+
+        Returns:
+            Boolean flag per row of ``masks``
+        """
+        masks = np.asarray(masks, dtype=bool)
+        weights = np.asarray(weights, dtype=np.float64)
+        with self._lock:
+            return self._flags(self._differences(self._history(user_id, weights), masks, weights))
+
+    def review(self, user_id: str, masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Audit a query and record the populations that will be released exactly.
+
+        With the ``reject`` action nothing is recorded and :class:`QueryRejected`
+        is raised if any row is flagged. With ``noise`` the flagged rows are
+        returned for the caller to perturb and only the others are recorded.
+
+        Returns:
+            Boolean flag per row of ``masks``
+        """
+        masks = np.asarray(masks, dtype=bool)
+        weights = np.asarray(weights, dtype=np.float64)
+        with self._lock:
+            history = self._history(user_id, weights)
+            diff = self._differences(history, masks, weights)
+            flags = self._flags(diff)
+            if flags.any() and self.action == "reject":
+                raise QueryRejected(
+                    f"Query rejected for user {user_id}: its answer differs from an earlier one by fewer than {self.k} patients"
+                )
+
+            # 與先前完全相同的族群不必重複儲存
+            new = ~flags & ~(np.abs(diff) < 0.5).any(axis=0)
+            if new.any():
+                history.append(masks[new], masks[new] @ weights)
+            history.queries += 1
+        return flags
+
+    def noisy_answers(self, user_id: str, masks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Noisy answers already released to a user for these populations.
+
+        Returns:
+            Stored answer per row of ``masks`` (NaN where none was released)
+        """
+        masks = np.asarray(masks, dtype=bool)
+        with self._lock:
+            history = self._history(user_id, np.asarray(weights, dtype=np.float64))
+            return np.array([history.noisy.get(key, np.nan) for key in self._keys(masks)], dtype=np.float64)
+
+    def record_noisy_answers(self, user_id: str, masks: np.ndarray, weights: np.ndarray, answers: np.ndarray) -> np.ndarray:
+        """
+        Store noisy answers for replay; an answer stored meanwhile is kept.
+
+        Returns:
+            The answers to release, one per row of ``masks``
+        """
+        masks = np.asarray(masks, dtype=bool)
+        with self._lock:
+            history = self._history(user_id, np.asarray(weights, dtype=np.float64))
+            return np.array([
+                history.noisy.setdefault(key, float(answer)) for key, answer in zip(self._keys(masks), answers)
+            ], dtype=np.float64)
+
+    @staticmethod
+    def _keys(masks: np.ndarray) -> list:
+        return [row.tobytes() for row in np.packbits(masks, axis=1)]
+
+    def summary(self, user_id: str) -> Dict[str, int]:
+        """Number of audited queries and stored populations for a user."""
+        with self._lock:
+            history = self._users.get(user_id)
+            return {
+                'user_id': user_id,
+                'queries': history.queries if history else 0,
+                'populations': history.count if history else 0
+            }
+
+
+# Global auditor instance
+query_auditor = QueryAuditor()
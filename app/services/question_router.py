@@ -0,0 +1,368 @@
+"""
+Fast-path question router.
+
+Parses questions into a structured intent and answers the ones covered by the
+pre-aggregated cohort cube directly in-process, without code generation or
+the sandbox. Everything else falls through to the LLM path.
+"""
+
+import re
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.models.schemas import OutputType, PrivacyLevel, QueryIntent
+from app.services.cohort_cube import CohortCube, UNKNOWN, load_default_cube
+from app.services.privacy_budget import privacy_budget
+from app.services.query_auditor import query_auditor
+from app.utils.differential_privacy import add_noise, noisy_counts
+from app.utils.privacy import enforce_table_diversity
+
+# 維度關鍵字
+DIMENSION_KEYWORDS: Dict[str, List[str]] = {
+    "intake_year": ["歷年", "年度", "每年", "年份", "收案年", "趨勢", "yearly", "year"],
+    "age_group": ["年齡", "年紀", "歲", "age"],
+    "gender": ["性別", "男女", "gender", "sex"],
+    "severity": ["失智程度", "嚴重度", "嚴重程度", "CDR", "severity"],
+    "apoe": ["APOE"],
+    "diagnosis": ["診斷", "失智類型", "失智症類型", "亞型", "diagnosis"],
+}
+
+# 圖表類型關鍵字（依優先順序，沿用原本預設程式碼的分類順序）
+CHART_KEYWORDS = [
+    ("line", ["折線圖", "趨勢", "line", "trend"]),
+    ("bar", ["分布", "統計", "長條圖", "直方圖", "bar", "distribution"]),
+    ("grouped_bar", ["比較", "對比", "compare", "comparison"]),
+    ("pie", ["圓餅圖", "pie"]),
+]
+
+MEASURE_KEYWORDS = [
+    ("percentage", ["比例", "百分比", "佔", "%", "percentage", "ratio", "proportion"]),
+    ("count", ["人數", "數量", "多少", "幾位", "分布", "統計", "count", "number"]),
+]
+
+# 立方體無法回答的分析需求
+UNSUPPORTED_KEYWORDS = [
+    "平均", "中位數", "標準差", "相關", "迴歸", "回歸", "預測", "分數", "MMSE", "CASI",
+    "存活", "教育", "醫師", "檢查", "average", "mean", "median", "correlation", "regression", "predict",
+]
+
+FAST_PATH_OUTPUTS = {OutputType.PLOT, OutputType.TABLE, OutputType.EXPLANATION}
+
+
+def _find_keywords(question: str, keywords: List[str]) -> List[str]:
+    lowered = question.lower()
+    found = []
+    for kw in keywords:
+        if kw.isascii() and kw.isalpha():
+            # 英文關鍵字需完整單字比對，避免 "percentage" 命中 "age"
+            if re.search(rf"\b{kw.lower()}s?\b", lowered):
+                found.append(kw)
+        elif kw.lower() in lowered:
+            found.append(kw)
+    return found
+
+
+def _group_dims(intent: QueryIntent) -> List[str]:
+    """Dimensions to group by; fall back to filtered dimensions for plain counts."""
+    return list(intent.dimensions) or list(intent.filters)
+
+
+class QuestionRouter:
+    """Route questions to the cohort cube fast path or the LLM path."""
+
+    def __init__(self, cube: Optional[CohortCube] = None, threshold: Optional[float] = None):
+        self._cube = cube
+        self.threshold = settings.router_confidence_threshold if threshold is None else threshold
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fast_path_seconds = 0.0
+        self.fallback_seconds = 0.0
+
+    @property
+    def cube(self) -> Optional[CohortCube]:
+        if self._cube is None:
+            self._cube = load_default_cube()
+        return self._cube
+
+    def parse(self, question: str) -> QueryIntent:
+        """
+        Parse a question into a structured intent.
+
+        Args:
+            question: User question (e.g. "歷年病患分布")
+
+        Returns:
+            QueryIntent with measure, dimensions, filters, chart type and confidence
+        """
+        dimensions = [dim for dim, keywords in DIMENSION_KEYWORDS.items() if _find_keywords(question, keywords)]
+        chart_type = next((chart for chart, keywords in CHART_KEYWORDS if _find_keywords(question, keywords)), None)
+        measure = next((m for m, keywords in MEASURE_KEYWORDS if _find_keywords(question, keywords)), None)
+        unsupported = _find_keywords(question, UNSUPPORTED_KEYWORDS)
+        filters = self._parse_filters(question)
+
+        confidence = 0.0
+        if dimensions or filters:
+            confidence += 0.5
+        if measure:
+            confidence += 0.2
+        if chart_type:
+            confidence += 0.15
+        if filters:
+            confidence += 0.15
+        if unsupported:
+            confidence *= 0.2
+
+        return QueryIntent(
+            measure=measure,
+            dimensions=dimensions,
+            filters=filters,
+            chart_type=chart_type,
+            unsupported=unsupported,
+            confidence=round(min(confidence, 1.0), 2)
+        )
+
+    def _parse_filters(self, question: str) -> Dict[str, List[str]]:
+        """Match cube labels mentioned in the question, longest label first."""
+        cube = self.cube
+        if cube is None:
+            return {}
+
+        candidates = [
+            (label, dim)
+            for dim in cube.dims
+            for label in cube.labels[dim]
+            if label != UNKNOWN and len(label) > 0
+        ]
+        candidates.sort(key=lambda item: len(item[0]), reverse=True)
+
+        remaining = question
+        filters: Dict[str, List[str]] = {}
+        for label, dim in candidates:
+            if label in remaining:
+                filters.setdefault(dim, []).append(str(label))
+                remaining = remaining.replace(label, " ")
+        return filters
+
+    def is_answerable(self, intent: QueryIntent, outputs: List[OutputType]) -> bool:
+        """Whether the intent can be served from pre-computed aggregates."""
+        cube = self.cube
+        if cube is None or intent.unsupported:
+            return False
+        if not intent.dimensions and not intent.filters:
+            return False
+        if not set(outputs) <= FAST_PATH_OUTPUTS:
+            return False
+        if any(dim not in cube.dims for dim in list(intent.dimensions) + list(intent.filters)):
+            return False
+        return intent.confidence >= self.threshold
+
+    def answer(self, question: str, outputs: List[OutputType], privacy_level: PrivacyLevel, artifacts_dir: Path,
+               epsilon: Optional[float] = None, user_id: Optional[str] = None,
+               job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Answer a question from the cohort cube if possible.
+
+        Args:
+            question: User question
+            outputs: Desired output types
+            privacy_level: Privacy protection level
+            artifacts_dir: Directory to write artifacts into
+            epsilon: Budget for noisy counts (differential_privacy only; the caller charges it)
+            user_id: User whose earlier answers the query is audited against (None skips auditing)
+            job_id: Job the answer is for (recorded with any budget charge)
+
+        Returns:
+            Result dict with intent, table and artifact names, or None to fall through
+
+        Raises:
+            QueryRejected: If the answer could be differenced against the user's earlier answers
+            PrivacyBudgetExceeded: If audit noise is needed but the user's budget is spent
+        """
+        started = time.perf_counter()
+        intent = self.parse(question)
+        if not self.is_answerable(intent, outputs):
+            return None
+
+        table = self.build_table(intent, privacy_level, epsilon)
+        if user_id is not None and privacy_level not in (PrivacyLevel.PUBLIC, PrivacyLevel.DIFFERENTIAL_PRIVACY):
+            table = self.audit_table(user_id, intent, table, job_id)
+
+        artifacts_dir = Path(artifacts_dir)
+        artifacts_dir.mkdir(parents=True, exist_ok=True)
+        artifacts = []
+
+        if OutputType.TABLE in outputs:
+            table.to_csv(artifacts_dir / "summary.csv", index=False)
+            artifacts.append("summary.csv")
+
+        if OutputType.PLOT in outputs and not table.empty:
+            self._render_chart(intent, table, artifacts_dir / "plot.png")
+            artifacts.append("plot.png")
+
+        if OutputType.EXPLANATION in outputs:
+            with open(artifacts_dir / "explanation.txt", "w", encoding="utf-8") as f:
+                f.write(self._explain(intent, table, privacy_level))
+            artifacts.append("explanation.txt")
+
+        intent_json = intent.model_dump_json()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.hits += 1
+            self.fast_path_seconds += elapsed
+
+        return {
+            'intent': intent,
+            'table': table,
+            'artifacts': artifacts,
+            'code_hash': hashlib.sha256(intent_json.encode()).hexdigest(),
+            'source': 'cohort_cube',
+            'elapsed': elapsed
+        }
+
+    def build_table(self, intent: QueryIntent, privacy_level: PrivacyLevel, epsilon: Optional[float] = None) -> pd.DataFrame:
+        """Dice and roll up the cube into the requested table."""
+        dims = _group_dims(intent)
+        cube = self.cube.dice(**intent.filters).rollup(dims)
+        dp = privacy_level == PrivacyLevel.DIFFERENTIAL_PRIVACY
+        # 差分隱私需對所有儲存格（含 0）加噪，否則是否出現在表中本身就洩漏資訊
+        table = cube.to_frame(drop_empty=not dp)
+
+        if dp:
+            # 同一病患可出現在多個年度檔案：敏感度為每位病患最多貢獻的列數
+            table["count"] = noisy_counts(table["count"].to_numpy(), epsilon or settings.dp_epsilon,
+                                          sensitivity=cube.max_contribution)
+            table = table[table["count"] > 0]
+
+        for dim in dims:
+            table = table[table[dim] != UNKNOWN]
+
+        if privacy_level not in (PrivacyLevel.PUBLIC, PrivacyLevel.DIFFERENTIAL_PRIVACY):
+            table = table[~table["suppressed"]]
+
+        table = table.drop(columns="suppressed").rename(columns={"count": "patient_count"})
+        # l_diverse / t_close：含敏感屬性的表需合併或移除違反的類別（圖表與說明都依此表產生）
+        table, _ = enforce_table_diversity(table, privacy_level.value)
+        total = table["patient_count"].sum()
+        table["percentage"] = (table["patient_count"] / total * 100).round(2) if total else 0.0
+        return table.reset_index(drop=True)
+
+    def audit_table(self, user_id: str, intent: QueryIntent, table: pd.DataFrame, job_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Audit a table's rows and their total against the user's earlier answers.
+
+        Rows flagged by the auditor (with the ``noise`` action) get Laplace
+        noise; if the total is flagged, every row does. A population gets
+        noise once: later queries replay the stored answer, and each answer
+        that draws fresh noise is charged ``dp_epsilon`` to the user's budget.
+
+        Raises:
+            PrivacyBudgetExceeded: If fresh noise is needed but the budget is spent
+        """
+        if table.empty:
+            return table
+        masks, weights = self.cube.populations(intent.filters, _group_dims(intent), table)
+        if len(masks) > 1:
+            # 百分比揭露了各列的總和，總和也是一個釋出的族群
+            masks = np.vstack([masks, masks.any(axis=0)])
+        flags = query_auditor.review(user_id, masks, weights)
+        if not flags.any():
+            return table
+
+        noisy = flags[:len(table)] | flags[-1]
+        counts = table["patient_count"].to_numpy(dtype="int64").copy()
+        rows = masks[:len(table)][noisy]
+        answers = query_auditor.noisy_answers(user_id, rows, weights)
+        fresh = np.isnan(answers)
+        if fresh.any():
+            # 各列族群互斥（平行組合），每次回答只扣一次 ε
+            privacy_budget.charge(user_id, settings.dp_epsilon, job_id)
+            drawn = add_noise(counts[noisy][fresh], self.cube.max_contribution, settings.dp_epsilon)
+            answers[fresh] = np.clip(np.rint(drawn), 0, None)
+            answers = query_auditor.record_noisy_answers(user_id, rows, weights, answers)
+        counts[noisy] = answers.astype("int64")
+        table = table.assign(patient_count=counts)
+        total = counts.sum()
+        table["percentage"] = (table["patient_count"] / total * 100).round(2) if total else 0.0
+        return table
+
+    def _render_chart(self, intent: QueryIntent, table: pd.DataFrame, path: Path):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        matplotlib.rcParams['font.sans-serif'] = [
+            'PingFang TC', 'Noto Sans CJK TC', 'Heiti TC', 'Arial Unicode MS', 'DejaVu Sans'
+        ]
+        matplotlib.rcParams['axes.unicode_minus'] = False
+
+        value = "percentage" if intent.measure == "percentage" else "patient_count"
+        dims = _group_dims(intent)
+        chart_type = intent.chart_type
+        if chart_type is None:
+            chart_type = "line" if dims[0] == "intake_year" else ("pie" if intent.measure == "percentage" else "bar")
+
+        fig, ax = plt.subplots(figsize=(12, 6))
+        if len(dims) >= 2:
+            data = table.pivot_table(index=dims[0], columns=dims[1], values=value, aggfunc="sum", fill_value=0)
+            if chart_type == "line":
+                data.plot(kind="line", ax=ax, marker="o")
+            else:
+                data.plot(kind="bar", ax=ax)
+        else:
+            data = table.set_index(dims[0])[value]
+            if chart_type == "pie":
+                data.plot(kind="pie", ax=ax, autopct="%1.1f%%")
+                ax.set_ylabel("")
+            elif chart_type == "line":
+                data.plot(kind="line", ax=ax, marker="o", linewidth=2, markersize=8)
+            else:
+                data.plot(kind="bar", ax=ax)
+
+        ax.set_title("、".join(dims), fontsize=16, fontweight="bold")
+        fig.tight_layout()
+        fig.savefig(path, dpi=150, bbox_inches="tight")
+        plt.close(fig)
+
+    def _explain(self, intent: QueryIntent, table: pd.DataFrame, privacy_level: PrivacyLevel = None) -> str:
+        if table.empty:
+            return "由於隱私保護要求，無法顯示詳細的統計資料。"
+        total = int(table["patient_count"].sum())
+        top = table.loc[table["patient_count"].idxmax()]
+        label = "、".join(str(top[d]) for d in _group_dims(intent))
+        text = f"依預先彙總資料統計，共 {total} 位病患。其中 {label} 的病患數量最多，達到 {int(top['patient_count'])} 人。"
+        if privacy_level == PrivacyLevel.DIFFERENTIAL_PRIVACY:
+            text += "（人數已加入差分隱私雜訊，為近似值）"
+        return text
+
+    def record_fallback(self, elapsed: float):
+        """Record a question that went through the LLM and sandbox path."""
+        with self._lock:
+            self.misses += 1
+            self.fallback_seconds += elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratio and estimated latency saved by the fast path."""
+        with self._lock:
+            total = self.hits + self.misses
+            avg_fast = self.fast_path_seconds / self.hits if self.hits else None
+            avg_fallback = self.fallback_seconds / self.misses if self.misses else None
+            saved = None
+            if avg_fallback is not None:
+                saved = max(self.hits * avg_fallback - self.fast_path_seconds, 0.0)
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'avg_fast_path_ms': avg_fast * 1000 if avg_fast is not None else None,
+                'avg_fallback_ms': avg_fallback * 1000 if avg_fallback is not None else None,
+                'latency_saved_seconds': saved
+            }
+
+
+# Global router instance (shared so statistics survive across requests)
+question_router = QuestionRouter()
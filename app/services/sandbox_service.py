@@ -30,10 +30,27 @@ class SandboxService:
         Returns:
             Execution result with status and artifacts
         """
+        return self._execute({'mode': 'python', 'code': code}, job_id)
+    
+    def execute_sql(self, sql: str, chart: Optional[Dict[str, Any]], job_id: str) -> Dict[str, Any]:
+        """
+        Execute SQL against the pre-registered DuckDB cohort views.
+        
+        Args:
+            sql: SQL query over the patients / patients_<year> / observations views
+            chart: Optional chart spec ({'type', 'x', 'y', 'title'})
+            job_id: Job identifier for artifact organization
+            
+        Returns:
+            Execution result with status and artifacts (result.arrow, summary.csv, plot.png)
+        """
+        return self._execute({'mode': 'sql', 'sql': sql, 'chart': chart}, job_id)
+    
+    def _execute(self, input_data: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+        """Write the runner input and execute it in a sandbox container."""
         try:
             # Create temporary input file
             with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-                input_data = {'code': code}
                 json.dump(input_data, f)
                 input_file = f.name
             
@@ -68,6 +85,12 @@ class SandboxService:
                 str(Path(settings.dataset_path).parent): {'bind': '/data', 'mode': 'ro'},
                 input_file: {'bind': '/tmp/input.json', 'mode': 'ro'}
             },
+            'environment': {
+                'DATASET_PATH': f'/data/{Path(settings.dataset_path).name}',
+                'DUCKDB_THREADS': str(settings.duckdb_threads),
+                'DUCKDB_MEMORY_LIMIT': settings.duckdb_memory_limit,
+                'DUCKDB_TEMP_DIR': '/tmp/duckdb'
+            },
             'stdin_open': True,
             'detach': False,
             'remove': True,
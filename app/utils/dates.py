@@ -0,0 +1,195 @@
+"""
+Vectorized date and age normalization for cohort files.
+
+Handles Gregorian and ROC (民國) dates in the formats found in the yearly
+CSVs (YYYY/MM/DD, YYYY-MM-DD, YYYY年MM月DD日, YYYY.MM.DD, 0YYY/MM/DD,
+YYY/MM/DD, compact YYYYMMDD, optional trailing time) as well as plain
+numeric ages. Parsing runs once per distinct value and the results are
+broadcast back with numpy, so cost scales with distinct values, not rows.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+ROC_OFFSET = 1911
+
+AGE_BINS = [0, 50, 60, 70, 80, 90, 120]
+AGE_LABELS = ["<50歲", "50-59歲", "60-69歲", "70-79歲", "80-89歲", "90+歲"]
+UNKNOWN_AGE = "未知年齡"
+UNKNOWN_VALUE = "未知"
+
+_DATE_PATTERN = (
+    r"^\s*(?P<year>\d{3,4})\s*[/\-.年]\s*(?P<month>\d{1,2})"
+    r"(?:\s*[/\-.月]\s*(?P<day>\d{1,2})\s*日?)?"
+)
+_COMPACT_PATTERN = r"^\s*(?P<year>\d{3,4})(?P<month>\d{2})(?P<day>\d{2})\s*$"
+_AGE_PATTERN = r"^\s*(?P<age>\d{1,3}(?:\.\d+)?)\s*歲?\s*$"
+
+
+def _factorize(series: pd.Series) -> Tuple[np.ndarray, pd.Series]:
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    return codes, pd.Series(uniques, dtype="object").astype("string")
+
+
+def _broadcast(values: pd.Series, codes: np.ndarray, index: pd.Index) -> pd.Series:
+    """Map per-unique numeric results back to every row (missing codes become NaN)."""
+    lookup = np.append(values.to_numpy(dtype="float64", na_value=np.nan), np.nan)
+    return pd.Series(lookup[codes], index=index)
+
+
+def parse_dates(series: pd.Series) -> pd.DataFrame:
+    """
+    Parse a Series of date-like values into year, month and day columns.
+
+    Args:
+        series: Raw values (strings, datetimes or mixed)
+
+    Returns:
+        DataFrame with nullable Int64 columns ``year``, ``month`` and ``day``
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.DataFrame({
+            "year": series.dt.year.astype("Int64"),
+            "month": series.dt.month.astype("Int64"),
+            "day": series.dt.day.astype("Int64"),
+        }, index=series.index)
+
+    codes, uniques = _factorize(series)
+    parts = uniques.str.extract(_DATE_PATTERN)
+    compact = uniques.str.extract(_COMPACT_PATTERN)
+    parts = parts.fillna(compact)
+    # 民國年只看年份字串：3 位數或補零的 0YYY；4 位數一律是西元年（含 1911 年以前）
+    token = parts["year"]
+    roc = (token.str.len() == 3) | token.str.startswith("0")
+    parts = parts.apply(pd.to_numeric, errors="coerce").astype("Int64")
+    parts["year"] = parts["year"].where(~roc.fillna(False).astype(bool), parts["year"] + ROC_OFFSET)
+
+    valid = parts["month"].between(1, 12) & (parts["day"].isna() | parts["day"].between(1, 31))
+    parts = parts.where(valid)
+
+    return pd.DataFrame({
+        col: _broadcast(parts[col], codes, series.index).astype("Int64")
+        for col in ["year", "month", "day"]
+    }, index=series.index)
+
+
+def parse_ages(series: pd.Series) -> pd.Series:
+    """
+    Parse plain numeric ages (e.g. ``84``, ``84.0``, ``84歲``).
+
+    Returns:
+        Float Series with NaN where the value is not an age between 0 and 120
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        age = series.astype("float64")
+    else:
+        codes, uniques = _factorize(series)
+        parsed = pd.to_numeric(uniques.str.extract(_AGE_PATTERN)["age"], errors="coerce")
+        age = _broadcast(parsed, codes, series.index).astype("float64")
+    return age.where((age > 0) & (age < 120))
+
+
+def to_age_band(series: pd.Series, unknown: str = UNKNOWN_AGE) -> pd.Series:
+    """Bucket numeric ages into the project's standard age bands."""
+    age = parse_ages(series)
+    bands = pd.cut(age, bins=AGE_BINS, labels=AGE_LABELS, right=False)
+    return bands.cat.add_categories([unknown]).fillna(unknown)
+
+
+def to_year_month(series: pd.Series) -> Tuple[pd.Series, Dict[str, float]]:
+    """
+    Reduce dates to ``YYYY-MM`` and ages to ``N歲``.
+
+    Missing values become ``未知``; unparseable values are kept as-is so that
+    nothing is silently lost.
+
+    Args:
+        series: Raw date / age column
+
+    Returns:
+        Tuple of (normalized Series, parse-rate report)
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype="object")
+
+    dates = parse_dates(uniques)
+    ages = parse_ages(uniques)
+    has_date = (dates["year"].notna() & dates["month"].notna()).to_numpy()
+    has_age = ages.notna().to_numpy() & ~has_date
+
+    out = uniques.copy()
+    if has_date.any():
+        out[has_date] = [
+            f"{year}-{month:02d}"
+            for year, month in zip(dates["year"][has_date], dates["month"][has_date])
+        ]
+    if has_age.any():
+        out[has_age] = [f"{int(age)}歲" for age in ages[has_age]]
+
+    # 以 codes 廣播回每一列；缺值 (code = -1) 對應到最後一格的「未知」
+    lookup = np.append(out.to_numpy(dtype=object), UNKNOWN_VALUE)
+    result = pd.Series(lookup[codes], index=series.index, dtype="object")
+
+    row_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    report = _report(len(series), int((codes < 0).sum()), int(row_counts[has_date].sum()), int(row_counts[has_age].sum()))
+    return result, report
+
+
+def _report(total: int, missing: int, dates: int, ages: int) -> Dict[str, float]:
+    """Summarize how many values of a column were recognized."""
+    present = total - missing
+    return {
+        "total": total,
+        "missing": missing,
+        "dates": dates,
+        "ages": ages,
+        "unparsed": present - dates - ages,
+        "parse_rate": round((dates + ages) / present, 4) if present else 1.0,
+    }
+
+
+def merge_reports(reports: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    """Combine per-chunk parse-rate reports into one report per column."""
+    totals: Dict[str, List[int]] = {}
+    for report in reports:
+        for col, stats in report.items():
+            acc = totals.setdefault(col, [0, 0, 0, 0])
+            for i, key in enumerate(["total", "missing", "dates", "ages"]):
+                acc[i] += stats[key]
+    return {col: _report(*acc) for col, acc in totals.items()}
+
+
+def normalize_year_month_columns(df: pd.DataFrame, columns: List[str]) -> Tuple[pd.DataFrame, Dict[str, Dict[str, float]]]:
+    """
+    Apply :func:`to_year_month` to every listed column present in ``df``.
+
+    Returns:
+        Tuple of (DataFrame with normalized columns, per-column parse-rate report)
+    """
+    report = {}
+    for col in columns:
+        if col in df.columns:
+            df[col], report[col] = to_year_month(df[col])
+    return df, report
+
+
+def year_of(series: pd.Series) -> pd.Series:
+    """Gregorian year of each date-like value (nullable Int64)."""
+    return parse_dates(series)["year"]
+
+
+def format_report(report: Dict[str, Dict[str, float]]) -> str:
+    """Render a per-column parse-rate report as printable lines."""
+    lines = []
+    for col, stats in report.items():
+        lines.append(
+            f"  {col}: 解析率 {stats['parse_rate']:.1%} "
+            f"(日期 {stats['dates']}, 年齡 {stats['ages']}, 無法解析 {stats['unparsed']}, 缺值 {stats['missing']})"
+        )
+    return "\n".join(lines)
+
+
+def age_band(value: Optional[float]) -> str:
+    """Scalar age band lookup, for callers working on single values."""
+    return str(to_age_band(pd.Series([value], dtype="object")).iloc[0])
@@ -0,0 +1,168 @@
+"""
+Differentially private noisy aggregates.
+
+Counts, sums and means are perturbed with the Laplace or Gaussian mechanism
+in a single vectorized draw per table. Noisy histograms are post-processed
+(consistency with a noisy total, non-negativity, integer rounding); this
+post-processing does not consume additional privacy budget.
+"""
+
+import math
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+
+MECHANISMS = ("laplace", "gaussian")
+
+
+def noise_scale(sensitivity: float, epsilon: float, mechanism: str = None, delta: float = None) -> float:
+    """
+    Noise scale calibrated to a query's sensitivity.
+
+    Laplace uses L1 sensitivity and returns ``b = Δ/ε``. Gaussian uses L2
+    sensitivity and returns ``σ = Δ·sqrt(2 ln(1.25/δ))/ε`` (requires ε < 1
+    for the classic guarantee).
+    """
+    mechanism = mechanism or settings.dp_mechanism
+    if mechanism not in MECHANISMS:
+        raise ValueError(f"Unknown noise mechanism: {mechanism}")
+    if epsilon <= 0:
+        raise ValueError("epsilon must be positive")
+    if mechanism == "laplace":
+        return sensitivity / epsilon
+    delta = settings.dp_delta if delta is None else delta
+    return sensitivity * math.sqrt(2 * math.log(1.25 / delta)) / epsilon
+
+
+def add_noise(values: np.ndarray, sensitivity: float, epsilon: float, mechanism: str = None,
+              delta: float = None, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Add calibrated noise to every element of ``values`` in one draw.
+
+    Args:
+        values: Exact answers
+        sensitivity: L1 (Laplace) or L2 (Gaussian) sensitivity of the whole vector
+        epsilon: Privacy budget spent on this release
+        mechanism: "laplace" or "gaussian" (default from settings)
+        delta: Gaussian delta (default from settings)
+        rng: Random generator (default: freshly seeded)
+
+    Returns:
+        Float array of noisy answers
+    """
+    mechanism = mechanism or settings.dp_mechanism
+    rng = rng or np.random.default_rng()
+    values = np.asarray(values, dtype="float64")
+    scale = noise_scale(sensitivity, epsilon, mechanism, delta)
+    if mechanism == "laplace":
+        return values + rng.laplace(0.0, scale, size=values.shape)
+    return values + rng.normal(0.0, scale, size=values.shape)
+
+
+def make_consistent(noisy: np.ndarray, total: Optional[float] = None) -> np.ndarray:
+    """
+    Post-process a noisy histogram into non-negative integers.
+
+    If a noisy ``total`` is given, cells are first shifted by the least-squares
+    correction so that they add up to it. Negative cells are then clipped to
+    zero and the remaining mass is rescaled to keep the total, and cells are
+    rounded with largest-remainder rounding so the sum is preserved exactly.
+    """
+    cells = np.asarray(noisy, dtype="float64").copy()
+    if cells.size == 0:
+        return cells.astype(np.int64)
+    if total is None:
+        total = cells.sum()
+    total = max(float(total), 0.0)
+
+    cells += (total - cells.sum()) / cells.size
+    cells = np.clip(cells, 0, None)
+    if cells.sum() > 0:
+        cells *= total / cells.sum()
+
+    target = int(round(total))
+    floors = np.floor(cells)
+    shortfall = target - int(floors.sum())
+    if shortfall > 0:
+        order = np.argsort(-(cells - floors), kind="stable")
+        floors[order[:shortfall]] += 1
+    return floors.astype(np.int64)
+
+
+def noisy_counts(counts: np.ndarray, epsilon: float, mechanism: str = None,
+                 rng: Optional[np.random.Generator] = None, sensitivity: float = 1.0) -> np.ndarray:
+    """
+    Release a histogram of disjoint counts.
+
+    Half of ``epsilon`` goes to the total and half to the cells, and the cells
+    are made consistent with the noisy total. If each person is counted at
+    most once, the histogram has sensitivity 1 (L1 and L2); if a person can
+    contribute up to ``m`` rows (e.g. one per yearly file), pass
+    ``sensitivity=m``.
+    """
+    counts = np.asarray(counts, dtype="float64")
+    rng = rng or np.random.default_rng()
+    total = add_noise(counts.sum(), sensitivity, epsilon / 2, mechanism, rng=rng)
+    cells = add_noise(counts.ravel(), sensitivity, epsilon / 2, mechanism, rng=rng)
+    return make_consistent(cells, total).reshape(counts.shape)
+
+
+def noisy_sum(values: pd.Series, lower: float, upper: float, epsilon: float, mechanism: str = None,
+              rng: Optional[np.random.Generator] = None) -> float:
+    """Noisy sum of values clipped to ``[lower, upper]``."""
+    clipped = np.clip(pd.to_numeric(values, errors="coerce").dropna().to_numpy(dtype="float64"), lower, upper)
+    sensitivity = max(abs(lower), abs(upper))
+    return float(add_noise(clipped.sum(), sensitivity, epsilon, mechanism, rng=rng))
+
+
+def noisy_mean(values: pd.Series, lower: float, upper: float, epsilon: float, mechanism: str = None,
+               rng: Optional[np.random.Generator] = None) -> float:
+    """Noisy mean of clipped values; the budget is split between sum and count."""
+    rng = rng or np.random.default_rng()
+    valid = pd.to_numeric(values, errors="coerce").dropna()
+    total = noisy_sum(valid, lower, upper, epsilon / 2, mechanism, rng)
+    count = float(add_noise(len(valid), 1.0, epsilon / 2, mechanism, rng=rng))
+    if count < 1:
+        return (lower + upper) / 2
+    return float(np.clip(total / count, lower, upper))
+
+
+def noisy_group_stats(df: pd.DataFrame, by: str, value: str, lower: float, upper: float, epsilon: float,
+                      mechanism: str = None, rng: Optional[np.random.Generator] = None) -> pd.DataFrame:
+    """
+    Noisy count, sum and mean of ``value`` per group in one grouped pass.
+
+    Groups are disjoint, so by parallel composition each statistic column
+    is paid for once: two thirds of ``epsilon`` go to the counts and one
+    third to the sums; means are derived from both (post-processing).
+    """
+    rng = rng or np.random.default_rng()
+    clipped = pd.to_numeric(df[value], errors="coerce").clip(lower, upper)
+    grouped = clipped.groupby(df[by], observed=True).agg(["count", "sum"])
+
+    counts = noisy_counts(grouped["count"].to_numpy(), epsilon / 3 * 2, mechanism, rng)
+    sums = add_noise(grouped["sum"].to_numpy(), max(abs(lower), abs(upper)), epsilon / 3, mechanism, rng=rng)
+    means = np.clip(np.divide(sums, counts, out=np.full(len(sums), (lower + upper) / 2), where=counts >= 1), lower, upper)
+    return pd.DataFrame({"count": counts, "sum": sums, "mean": means}, index=grouped.index).reset_index()
+
+
+def noisy_table(table: pd.DataFrame, count_column: str, epsilon: float, mechanism: str = None,
+                rng: Optional[np.random.Generator] = None, sensitivity: float = 1.0) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Replace a histogram table's counts (and derived percentages) with noisy counts.
+
+    Returns:
+        Tuple of (noisy table, report with epsilon and noise scale)
+    """
+    mechanism = mechanism or settings.dp_mechanism
+    noisy = noisy_counts(table[count_column].to_numpy(), epsilon, mechanism, rng, sensitivity)
+    result = table.assign(**{count_column: noisy})
+    if "percentage" in result.columns:
+        total = noisy.sum()
+        result["percentage"] = (noisy / total * 100).round(2) if total else 0.0
+    return result, {
+        "epsilon": epsilon,
+        "mechanism": mechanism,
+        "noise_scale": noise_scale(sensitivity, epsilon / 2, mechanism),
+    }
@@ -0,0 +1,363 @@
+"""
+Columnar conversion of cohort rows into FHIR R4 resources.
+
+Identifiers and code hashes are computed once per distinct value (via
+``pd.factorize``) instead of once per row, observation columns are
+exploded with ``melt``, and resources are assembled from the pre-computed
+column arrays in a single pass. Diagnosis, severity and observation codes
+are mapped to the canonical codes of :mod:`app.utils.terminology`; values
+without a mapping keep a hashed code. Large files are converted chunk by chunk
+(:func:`iter_resources`) and written in batches (:func:`write_resources`)
+so memory does not grow with the file.
+"""
+
+import uuid
+import hashlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.dates import to_age_band
+from app.utils.pseudonymize import SENSITIVE_COLUMNS
+
+# 串流寫出時每批寫入的資源數
+WRITE_BATCH_SIZE = 1000
+
+FHIR_BASE = "http://tmu.edu.tw/fhir/alzheimers"
+
+GENDER_CODES = {"男": "male", "女": "female"}
+
+# 病人身分連結欄位（假名化後）：任一欄位相同即視為同一病人
+LINKAGE_COLUMNS = ("個案編號", "身分證字號", "病歷號")
+
+PROFILES = {
+    "Patient": ["http://hl7.org/fhir/R4/patient.html"],
+    "Condition": ["http://hl7.org/fhir/R4/condition.html"],
+    "Observation": ["http://hl7.org/fhir/R4/observation.html"],
+}
+
+
+def generate_uuid(value) -> str:
+    """生成一致的 UUID，相同輸入產生相同 UUID"""
+    if pd.isna(value):
+        return str(uuid.uuid4())
+    return _md5_uuid(str(value))
+
+
+def _md5_uuid(text: str) -> str:
+    """``str(uuid.UUID(md5(text)))`` without building the UUID object."""
+    h = hashlib.md5(text.encode()).hexdigest()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def hash_value(value) -> Optional[str]:
+    """將代碼值雜湊化（識別欄位改由 get_pseudonymizer 處理）"""
+    if pd.isna(value):
+        return None
+    return hashlib.sha256(str(value).encode()).hexdigest()[:16]
+
+
+def _plain(value):
+    """Convert numpy scalars to plain Python values for JSON."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def map_unique(series: pd.Series, func: Callable) -> np.ndarray:
+    """
+    Apply ``func`` once per distinct value and broadcast the results to every row.
+
+    Missing values share one call with ``np.nan``.
+    """
+    codes, uniques = pd.factorize(series)
+    results = np.empty(len(uniques) + 1, dtype=object)
+    results[:len(uniques)] = [func(_plain(v)) for v in uniques]
+    results[-1] = func(np.nan)
+    return results[codes]
+
+
+def observation_columns(columns) -> List[str]:
+    """Columns exported as Observations (identifiers, gender and dementia fields are skipped)."""
+    return [col for col in columns if col not in SENSITIVE_COLUMNS and col != "性別" and "失智" not in col]
+
+
+def _primary_keys(df: pd.DataFrame) -> pd.Series:
+    """Case number + national ID of every row (missing where both are missing)."""
+    key = pd.Series("", index=df.index, dtype=object)
+    present = pd.Series(False, index=df.index)
+    for col in ("個案編號", "身分證字號"):
+        if col in df.columns:
+            key = key + df[col].fillna("").astype(str)
+            present |= df[col].notna()
+    return key.where(present)
+
+
+def _row_keys(df: pd.DataFrame) -> pd.Series:
+    """Content key of rows without any identifier, so they still get a reproducible id."""
+    text = df.map(str).agg("\x1f".join, axis=1)
+    return "row:" + text.map(lambda t: hashlib.sha256(t.encode()).hexdigest())
+
+
+class PatientLinkage:
+    """
+    Deterministic patient linkage across files.
+
+    Rows sharing any pseudonymized identifier of LINKAGE_COLUMNS belong to
+    the same patient (union-find over identifiers). Each patient's linkage
+    key is the smallest case number + national ID key among its rows (the
+    key used for a single file), or its smallest identifier if it has none,
+    so keys do not depend on file or row order.
+    """
+
+    def __init__(self):
+        self._parent: Dict[str, str] = {}
+        self._best: Dict[str, Tuple[int, str]] = {}
+        self.keys: Dict[str, str] = {}
+
+    def _find(self, identifier: str) -> str:
+        root = identifier
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[identifier] != root:
+            self._parent[identifier], identifier = root, self._parent[identifier]
+        return root
+
+    def _union(self, a: str, b: str):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            a, b = min(a, b), max(a, b)
+            self._parent[b] = a
+            self._best[a] = min(self._best[a], self._best.pop(b))
+
+    def add_frame(self, df: pd.DataFrame):
+        """Add the identifiers of (pseudonymized) cohort rows."""
+        columns = [col for col in LINKAGE_COLUMNS if col in df.columns]
+        if not columns:
+            return
+        rows = df[columns].assign(_key=_primary_keys(df)).drop_duplicates()
+        for *values, primary in rows.itertuples(index=False):
+            identifiers = [f"{col}:{value}" for col, value in zip(columns, values) if isinstance(value, str)]
+            for identifier in identifiers:
+                if identifier not in self._parent:
+                    self._parent[identifier] = identifier
+                    self._best[identifier] = (1, identifier)
+            if identifiers and isinstance(primary, str):
+                root = self._find(identifiers[0])
+                self._best[root] = min(self._best[root], (0, primary))
+            for identifier in identifiers[1:]:
+                self._union(identifiers[0], identifier)
+        self.keys = {}
+
+    def freeze(self) -> "PatientLinkage":
+        """Resolve every identifier to its patient's linkage key (call after the last :meth:`add_frame`)."""
+        self.keys = {identifier: self._best[self._find(identifier)][1] for identifier in self._parent}
+        return self
+
+    def resolve(self, df: pd.DataFrame) -> pd.Series:
+        """Linkage key of every row (missing for rows without a known identifier)."""
+        resolved = pd.Series(np.nan, index=df.index, dtype=object)
+        for col in reversed([col for col in LINKAGE_COLUMNS if col in df.columns]):
+            keys = df[col].map(lambda v: self.keys.get(f"{col}:{v}") if isinstance(v, str) else None)
+            resolved = keys.where(keys.notna(), resolved)
+        return resolved
+
+
+def patient_ids(df: pd.DataFrame, linkage: Optional[PatientLinkage] = None) -> np.ndarray:
+    """
+    Patient resource id of every row.
+
+    The id is derived from the (pseudonymized) case number and national ID,
+    or from the patient's linkage key when a :class:`PatientLinkage` is
+    given. Rows without any identifier get an id from their content instead
+    of a random one, so reruns produce the same ids.
+    """
+    key = _primary_keys(df)
+    if linkage is not None:
+        linked = linkage.resolve(df)
+        key = linked.where(linked.notna(), key)
+    missing = key.isna()
+    if missing.any():
+        key[missing] = _row_keys(df[missing])
+    return map_unique(key, generate_uuid)
+
+
+def _observation_value(value) -> Dict:
+    try:
+        return {"valueQuantity": {"value": float(value), "unit": "", "system": "http://unitsofmeasure.org", "code": ""}}
+    except (ValueError, TypeError):
+        return {"valueString": str(value)}
+
+
+def _coding(terminology, system: str, value, display: str) -> Dict:
+    """Canonical coding of a source value, or a hashed code with ``display`` if it is not mapped."""
+    concept = terminology.map_value(system, value)
+    if concept is None:
+        return {"system": system, "code": hash_value(value), "display": display}
+    return {"system": system, "code": concept["code"], "display": concept["display"]}
+
+
+def _meta(resource_type: str, last_updated: str) -> Dict:
+    return {"profile": PROFILES[resource_type], "versionId": "1", "lastUpdated": last_updated}
+
+
+def convert_frame(df: pd.DataFrame, last_updated: Optional[str] = None, terminology=None,
+                  linkage: Optional[PatientLinkage] = None) -> Dict[str, List[Dict]]:
+    """
+    Convert (already pseudonymized) cohort rows into Patient, Condition and Observation resources.
+
+    Args:
+        df: Cohort rows with the original Chinese columns
+        last_updated: ``meta.lastUpdated`` stamp (default: now, computed once)
+        terminology: Code mapping (default: :func:`app.utils.terminology.get_terminology`)
+        linkage: Cross-file patient linkage (default: ids from each row's own identifiers)
+
+    Returns:
+        Resources per resource type, in row order
+    """
+    if terminology is None:
+        from app.utils.terminology import get_terminology
+        terminology = get_terminology()
+    last_updated = last_updated or datetime.now().isoformat()
+    n = len(df)
+    ids = patient_ids(df, linkage)
+
+    # Patient
+    genders = df["性別"].map(GENDER_CODES).fillna("unknown").to_numpy() if "性別" in df.columns else np.full(n, "unknown")
+    case_numbers = df["個案編號"].astype(object).where(df["個案編號"].notna(), None).to_numpy() if "個案編號" in df.columns else np.full(n, None)
+    age_groups = to_age_band(df["生日/年齡"]).astype(str).to_numpy() if "生日/年齡" in df.columns else np.full(n, None)
+    patients = []
+    for pid, gender, case_number, age_group in zip(ids, genders, case_numbers, age_groups):
+        resource = {
+            "resourceType": "Patient",
+            "id": pid,
+            "meta": _meta("Patient", last_updated),
+            "identifier": [{"system": f"{FHIR_BASE}/patient-id", "value": _plain(case_number)}],
+            "active": True,
+            "gender": gender,
+            "extension": []
+        }
+        if age_group:
+            resource["extension"].append({"url": f"{FHIR_BASE}/age-group", "valueString": age_group})
+        patients.append(resource)
+
+    # Condition：有失智症診斷的列
+    conditions = []
+    if "失智症診斷" in df.columns:
+        rows = np.flatnonzero(df["失智症診斷"].notna().to_numpy())
+        diagnosis = df["失智症診斷"].iloc[rows]
+        condition_ids = map_unique(pd.Series(ids[rows]) + "_" + diagnosis.astype(str).to_numpy(), generate_uuid)
+        diagnosis_codings = map_unique(diagnosis, lambda v: _coding(terminology, f"{FHIR_BASE}/diagnosis", v, "失智症"))
+        severity = df["失智程度"].iloc[rows] if "失智程度" in df.columns else pd.Series(np.nan, index=diagnosis.index)
+        severity_codings = map_unique(severity, lambda v: None if pd.isna(v) else _coding(terminology, f"{FHIR_BASE}/dementia-severity", v, str(v)))
+        for row, condition_id, coding, level, level_coding in zip(rows, condition_ids, diagnosis_codings, severity.to_numpy(), severity_codings):
+            resource = {
+                "resourceType": "Condition",
+                "id": condition_id,
+                "meta": _meta("Condition", last_updated),
+                "subject": {"reference": f"Patient/{ids[row]}"},
+                "code": {
+                    "coding": [coding],
+                    "text": "失智症"
+                },
+                "clinicalStatus": {"coding": [{
+                    "system": "http://terminology.hl7.org/CodeSystem/condition-clinical", "code": "active", "display": "Active"
+                }]},
+                "verificationStatus": {"coding": [{
+                    "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status", "code": "confirmed", "display": "Confirmed"
+                }]}
+            }
+            if level_coding is not None and str(level).strip():
+                resource["severity"] = {
+                    "coding": [level_coding],
+                    "text": _plain(level)
+                }
+            conditions.append(resource)
+
+    # Observation：每列每個有值的觀察欄位，依列順序展開
+    columns = observation_columns(df.columns)
+    observations = []
+    if columns and n:
+        long = df[columns].assign(_row=np.arange(n)).melt(id_vars="_row", var_name="column", value_name="value")
+        long = long[long["value"].notna() & (long["value"].astype(str) != "")]
+        long = long.sort_values("_row", kind="stable")
+        rows = long["_row"].to_numpy()
+
+        if "收案日期" in df.columns:
+            times = df["收案日期"].astype(str).to_numpy()[rows]
+        else:
+            times = np.full(len(rows), last_updated, dtype=object)
+        observation_ids = [_md5_uuid(f"{ids[r]}_{c}_{t}") for r, c, t in zip(rows, long["column"].to_numpy(), times)]
+        column_codings = map_unique(long["column"], lambda c: _coding(terminology, f"{FHIR_BASE}/observation", c, c))
+        values = map_unique(long["value"], _observation_value)
+
+        for row, observation_id, column, coding, value in zip(rows, observation_ids, long["column"].to_numpy(), column_codings, values):
+            resource = {
+                "resourceType": "Observation",
+                "id": observation_id,
+                "meta": _meta("Observation", last_updated),
+                "status": "final",
+                "subject": {"reference": f"Patient/{ids[row]}"},
+                "code": {
+                    "coding": [coding],
+                    "text": column
+                }
+            }
+            resource.update(value)
+            observations.append(resource)
+
+    return {"Patient": patients, "Condition": conditions, "Observation": observations}
+
+
+def iter_resources(frames: Iterable[pd.DataFrame], last_updated: Optional[str] = None,
+                   linkage: Optional[PatientLinkage] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Convert cohort frames one at a time and yield ``(resource_type, resource)`` pairs.
+
+    Only the resources of the current frame are held in memory, so feeding
+    ``pd.read_csv(..., chunksize=...)`` keeps memory flat regardless of
+    file size. All frames share one ``meta.lastUpdated`` stamp.
+    """
+    last_updated = last_updated or datetime.now().isoformat()
+    for frame in frames:
+        for resource_type, resources in convert_frame(frame, last_updated, linkage=linkage).items():
+            for resource in resources:
+                yield resource_type, resource
+
+
+def write_resources(resources: Iterable[Tuple[str, Dict]], write_batch: Callable[[str, List[Dict]], None],
+                    batch_size: int = WRITE_BATCH_SIZE,
+                    on_batch: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+    """
+    Consume a resource stream and hand it to ``write_batch`` in batches per resource type.
+
+    Everything flushed before an error is already on disk, so a crash
+    mid-file loses at most one unwritten batch per type.
+
+    Args:
+        resources: ``(resource_type, resource)`` pairs, e.g. from :func:`iter_resources`
+        write_batch: Called with a resource type and a list of its resources
+        batch_size: Resources buffered per type before a flush
+        on_batch: Called with the running counts per type after every flush
+
+    Returns:
+        Number of resources written per resource type
+    """
+    buffers: Dict[str, List[Dict]] = defaultdict(list)
+    counts: Dict[str, int] = defaultdict(int)
+
+    def flush(resource_type: str):
+        batch = buffers.pop(resource_type, [])
+        if batch:
+            write_batch(resource_type, batch)
+            counts[resource_type] += len(batch)
+            if on_batch:
+                on_batch(dict(counts))
+
+    for resource_type, resource in resources:
+        buffer = buffers[resource_type]
+        buffer.append(resource)
+        if len(buffer) >= batch_size:
+            flush(resource_type)
+    for resource_type in list(buffers):
+        flush(resource_type)
+    return dict(counts)
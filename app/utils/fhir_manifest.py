@@ -0,0 +1,131 @@
+"""
+Content-hash manifest for incremental FHIR regeneration.
+
+The manifest maps ``<Type>/<id>`` to the hash of the resource's canonical
+body (everything except ``meta.versionId`` and ``meta.lastUpdated``), its
+version and the time that version was produced. A regenerated resource
+whose hash is unchanged gets its previous ``versionId``/``lastUpdated``
+back and need not be rewritten; a changed one gets the next version and
+the current run's timestamp, so ``_since`` only picks up real changes.
+
+Every occurrence is compared with the entry stored before the run, not
+with earlier occurrences of the same id in this run (an id produced once
+per yearly file with different content), so only the final occurrence
+decides whether the resource changed and a version is bumped at most once
+per run.
+"""
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+MANIFEST_FILE = "manifest.json"
+
+# 計算雜湊時排除的 meta 欄位（每次產生都會變動）
+VOLATILE_META = ("versionId", "lastUpdated")
+
+
+def content_hash(resource: Dict) -> str:
+    """SHA-256 of the canonical (sorted-key, compact) resource body without volatile meta fields."""
+    meta = {k: v for k, v in (resource.get("meta") or {}).items() if k not in VOLATILE_META}
+    body = {**resource, "meta": meta} if "meta" in resource else resource
+    canonical = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResourceManifest:
+    """
+    ``<Type>/<id>`` -> ``[content hash, versionId, lastUpdated]``, persisted as JSON.
+
+    ``sources`` additionally records a fingerprint per converted source
+    file, so a rerun can skip files that have not changed at all.
+
+    Args:
+        path: Manifest file (loaded if it exists)
+        run_time: ``lastUpdated`` stamp for resources changed in this run (default: now, UTC)
+    """
+
+    def __init__(self, path: Union[str, Path], run_time: Optional[str] = None):
+        self.path = Path(path)
+        self.run_time = run_time or datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+        self.entries: Dict[str, List] = {}
+        self.sources: Dict[str, str] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+            self.entries = stored.get("resources", {})
+            self.sources = stored.get("sources", {})
+        # 執行前的內容雜湊與版本；同一 id 在本次執行中多次出現時皆與此比較
+        self._stored: Dict[str, List] = dict(self.entries)
+        self.changed: Dict[str, int] = defaultdict(int)
+        self.unchanged: Dict[str, int] = defaultdict(int)
+
+    def stamp(self, resource: Dict, pending: Optional[Dict[str, List]] = None,
+              digest: Optional[str] = None) -> Tuple[str, List, bool]:
+        """
+        Set ``meta.versionId``/``meta.lastUpdated`` from the manifest without recording anything.
+
+        Args:
+            resource: Resource to stamp in place
+            pending: Entries not yet recorded (checked before the manifest)
+            digest: Precomputed :func:`content_hash` of the resource
+
+        Returns:
+            ``(key, entry, changed)`` where ``changed`` is True when the entry differs from
+            the latest recorded one (new or modified content, or an earlier occurrence
+            of the id in this run), i.e. the resource has to be written
+        """
+        key = f"{resource['resourceType']}/{resource['id']}"
+        digest = digest or content_hash(resource)
+        stored = self._stored.get(key)
+        if stored is not None and stored[0] == digest:
+            entry = stored
+        else:
+            entry = [digest, str(int(stored[1]) + 1 if stored else 1), self.run_time]
+        latest = (pending or {}).get(key) or self.entries.get(key)
+        changed = latest != entry
+        resource["meta"] = {**(resource.get("meta") or {}), "versionId": entry[1], "lastUpdated": entry[2]}
+        return key, entry, changed
+
+    def writer(self, write_batch: Callable[[str, List[Dict]], None], skip_unchanged: bool = True) -> Callable[[str, List[Dict]], None]:
+        """
+        Wrap a batch writer so resources are stamped and the manifest is updated only after a batch is written.
+
+        Unchanged resources must still be written when the output is
+        rebuilt from scratch (e.g. NDJSON shards); with a per-file tree
+        they are skipped. The returned writer optionally takes the content
+        hashes of the batch when they were computed elsewhere (e.g. by
+        conversion workers).
+        """
+        def write(resource_type: str, batch: List[Dict], digests: Optional[List[str]] = None):
+            updates = {}
+            selected = []
+            for resource, digest in zip(batch, digests or [None] * len(batch)):
+                key, entry, changed = self.stamp(resource, updates, digest)
+                if changed:
+                    updates[key] = entry
+                if changed or not skip_unchanged:
+                    selected.append(resource)
+            if selected:
+                write_batch(resource_type, selected)
+            # 寫入成功後才記錄新雜湊，中斷時未寫出的資源下次會重新產生
+            self.entries.update(updates)
+            self.changed[resource_type] += len(updates)
+            self.unchanged[resource_type] += len(batch) - len(updates)
+        return write
+
+    def changed_since(self, since: str) -> List[str]:
+        """``<Type>/<id>`` keys whose current version was produced after ``since`` (same ISO format)."""
+        return [key for key, entry in self.entries.items() if entry[2] > since]
+
+    def save(self):
+        """Write the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": self.sources, "resources": self.entries}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
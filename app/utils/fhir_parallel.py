@@ -0,0 +1,184 @@
+"""
+Parallel multi-file FHIR conversion with a deterministic reduce step.
+
+Cohort files are read in chunks by the parent and converted on a process
+pool: each worker pseudonymizes its chunk, builds the resources with the
+shared :class:`~app.utils.fhir.PatientLinkage` and returns them as compact
+JSON bytes with their content hash, so neither pickling resource dicts nor
+hashing happens in the parent. Results are reduced in file and row order
+(not completion order): Patient resources of the same person are merged,
+and for any other id the latest occurrence wins. The output therefore
+does not depend on the number of workers or on scheduling; a single
+worker runs the same steps in-process.
+"""
+
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import pandas as pd
+from app.utils.fhir import LINKAGE_COLUMNS, WRITE_BATCH_SIZE, PatientLinkage, convert_frame
+from app.utils.fhir_manifest import content_hash
+from app.utils.ndjson_store import dumps
+from app.utils.pseudonymize import get_pseudonymizer
+
+# 每個 worker 同時排隊的分塊數上限（限制記憶體）
+PENDING_PER_WORKER = 2
+
+_worker_state: Dict = {}
+
+
+def build_linkage(paths: Iterable[str], chunksize: int) -> PatientLinkage:
+    """
+    Read only the identifier columns of every file and link patients across them.
+
+    Use the same ``chunksize`` as the conversion, so identifiers are parsed
+    (and therefore pseudonymized) exactly as they will be there.
+    """
+    pseudonymizer = get_pseudonymizer()
+    linkage = PatientLinkage()
+    for path in paths:
+        for chunk in pd.read_csv(path, chunksize=chunksize, usecols=lambda col: col in LINKAGE_COLUMNS):
+            linkage.add_frame(pseudonymizer.pseudonymize_frame(chunk))
+    return linkage.freeze()
+
+
+def _init_worker(linkage: PatientLinkage, last_updated: str):
+    _worker_state.update(linkage=linkage, last_updated=last_updated)
+
+
+class _InlineExecutor:
+    """Executor running tasks in the calling process (one worker, same reduce path)."""
+
+    def __init__(self, linkage: PatientLinkage, last_updated: str):
+        _init_worker(linkage, last_updated)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        _worker_state.clear()
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def convert_chunk(frame: pd.DataFrame, linkage: Optional[PatientLinkage] = None,
+                  last_updated: Optional[str] = None) -> Dict[str, List[Tuple[str, str, bytes]]]:
+    """
+    Pseudonymize and convert one raw chunk.
+
+    Returns:
+        ``(id, content hash, compact JSON bytes)`` per resource type, in row order
+    """
+    linkage = linkage or _worker_state.get("linkage")
+    last_updated = last_updated or _worker_state.get("last_updated")
+    resources = convert_frame(get_pseudonymizer().pseudonymize_frame(frame), last_updated, linkage=linkage)
+    return {
+        resource_type: [(resource["id"], content_hash(resource), dumps(resource)) for resource in items]
+        for resource_type, items in resources.items()
+    }
+
+
+def merge_patient(current: Dict, update: Dict) -> Dict:
+    """
+    Merge a later occurrence of a patient into an earlier one.
+
+    Later values win except ``unknown``/empty ones; identifiers are unioned
+    and extensions are merged by url (the later value wins).
+    """
+    merged = dict(current)
+    for field, value in update.items():
+        if field == "identifier":
+            identifiers = [i for i in current.get("identifier", []) + value if i.get("value") is not None]
+            unique = {(i.get("system"), i["value"]): i for i in identifiers}
+            merged["identifier"] = list(unique.values()) or current.get("identifier", value)
+        elif field == "extension":
+            by_url = {e["url"]: e for e in current.get("extension", [])}
+            by_url.update({e["url"]: e for e in value})
+            merged["extension"] = list(by_url.values())
+        elif value not in (None, "", "unknown") or field not in current:
+            merged[field] = value
+    return merged
+
+
+def convert_parallel(paths: List[str], write_batch: Callable[[str, List[Dict], List[str]], None],
+                     linkage: PatientLinkage, workers: int, chunksize: int,
+                     last_updated: Optional[str] = None, batch_size: int = WRITE_BATCH_SIZE,
+                     on_file: Optional[Callable[[str, Dict[str, int]], None]] = None) -> Dict[str, int]:
+    """
+    Convert files on a process pool, reduce duplicates deterministically and write the result.
+
+    Args:
+        paths: Cohort CSV files, in the order their rows take precedence (later wins)
+        write_batch: Called with a resource type, a batch of resources and their content hashes
+        linkage: Frozen linkage over all files (see :func:`build_linkage`)
+        workers: Worker processes (1 converts in the calling process)
+        chunksize: CSV rows per task
+        last_updated: ``meta.lastUpdated`` stamp shared by all workers (default: now)
+        batch_size: Resources per ``write_batch`` call
+        on_file: Called with a file path and the resources converted from it
+
+    Returns:
+        Number of (merged) resources written per resource type
+    """
+    last_updated = last_updated or datetime.now().isoformat()
+    patients: Dict[str, Dict] = {}
+    others: Dict[str, Dict[str, Tuple[str, bytes]]] = defaultdict(dict)
+    converted: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def reduce(path: str, result: Dict[str, List[Tuple[str, str, bytes]]]):
+        for resource_type, items in result.items():
+            converted[path][resource_type] += len(items)
+            if resource_type == "Patient":
+                for resource_id, _, raw in items:
+                    resource = json.loads(raw)
+                    patients[resource_id] = merge_patient(patients[resource_id], resource) if resource_id in patients else resource
+            else:
+                by_id = others[resource_type]
+                for resource_id, digest, raw in items:
+                    by_id[resource_id] = (digest, raw)
+
+    remaining: Dict[str, int] = defaultdict(int)
+    pending = deque()
+
+    def drain():
+        path, future = pending.popleft()
+        reduce(path, future.result())
+        remaining[path] -= 1
+        if on_file and not remaining[path]:
+            on_file(path, dict(converted[path]))
+
+    # 依提交順序（檔案、列順序）合併結果，與完成順序無關
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(linkage, last_updated))
+    else:
+        executor = _InlineExecutor(linkage, last_updated)
+    with executor:
+        for path in paths:
+            # 讀取期間先佔一個名額，檔案讀完前不會回報完成
+            remaining[path] += 1
+            for frame in pd.read_csv(path, chunksize=chunksize):
+                remaining[path] += 1
+                pending.append((path, executor.submit(convert_chunk, frame)))
+                while len(pending) >= max(workers, 1) * PENDING_PER_WORKER:
+                    drain()
+            remaining[path] -= 1
+            if on_file and not remaining[path]:
+                on_file(path, dict(converted[path]))
+        while pending:
+            drain()
+
+    counts = {}
+    groups = [("Patient", [(resource, content_hash(resource)) for resource in patients.values()])]
+    groups += [(resource_type, [(raw, digest) for digest, raw in by_id.values()]) for resource_type, by_id in others.items()]
+    for resource_type, items in groups:
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            resources = [json.loads(item) if isinstance(item, bytes) else item for item, _ in batch]
+            write_batch(resource_type, resources, [digest for _, digest in batch])
+        counts[resource_type] = len(items)
+    return counts
@@ -0,0 +1,88 @@
+"""
+Forward and reverse reference index between FHIR resources.
+
+The forward map (``<Type>/<id>`` -> referenced ``<Type>/<id>`` keys) is
+recorded while resources are written and persisted next to them; the
+reverse map (target -> referencing resources) is derived from it on
+demand, so "everything that points at Patient/x" is a dict lookup
+instead of a scan over every Observation and Condition.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+REFERENCES_FILE = "references.json"
+
+
+def iter_references(node) -> Iterator[str]:
+    """Every relative ``<Type>/<id>`` reference found anywhere in a resource."""
+    if isinstance(node, dict):
+        reference = node.get("reference")
+        if isinstance(reference, str) and reference.count("/") == 1 and not reference.startswith("#"):
+            yield reference
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                yield from iter_references(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from iter_references(item)
+
+
+class ReferenceIndex:
+    """``<Type>/<id>`` -> referenced keys, with a lazily built reverse map."""
+
+    def __init__(self, forward: Optional[Dict[str, List[str]]] = None):
+        self.forward: Dict[str, List[str]] = forward or {}
+        self._reverse: Optional[Dict[str, List[str]]] = None
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ReferenceIndex":
+        """Load a persisted forward map (empty index if the file does not exist)."""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, path: Union[str, Path]):
+        """Write the forward map atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.forward, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def add(self, resource: Dict):
+        """Record (or replace) the outgoing references of one resource."""
+        key = f"{resource['resourceType']}/{resource['id']}"
+        targets = sorted(set(iter_references(resource)))
+        if targets:
+            self.forward[key] = targets
+        else:
+            self.forward.pop(key, None)
+        self._reverse = None
+
+    def references(self, key: str) -> List[str]:
+        """Keys referenced by ``key``."""
+        return self.forward.get(key, [])
+
+    def referencing(self, target: str) -> List[str]:
+        """Keys of the resources that reference ``target``."""
+        if self._reverse is None:
+            reverse: Dict[str, List[str]] = {}
+            for source, targets in self.forward.items():
+                for referenced in targets:
+                    reverse.setdefault(referenced, []).append(source)
+            self._reverse = reverse
+        return self._reverse.get(target, [])
+
+    def writer(self, write_batch: Callable[[str, List[Dict]], None]) -> Callable[[str, List[Dict]], None]:
+        """Wrap a batch writer so the references of every written resource are recorded."""
+        def write(resource_type: str, batch: List[Dict]):
+            write_batch(resource_type, batch)
+            for resource in batch:
+                self.add(resource)
+        return write
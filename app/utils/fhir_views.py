@@ -0,0 +1,262 @@
+"""
+SQL-on-FHIR style flattened views materialized as Parquet.
+
+Each view is a ViewDefinition-like dict: a resource type and a list of
+columns, each given by a small FHIRPath subset (member access, ``first()``,
+``where(field='value')`` and ``getReferenceKey()``). Views are written as
+one Parquet file each with dictionary-encoded string columns, which the
+sandbox registers as DuckDB views (``fhir_views/<name>.parquet``).
+
+With a resource manifest (see :mod:`app.utils.fhir_manifest`) a refresh
+only re-flattens resources whose content hash changed since the last
+materialization and drops rows of removed resources.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+from app.utils.fhir import FHIR_BASE
+from app.utils.fhir_manifest import MANIFEST_FILE
+from app.utils.ndjson_store import INDEX_SUFFIX, NDJSONStore
+
+STATE_FILE = "_state.json"
+
+VIEW_DEFINITIONS: List[Dict] = [
+    {
+        "resourceType": "ViewDefinition",
+        "name": "patient",
+        "resource": "Patient",
+        "select": [{"column": [
+            {"name": "id", "path": "id"},
+            {"name": "gender", "path": "gender"},
+            {"name": "age_group", "path": f"extension.where(url='{FHIR_BASE}/age-group').valueString"},
+            {"name": "last_updated", "path": "meta.lastUpdated"},
+        ]}],
+    },
+    {
+        "resourceType": "ViewDefinition",
+        "name": "observation",
+        "resource": "Observation",
+        "select": [{"column": [
+            {"name": "id", "path": "id"},
+            {"name": "subject", "path": "subject.getReferenceKey(Patient)"},
+            {"name": "code", "path": "code.coding.first().code"},
+            {"name": "display", "path": "code.text"},
+            {"name": "value_quantity", "path": "valueQuantity.value", "type": "decimal"},
+            {"name": "value_string", "path": "valueString"},
+            {"name": "last_updated", "path": "meta.lastUpdated"},
+        ]}],
+    },
+    {
+        "resourceType": "ViewDefinition",
+        "name": "condition",
+        "resource": "Condition",
+        "select": [{"column": [
+            {"name": "id", "path": "id"},
+            {"name": "subject", "path": "subject.getReferenceKey(Patient)"},
+            {"name": "code", "path": "code.coding.first().code"},
+            {"name": "severity", "path": "severity.text"},
+            {"name": "severity_code", "path": "severity.coding.first().code"},
+            {"name": "last_updated", "path": "meta.lastUpdated"},
+        ]}],
+    },
+]
+
+_FUNCTION = re.compile(r"^(\w+)\((.*)\)$")
+_WHERE = re.compile(r"^\s*(\w+)\s*=\s*'([^']*)'\s*$")
+
+
+def _split_path(path: str) -> List[str]:
+    """Split a path on dots outside parentheses and quotes."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(path):
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ".":
+            parts.append(path[start:i])
+            start = i + 1
+    parts.append(path[start:])
+    return parts
+
+
+def evaluate(resource: Dict, path: str) -> List[Any]:
+    """
+    Evaluate a FHIRPath subset against one resource and return the result collection.
+
+    Supported: member access (lists are flattened), ``first()``,
+    ``where(field='value')`` and ``getReferenceKey([Type])``.
+    """
+    nodes: List[Any] = [resource]
+    for segment in _split_path(path):
+        function = _FUNCTION.match(segment)
+        if function is None:
+            found = []
+            for node in nodes:
+                value = node.get(segment) if isinstance(node, dict) else None
+                if isinstance(value, list):
+                    found.extend(value)
+                elif value is not None:
+                    found.append(value)
+            nodes = found
+        elif function.group(1) == "first":
+            nodes = nodes[:1]
+        elif function.group(1) == "where":
+            condition = _WHERE.match(function.group(2))
+            if condition is None:
+                raise ValueError(f"Unsupported where() condition: {function.group(2)}")
+            field, expected = condition.groups()
+            nodes = [n for n in nodes if isinstance(n, dict) and n.get(field) == expected]
+        elif function.group(1) == "getReferenceKey":
+            target = function.group(2).strip()
+            keys = []
+            for node in nodes:
+                reference = node.get("reference", "") if isinstance(node, dict) else ""
+                resource_type, _, key = reference.rpartition("/")
+                if key and (not target or resource_type == target):
+                    keys.append(key)
+            nodes = keys
+        else:
+            raise ValueError(f"Unsupported FHIRPath function: {segment}")
+    return nodes
+
+
+def _columns(view: Dict) -> List[Dict]:
+    return [column for select in view["select"] for column in select["column"]]
+
+
+def flatten(resources: Iterable[Dict], view: Dict):
+    """
+    Project resources of the view's type into an Arrow table.
+
+    String columns are dictionary-encoded; ``decimal`` columns become float64.
+    """
+    import pyarrow as pa
+
+    columns = _columns(view)
+    values: Dict[str, List] = {column["name"]: [] for column in columns}
+    for resource in resources:
+        if resource.get("resourceType") != view["resource"]:
+            continue
+        for column in columns:
+            found = evaluate(resource, column["path"])
+            values[column["name"]].append(found[0] if found else None)
+
+    arrays = []
+    for column in columns:
+        if column.get("type") == "decimal":
+            arrays.append(pa.array(values[column["name"]], type=pa.float64()))
+        else:
+            data = [None if v is None else str(v) for v in values[column["name"]]]
+            arrays.append(pa.array(data, type=pa.string()).dictionary_encode())
+    return pa.table(arrays, names=[column["name"] for column in columns])
+
+
+class _DirectorySource:
+    """Resources of a ``<Type>/<id>.json`` tree."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def iter_resources(self, resource_type: str) -> Iterator[Dict]:
+        for path in sorted((self.root / resource_type).glob("*.json")):
+            with open(path, encoding="utf-8") as f:
+                yield json.load(f)
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict]:
+        path = self.root / resource_type / f"{resource_id}.json"
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def close(self):
+        pass
+
+
+def _open_source(source: Path):
+    if any(source.glob(f"*{INDEX_SUFFIX}")):
+        return NDJSONStore(source)
+    return _DirectorySource(source)
+
+
+def _write(table, path: Path):
+    import pyarrow.parquet as pq
+
+    tmp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(table, tmp_path, use_dictionary=True, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def materialize_views(source_dir: Union[str, Path], output_dir: Union[str, Path], manifest_path: Optional[Union[str, Path]] = None,
+                      views: Optional[List[Dict]] = None, full: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Materialize views from a resource tree or NDJSON store, incrementally when possible.
+
+    Args:
+        source_dir: Per-file resource tree or packed NDJSON store
+        output_dir: Directory for ``<view>.parquet`` files
+        manifest_path: Resource manifest (default: ``<source_dir>/manifest.json``)
+        views: View definitions (default: VIEW_DEFINITIONS)
+        full: Rebuild every view from scratch
+
+    Returns:
+        Per view: total rows, re-flattened resources and removed resources
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    source_dir, output_dir = Path(source_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(manifest_path) if manifest_path else source_dir / MANIFEST_FILE
+    hashes = {}
+    if manifest_path.exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            hashes = {key: entry[0] for key, entry in json.load(f).get("resources", {}).items()}
+
+    state_path = output_dir / STATE_FILE
+    state = {}
+    if state_path.exists() and not full:
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+
+    source = _open_source(source_dir)
+    summary = {}
+    try:
+        for view in views or VIEW_DEFINITIONS:
+            resource_type, path = view["resource"], output_dir / f"{view['name']}.parquet"
+            prefix = f"{resource_type}/"
+            current = {key[len(prefix):]: digest for key, digest in hashes.items() if key.startswith(prefix)}
+            previous = state.get(view["name"])
+
+            if current and previous is not None and path.exists():
+                changed = [rid for rid, digest in current.items() if previous.get(rid) != digest]
+                removed = [rid for rid in previous if rid not in current]
+                table = pq.read_table(path)
+                stale = pa.array(changed + removed, type=pa.string())
+                keep = pc.invert(pc.is_in(table.column("id").cast(pa.string()), value_set=stale))
+                fresh = flatten((r for r in (source.get(resource_type, rid) for rid in changed) if r), view)
+                table = pa.concat_tables([table.filter(keep), fresh.cast(table.schema)])
+                refreshed = fresh.num_rows
+                if changed or removed:
+                    _write(table, path)
+            else:
+                table = flatten(source.iter_resources(resource_type), view)
+                refreshed, removed = table.num_rows, []
+                _write(table, path)
+
+            # 沒有清單時無法判斷變更，下次仍整體重建
+            state[view["name"]] = current if current else None
+            summary[view["name"]] = {"rows": table.num_rows, "refreshed": refreshed, "removed": len(removed)}
+    finally:
+        source.close()
+
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, separators=(",", ":"))
+    return summary
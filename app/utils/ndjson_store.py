@@ -0,0 +1,307 @@
+"""
+Packed NDJSON storage for FHIR resources.
+
+Each resource type is written as compact NDJSON shards
+(``<Type>.<n>.ndjson``, optionally ``.gz`` or ``.zst``) that roll over at
+a size limit, plus a sidecar ``<Type>.index.json`` mapping every resource
+id to its shard, byte range and position. Compressed shards are written
+as a sequence of independent blocks (gzip members / zstd frames), which
+keeps them valid ``.gz``/``.zst`` files for streaming tools while letting
+the reader decompress only the block that holds a requested resource.
+Shards are read through ``mmap``.
+"""
+
+import gzip
+import json
+import mmap
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+COMPRESSIONS = {None: ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+# 單一分片的大小上限（壓縮後位元組）
+DEFAULT_SHARD_BYTES = 64 * 1024 * 1024
+
+# 壓縮區塊的大小（未壓縮位元組）；越小隨機讀取越快、壓縮率越差
+DEFAULT_BLOCK_BYTES = 32 * 1024
+
+# 讀取時保留的已解壓縮區塊數
+BLOCK_CACHE_SIZE = 16
+
+INDEX_SUFFIX = ".index.json"
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd shards require the 'zstandard' package") from e
+    return zstandard
+
+
+def _compress(data: bytes, compression: Optional[str]) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return _zstd().ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: Optional[str]) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _zstd().ZstdDecompressor().decompress(data)
+    return data
+
+
+def dumps(resource: Dict) -> bytes:
+    """Compact single-line JSON encoding used for every stored resource."""
+    return json.dumps(resource, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _TypeWriter:
+    """Shards, pending block and index entries of one resource type."""
+
+    def __init__(self, output_dir: Path, resource_type: str, compression: Optional[str],
+                 shard_bytes: int, block_bytes: int):
+        self.output_dir = output_dir
+        self.resource_type = resource_type
+        self.compression = compression
+        self.shard_bytes = shard_bytes
+        self.block_bytes = block_bytes if compression else 0
+        self.shards: List[str] = []
+        self.file = None
+        self.position = 0
+        self.block: List[Tuple[str, bytes]] = []
+        self.block_size = 0
+        # id -> [shard, block_offset, block_length, offset, length]
+        self.entries: Dict[str, List[int]] = {}
+
+    def _open_shard(self):
+        if self.file is not None:
+            self.file.close()
+        name = f"{self.resource_type}.{len(self.shards)}{COMPRESSIONS[self.compression]}"
+        self.shards.append(name)
+        self.file = open(self.output_dir / name, "wb")
+        self.position = 0
+
+    def add(self, resource_id: str, line: bytes):
+        self.block.append((resource_id, line))
+        self.block_size += len(line) + 1
+        if self.block_size >= self.block_bytes:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.block:
+            return
+        if self.file is None or self.position >= self.shard_bytes:
+            self._open_shard()
+        shard = len(self.shards) - 1
+        raw = b"".join(line + b"\n" for _, line in self.block)
+        data = _compress(raw, self.compression)
+        offset = 0
+        for resource_id, line in self.block:
+            if self.compression:
+                self.entries[resource_id] = [shard, self.position, len(data), offset, len(line)]
+            else:
+                # 未壓縮時區塊就是該行本身
+                self.entries[resource_id] = [shard, self.position + offset, len(line), 0, len(line)]
+            offset += len(line) + 1
+        self.file.write(data)
+        self.position += len(data)
+        self.block = []
+        self.block_size = 0
+
+    def close(self):
+        self.flush_block()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        index = {
+            "resourceType": self.resource_type,
+            "compression": self.compression,
+            "shards": self.shards,
+            "entries": self.entries,
+        }
+        tmp_path = self.output_dir / f"{self.resource_type}{INDEX_SUFFIX}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.output_dir / f"{self.resource_type}{INDEX_SUFFIX}")
+
+
+class NDJSONWriter:
+    """
+    Write FHIR resources as size-sharded NDJSON with an offset index.
+
+    ``write_batch`` has the signature expected by
+    :func:`app.utils.fhir.write_resources`. A resource id written twice
+    keeps its latest version in the index (the older line stays in the
+    shard). Indexes are written on :meth:`close`.
+    """
+
+    def __init__(self, output_dir: Union[str, Path], compression: Optional[str] = None,
+                 shard_bytes: int = DEFAULT_SHARD_BYTES, block_bytes: int = DEFAULT_BLOCK_BYTES):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == "zstd":
+            _zstd()
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.compression = compression
+        self.shard_bytes = shard_bytes
+        self.block_bytes = block_bytes
+        self._types: Dict[str, _TypeWriter] = {}
+
+    def _writer(self, resource_type: str) -> _TypeWriter:
+        writer = self._types.get(resource_type)
+        if writer is None:
+            # 重新寫出一個資源類型時先清掉舊分片
+            for old in self.output_dir.glob(f"{resource_type}.*"):
+                old.unlink()
+            writer = self._types[resource_type] = _TypeWriter(
+                self.output_dir, resource_type, self.compression, self.shard_bytes, self.block_bytes
+            )
+        return writer
+
+    def write(self, resource: Dict):
+        self._writer(resource["resourceType"]).add(resource["id"], dumps(resource))
+
+    def write_batch(self, resource_type: str, resources: Iterable[Dict]):
+        writer = self._writer(resource_type)
+        for resource in resources:
+            writer.add(resource["id"], dumps(resource))
+
+    def close(self):
+        for writer in self._types.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class NDJSONStore:
+    """
+    Random and sequential access to resources written by :class:`NDJSONWriter`.
+
+    A lookup is one dict probe in the index plus a slice of the mapped
+    shard (and, for compressed shards, decompressing one small block; recently
+    read blocks are cached so sequential access decompresses each block once).
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self._indexes: Dict[str, Dict] = {}
+        self._maps: Dict[Tuple[str, int], mmap.mmap] = {}
+        self._files = []
+        self._block_cache: "OrderedDict[Tuple[str, int, int], bytes]" = OrderedDict()
+        for path in sorted(self.root.glob(f"*{INDEX_SUFFIX}")):
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+            self._indexes[index["resourceType"]] = index
+
+    def resource_types(self) -> List[str]:
+        return list(self._indexes)
+
+    def count(self, resource_type: str) -> int:
+        index = self._indexes.get(resource_type)
+        return len(index["entries"]) if index else 0
+
+    def ids(self, resource_type: str) -> List[str]:
+        index = self._indexes.get(resource_type)
+        return list(index["entries"]) if index else []
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        resource_type, resource_id = key
+        index = self._indexes.get(resource_type)
+        return bool(index) and resource_id in index["entries"]
+
+    def _map(self, resource_type: str, shard: int) -> mmap.mmap:
+        key = (resource_type, shard)
+        mapped = self._maps.get(key)
+        if mapped is None:
+            f = open(self.root / self._indexes[resource_type]["shards"][shard], "rb")
+            self._files.append(f)
+            mapped = self._maps[key] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def _read(self, resource_type: str, entry: List[int]) -> bytes:
+        shard, block_offset, block_length, offset, length = entry
+        mapped = self._map(resource_type, shard)
+        compression = self._indexes[resource_type]["compression"]
+        if not compression:
+            return mapped[block_offset:block_offset + block_length]
+        key = (resource_type, shard, block_offset)
+        block = self._block_cache.get(key)
+        if block is None:
+            block = self._block_cache[key] = _decompress(mapped[block_offset:block_offset + block_length], compression)
+            if len(self._block_cache) > BLOCK_CACHE_SIZE:
+                self._block_cache.popitem(last=False)
+        else:
+            self._block_cache.move_to_end(key)
+        return block[offset:offset + length]
+
+    def read_raw(self, resource_type: str, resource_id: str) -> Optional[bytes]:
+        """Stored JSON bytes of one resource, or None if absent."""
+        index = self._indexes.get(resource_type)
+        entry = index["entries"].get(resource_id) if index else None
+        return self._read(resource_type, entry) if entry else None
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict]:
+        raw = self.read_raw(resource_type, resource_id)
+        return json.loads(raw) if raw is not None else None
+
+    def iter_raw(self, resource_type: str) -> Iterator[Tuple[str, bytes]]:
+        """``(id, bytes)`` of every current resource, in storage order."""
+        index = self._indexes.get(resource_type)
+        if not index:
+            return
+        entries = sorted(index["entries"].items(), key=lambda item: item[1][:2] + item[1][3:4])
+        for resource_id, entry in entries:
+            yield resource_id, self._read(resource_type, entry)
+
+    def iter_resources(self, resource_type: str) -> Iterator[Dict]:
+        for _, raw in self.iter_raw(resource_type):
+            yield json.loads(raw)
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        for f in self._files:
+            f.close()
+        self._maps.clear()
+        self._files.clear()
+        self._block_cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def pack_directory(source_dir: Union[str, Path], output_dir: Union[str, Path], compression: Optional[str] = None,
+                   shard_bytes: int = DEFAULT_SHARD_BYTES, block_bytes: int = DEFAULT_BLOCK_BYTES) -> Dict[str, int]:
+    """
+    Pack a ``<Type>/<id>.json`` resource tree into NDJSON shards.
+
+    Returns:
+        Number of resources packed per resource type
+    """
+    source_dir = Path(source_dir)
+    counts = {}
+    with NDJSONWriter(output_dir, compression, shard_bytes, block_bytes) as writer:
+        for type_dir in sorted(p for p in source_dir.iterdir() if p.is_dir()):
+            paths = sorted(type_dir.glob("*.json"))
+            if not paths:
+                continue
+            for path in paths:
+                with open(path, encoding="utf-8") as f:
+                    writer.write_batch(type_dir.name, [json.load(f)])
+            counts[type_dir.name] = len(paths)
+    return counts
@@ -2,36 +2,962 @@
 Privacy protection utilities for data analysis.
 """
 
+import re
+import numpy as np
 import pandas as pd
-from typing import List, Tuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 from app.core.config import settings
+from app.utils.dates import UNKNOWN_VALUE, parse_ages, parse_dates
 
-def apply_k_anonymity(df: pd.DataFrame, k: int = None) -> pd.DataFrame:
+# 無法再泛化時使用的最上層標籤
+ROOT = "*"
+
+# 串流去識別化每次讀取的列數
+STREAM_CHUNKSIZE = 100_000
+
+# 失智症診斷泛化階層（子類別 -> 上層類別；未列出的值直接接在最上層之下）
+DIAGNOSIS_HIERARCHY: Dict[str, str] = {
+    "阿茲海默症": "退化性失智症",
+    "路易氏體失智症": "退化性失智症",
+    "額顳葉失智症": "退化性失智症",
+    "巴金森氏症失智": "退化性失智症",
+    "血管性失智症": "血管性失智症類",
+    "混合型失智症": "血管性失智症類",
+    "退化性失智症": "失智症",
+    "血管性失智症類": "失智症",
+    "失智症": ROOT,
+}
+
+
+class QuasiIdentifier:
+    """
+    A quasi-identifier column and its generalization hierarchy.
+
+    ``age``, ``year_month`` and ``numeric`` attributes are ordered and are
+    generalized to value ranges (e.g. ``70-74歲``, ``2019-03~2019-08``).
+    ``categorical`` attributes are generalized to the lowest common ancestor
+    in ``hierarchy`` (a child -> parent mapping whose top level is ``*``).
+    Missing values form their own ``未知`` group.
+    """
+
+    KINDS = ("age", "year_month", "numeric", "categorical")
+
+    def __init__(self, column: str, kind: str = "categorical", hierarchy: Optional[Dict[str, str]] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown quasi-identifier kind: {kind}")
+        self.column = column
+        self.kind = kind
+        self.hierarchy = hierarchy or {}
+
+    @property
+    def ordered(self) -> bool:
+        return self.kind != "categorical"
+
+    def _values(self, series: pd.Series) -> pd.Series:
+        if self.kind == "age":
+            return parse_ages(series).round()
+        if self.kind == "year_month":
+            parts = parse_dates(series)
+            return (parts["year"] * 12 + parts["month"] - 1).astype("float64")
+        if self.kind == "numeric":
+            return pd.to_numeric(series, errors="coerce")
+        values = series.astype("string").str.strip()
+        return values.where(values != "")
+
+    def _path(self, value: str) -> Tuple[str, ...]:
+        """Ancestors of a value from the root down to the value itself."""
+        path = [value]
+        seen = {value}
+        while path[-1] in self.hierarchy and self.hierarchy[path[-1]] not in seen:
+            parent = self.hierarchy[path[-1]]
+            seen.add(parent)
+            path.append(parent)
+        if path[-1] != ROOT:
+            path.append(ROOT)
+        return tuple(reversed(path))
+
+    def domain_of(self, values: pd.Series) -> np.ndarray:
+        """Sorted distinct values of a normalized column."""
+        if self.ordered:
+            return np.unique(values.dropna().to_numpy(dtype="float64"))
+        # 依階層路徑排序，使同一上層類別的值相鄰，區間端點的共同祖先即涵蓋整個區間
+        leaves = values.dropna().unique().tolist()
+        return np.asarray(sorted(leaves, key=self._path), dtype=object)
+
+    def encode(self, series: pd.Series, domain: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encode a column as ordered integer codes.
+
+        Args:
+            series: Raw column
+            domain: Fixed domain to encode against (default: the column's own values)
+
+        Returns:
+            Tuple of (codes, domain). Codes index into ``domain``; missing
+            values and values outside a fixed domain get the last code.
+        """
+        # 只對不重複值做解析，再以 factorize 代碼映射回每一列
+        raw_codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        values = self._values(pd.Series(uniques, dtype="object"))
+        if domain is None:
+            domain = self.domain_of(values)
+
+        positions = pd.Index(domain).get_indexer(values)
+        positions[positions < 0] = len(domain)
+        lookup = np.append(positions, len(domain)).astype(np.int32)
+        return lookup[raw_codes], domain
+
+    @staticmethod
+    def decode(codes: np.ndarray, domain: np.ndarray) -> np.ndarray:
+        """Map codes back to normalized values (missing code -> None)."""
+        return np.append(domain.astype(object), None)[codes]
+
+    def _format(self, value) -> str:
+        if self.kind == "age":
+            return f"{int(value)}"
+        if self.kind == "year_month":
+            year, month = divmod(int(value), 12)
+            return f"{year}-{month + 1:02d}"
+        return f"{value:g}"
+
+    def generalize(self, lo: np.ndarray, hi: np.ndarray, domain: np.ndarray) -> np.ndarray:
+        """
+        Label code ranges ``[lo, hi]`` with their generalized value.
+
+        Ranges that mix known and missing values are generalized to ``*``.
+        """
+        missing = len(domain)
+        pairs, inverse = np.unique(np.stack([lo, hi], axis=1), axis=0, return_inverse=True)
+        labels = []
+        for a, b in pairs:
+            if a == missing:
+                labels.append(UNKNOWN_VALUE)
+            elif b == missing:
+                labels.append(ROOT)
+            elif self.ordered:
+                sep = "~" if self.kind == "year_month" else "-"
+                text = self._format(domain[a]) if a == b else f"{self._format(domain[a])}{sep}{self._format(domain[b])}"
+                labels.append(f"{text}歲" if self.kind == "age" else text)
+            elif a == b:
+                labels.append(str(domain[a]))
+            else:
+                first, last = self._path(domain[a]), self._path(domain[b])
+                common = [x for x, y in zip(first, last) if x == y]
+                labels.append(common[-1] if common else ROOT)
+        return np.asarray(labels, dtype=object)[inverse.ravel()]
+
+
+# 預設準識別欄位：年齡、性別、收案年月、醫院、診斷
+DEFAULT_QUASI_IDENTIFIERS: List[QuasiIdentifier] = [
+    QuasiIdentifier("生日/年齡", "age"),
+    QuasiIdentifier("性別", "categorical"),
+    QuasiIdentifier("收案日期", "year_month"),
+    QuasiIdentifier("醫院", "categorical"),
+    QuasiIdentifier("失智症診斷", "categorical", DIAGNOSIS_HIERARCHY),
+]
+
+
+def _group_bounds(codes: np.ndarray, part: np.ndarray, n_parts: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-partition minimum and maximum of every column of ``codes``."""
+    order = np.argsort(part, kind="stable")
+    starts = np.searchsorted(part[order], np.arange(n_parts))
+    sorted_codes = codes[order]
+    return np.minimum.reduceat(sorted_codes, starts, axis=0), np.maximum.reduceat(sorted_codes, starts, axis=0)
+
+
+def mondrian_partition(codes: np.ndarray, weights: np.ndarray, k: int) -> np.ndarray:
+    """
+    Multidimensional Mondrian partitioning.
+
+    All partitions are split in parallel: each round picks, per partition,
+    the quasi-identifier with the widest normalized range and cuts it at the
+    weighted median if both halves keep at least ``k`` records. Dimensions
+    that cannot be cut are marked and the next widest one is tried.
+    Working rows are kept sorted by partition so that group statistics are
+    ``reduceat`` calls, and finished partitions leave the working set.
+
+    Args:
+        codes: (n, d) ordered integer codes, one row per distinct QI combination
+        weights: Number of records behind each row
+        k: Minimum equivalence class size
+
+    Returns:
+        Partition id of every row
+    """
+    n, d = codes.shape
+    result = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return result
+    spans = np.maximum(codes.max(axis=0) - codes.min(axis=0), 1)
+    radix = int(codes.max()) + 1
+
+    rows = np.arange(n)
+    block, w = codes, weights
+    part = np.zeros(n, dtype=np.int64)
+    tried = np.zeros((1, d), dtype=bool)
+    finished = 0
+
+    while len(rows):
+        starts = np.flatnonzero(np.r_[True, part[1:] != part[:-1]])
+        totals = np.add.reduceat(w, starts)
+        lo = np.minimum.reduceat(block, starts, axis=0)
+        hi = np.maximum.reduceat(block, starts, axis=0)
+
+        width = (hi - lo) / spans
+        width[tried | (hi == lo)] = -1
+        width[totals < 2 * k] = -1
+        dim = width.argmax(axis=1)
+        candidate = width[np.arange(len(starts)), dim] > 0
+
+        # 無法再切割的分割定案，移出工作集合
+        done = ~candidate[part]
+        n_done = int((~candidate).sum())
+        if n_done:
+            local = np.cumsum(~candidate) - 1
+            result[rows[done]] = finished + local[part[done]]
+            finished += n_done
+        if not candidate.any():
+            break
+        keep = np.flatnonzero(candidate)
+        remap = np.full(len(starts), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        if n_done:
+            rows, part, block, w = rows[~done], remap[part[~done]], block[~done], w[~done]
+        totals, dim, tried = totals[keep], dim[keep], tried[keep]
+
+        # 依 (分割, 選定維度的值) 排序，以累積權重找加權中位數
+        value = block[np.arange(len(rows)), dim[part]]
+        order = np.argsort(part * radix + value, kind="stable")
+        rows, part, value, block, w = rows[order], part[order], value[order], block[order], w[order]
+        cumulative = np.cumsum(w)
+        before = np.concatenate([[0], np.cumsum(totals)[:-1]])
+        median = value[np.minimum(np.searchsorted(cumulative, before + totals / 2), len(rows) - 1)]
+
+        left_le = value <= median[part]
+        left = np.bincount(part, weights=w * left_le, minlength=len(keep))
+        use_lt = left >= totals
+        left_lt = value < median[part]
+        left = np.where(use_lt, np.bincount(part, weights=w * left_lt, minlength=len(keep)), left)
+        goes_left = np.where(use_lt[part], left_lt, left_le)
+
+        ok = (left >= k) & (totals - left >= k)
+        tried[~ok, dim[~ok]] = True
+        tried[ok] = False
+
+        # 切割後重新編號：左半部排在右半部之前，工作列維持依分割排序
+        side = ok[part] & ~goes_left
+        boundary = np.r_[True, (part[1:] != part[:-1]) | (side[1:] != side[:-1])]
+        new_part = np.cumsum(boundary) - 1
+        tried = tried[part[boundary]]
+        part = new_part
+
+    return result
+
+
+def _generalize_combos(combo_codes: np.ndarray, weights: np.ndarray, domains: List[np.ndarray],
+                       qis: Sequence[QuasiIdentifier], k: int) -> Tuple[np.ndarray, List[pd.Categorical], Dict[str, float]]:
+    """
+    Partition distinct QI combinations and label every partition.
+
+    Returns:
+        Tuple of (partition id per combination, generalized labels per QI
+        indexed by partition id, report)
+    """
+    part = mondrian_partition(combo_codes, weights, k)
+    n_parts = int(part.max()) + 1
+    lo, hi = _group_bounds(combo_codes, part, n_parts)
+    sizes = np.bincount(part, weights=weights, minlength=n_parts)
+
+    labels = []
+    loss = 0.0
+    for i, (qi, domain) in enumerate(zip(qis, domains)):
+        label_codes, categories = pd.factorize(qi.generalize(lo[:, i], hi[:, i], domain))
+        labels.append(pd.Categorical.from_codes(label_codes, categories=categories))
+        loss += float(np.sum(sizes * (hi[:, i] - lo[:, i]) / max(len(domain), 1)))
+
+    total = float(sizes.sum())
+    return part, labels, {
+        "records": int(total),
+        "suppressed": 0,
+        "classes": n_parts,
+        "min_class_size": int(sizes.min()),
+        "information_loss": round(loss / total / len(qis), 4),
+    }
+
+
+def _assign_labels(df: pd.DataFrame, qis: Sequence[QuasiIdentifier], labels: List[pd.Categorical], row_part: np.ndarray) -> pd.DataFrame:
+    """Replace QI columns by the generalized labels of each row's partition."""
+    replaced = {
+        qi.column: pd.Categorical.from_codes(np.asarray(label.codes)[row_part], categories=label.categories)
+        for qi, label in zip(qis, labels)
+    }
+    return df.assign(**replaced)
+
+
+def k_anonymize(df: pd.DataFrame, k: int = None, quasi_identifiers: Sequence[QuasiIdentifier] = None) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Generalize quasi-identifiers so that every record shares its values with at least k-1 others.
+
+    Args:
+        df: Input DataFrame
+        k: K-anonymity parameter (default from settings)
+        quasi_identifiers: Quasi-identifiers to generalize (default: DEFAULT_QUASI_IDENTIFIERS present in df)
+
+    Returns:
+        Tuple of (generalized DataFrame, report with class counts and information loss)
+    """
+    if k is None:
+        k = settings.k_anonymity
+    if quasi_identifiers is None:
+        quasi_identifiers = DEFAULT_QUASI_IDENTIFIERS
+    qis = [qi for qi in quasi_identifiers if qi.column in df.columns]
+
+    if len(df) < k:
+        # Dataset too small for k-anonymity
+        return df.iloc[0:0], {"records": 0, "suppressed": len(df), "classes": 0, "min_class_size": 0, "information_loss": 1.0}
+    if not qis:
+        return df, {"records": len(df), "suppressed": 0, "classes": 1, "min_class_size": len(df), "information_loss": 0.0}
+
+    encoded = [qi.encode(df[qi.column]) for qi in qis]
+    codes = np.stack([c for c, _ in encoded], axis=1)
+    shape = [len(domain) + 1 for _, domain in encoded]
+
+    # 以不重複的準識別組合（附人數權重）進行分割，成本取決於組合數而非列數
+    flat = np.ravel_multi_index(codes.T, shape)
+    combos, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+    combo_codes = np.stack(np.unravel_index(combos, shape), axis=1).astype(np.int32)
+
+    part, labels, report = _generalize_combos(combo_codes, counts.astype("float64"), [d for _, d in encoded], qis, k)
+    return _assign_labels(df, qis, labels, part[inverse.ravel()]), report
+
+
+def apply_k_anonymity(df: pd.DataFrame, k: int = None, quasi_identifiers: Sequence[QuasiIdentifier] = None) -> pd.DataFrame:
     """
     Apply k-anonymity to ensure privacy protection.
     
     Args:
         df: Input DataFrame
         k: K-anonymity parameter (default from settings)
+        quasi_identifiers: Quasi-identifiers to generalize (default: DEFAULT_QUASI_IDENTIFIERS present in df)
         
     Returns:
         DataFrame with k-anonymity applied
     """
+    return k_anonymize(df, k, quasi_identifiers)[0]
+
+class StreamingKAnonymizer:
+    """
+    Two-pass k-anonymization for inputs larger than memory.
+
+    Pass 1 (:meth:`count`) accumulates record counts per distinct
+    quasi-identifier combination, which is bounded by the QI domains rather
+    than by the number of rows. :meth:`fit` partitions those counts with
+    Mondrian, and pass 2 (:meth:`transform`) replaces the QIs of each chunk
+    by the labels of its equivalence class.
+    """
+
+    def __init__(self, k: int = None, quasi_identifiers: Sequence[QuasiIdentifier] = None):
+        self.k = settings.k_anonymity if k is None else k
+        self.quasi_identifiers = list(DEFAULT_QUASI_IDENTIFIERS if quasi_identifiers is None else quasi_identifiers)
+        self.qis: Optional[List[QuasiIdentifier]] = None
+        self.records = 0
+        self.report: Optional[Dict[str, float]] = None
+        self._counts: Optional[pd.DataFrame] = None
+
+    def columns(self, available: Sequence[str]) -> List[str]:
+        """Quasi-identifier columns present among ``available``."""
+        return [qi.column for qi in self.quasi_identifiers if qi.column in available]
+
+    def count(self, chunk: pd.DataFrame):
+        """Pass 1: add a chunk's QI combinations to the running counts."""
+        if self.qis is None:
+            self.qis = [qi for qi in self.quasi_identifiers if qi.column in chunk.columns]
+        self.records += len(chunk)
+        if not self.qis or chunk.empty:
+            return
+
+        encoded = [qi.encode(chunk[qi.column]) for qi in self.qis]
+        shape = [len(domain) + 1 for _, domain in encoded]
+        flat = np.ravel_multi_index([codes for codes, _ in encoded], shape)
+        combos, counts = np.unique(flat, return_counts=True)
+        combo_codes = np.unravel_index(combos, shape)
+
+        frame = pd.DataFrame({
+            qi.column: qi.decode(codes, domain)
+            for qi, codes, (_, domain) in zip(self.qis, combo_codes, encoded)
+        })
+        frame["count"] = counts
+        if self._counts is not None:
+            frame = pd.concat([self._counts, frame], ignore_index=True)
+            frame = frame.groupby([qi.column for qi in self.qis], dropna=False, sort=False, as_index=False)["count"].sum()
+        self._counts = frame
+
+    def fit(self) -> Dict[str, float]:
+        """Partition the accumulated counts; returns the k-anonymity report."""
+        if self.records < self.k:
+            self.report = {"records": 0, "suppressed": self.records, "classes": 0, "min_class_size": 0, "information_loss": 1.0}
+            return self.report
+        if not self.qis:
+            self.report = {"records": self.records, "suppressed": 0, "classes": 1, "min_class_size": self.records, "information_loss": 0.0}
+            return self.report
+
+        self._domains = [qi.domain_of(self._counts[qi.column]) for qi in self.qis]
+        self._shape = [len(domain) + 1 for domain in self._domains]
+        codes = []
+        for qi, domain in zip(self.qis, self._domains):
+            positions = pd.Index(domain).get_indexer(self._counts[qi.column])
+            positions[positions < 0] = len(domain)
+            codes.append(positions.astype(np.int32))
+        combo_codes = np.stack(codes, axis=1)
+
+        part, self._labels, self.report = _generalize_combos(
+            combo_codes, self._counts["count"].to_numpy(dtype="float64"), self._domains, self.qis, self.k
+        )
+        flat = np.ravel_multi_index(combo_codes.T, self._shape)
+        order = np.argsort(flat)
+        self._keys, self._key_part = flat[order], part[order]
+        self._counts = None
+        return self.report
+
+    def transform(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Pass 2: generalize a chunk's QIs (chunks must come from the counted input)."""
+        if self.report is None:
+            raise RuntimeError("fit() must be called before transform()")
+        if self.report["records"] == 0:
+            return chunk.iloc[0:0]
+        if not self.qis:
+            return chunk
+
+        codes = [qi.encode(chunk[qi.column], domain)[0] for qi, domain in zip(self.qis, self._domains)]
+        flat = np.ravel_multi_index(codes, self._shape)
+        position = np.minimum(np.searchsorted(self._keys, flat), len(self._keys) - 1)
+        if (self._keys[position] != flat).any():
+            raise ValueError("Chunk contains quasi-identifier combinations that were not counted in pass 1")
+        return _assign_labels(chunk, self.qis, self._labels, self._key_part[position])
+
+
+def stream_k_anonymize(input_path: Union[str, Path], output_path: Union[str, Path], k: int = None,
+                       quasi_identifiers: Sequence[QuasiIdentifier] = None,
+                       transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                       chunksize: int = STREAM_CHUNKSIZE) -> Dict[str, float]:
+    """
+    K-anonymize a CSV file in bounded memory.
+
+    The first pass reads only the quasi-identifier columns and counts their
+    combinations; the second pass reads the full file chunk by chunk,
+    generalizes QIs, applies ``transform`` and appends to ``output_path``.
+
+    Args:
+        input_path: Source CSV
+        output_path: Destination CSV (overwritten)
+        k: K-anonymity parameter (default from settings)
+        quasi_identifiers: Quasi-identifiers to generalize (default: DEFAULT_QUASI_IDENTIFIERS)
+        transform: Per-chunk column transform applied after generalization
+        chunksize: Rows per chunk
+
+    Returns:
+        K-anonymity report
+    """
+    anonymizer = StreamingKAnonymizer(k, quasi_identifiers)
+    qi_columns = anonymizer.columns(pd.read_csv(input_path, nrows=0).columns)
+
+    for chunk in pd.read_csv(input_path, chunksize=chunksize, usecols=qi_columns or [0]):
+        anonymizer.count(chunk[qi_columns])
+    report = anonymizer.fit()
+
+    header = True
+    for chunk in pd.read_csv(input_path, chunksize=chunksize):
+        chunk = anonymizer.transform(chunk)
+        if transform is not None:
+            chunk = transform(chunk)
+        chunk.to_csv(output_path, mode="w" if header else "a", header=header, index=False)
+        header = False
+    return report
+
+
+# 有序敏感屬性的等級（原始值 -> 等級），t-closeness 以等級距離計算 EMD
+ORDINAL_SENSITIVE: Dict[str, Dict[str, int]] = {
+    "失智程度": {
+        "0.5": 0, "極輕度": 0, "極輕度失智": 0,
+        "1": 1, "輕度": 1, "輕度失智": 1,
+        "2": 2, "中度": 2, "中度失智": 2,
+        "3": 3, "重度": 3, "重度失智": 3,
+    },
+}
+
+
+def _sensitive_codes(series: pd.Series, sensitive: str) -> Tuple[np.ndarray, int, bool]:
+    """
+    Encode a sensitive column as integer codes (missing values are -1).
+
+    Returns:
+        Tuple of (codes, number of distinct values, whether the codes are ordinal levels)
+    """
+    codes, uniques = pd.factorize(series)
+    levels = ORDINAL_SENSITIVE.get(sensitive)
+    if levels is None:
+        return codes.astype(np.int64), max(len(uniques), 1), False
+
+    # 只需正規化不重複值（"2.0" -> "2"，去除空白）
+    normalized = [re.sub(r"^(\d)\.0$", r"\1", re.sub(r"\s+", "", str(u))) for u in uniques]
+    lookup = np.array([levels.get(u, -1) for u in normalized] + [-1], dtype=np.int64)
+    return lookup[codes], max(levels.values()) + 1, True
+
+
+def diversity_statistics(df: pd.DataFrame, sensitive: str = None,
+                         qi_columns: Sequence[str] = None) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Sensitive-value statistics of every equivalence class in one grouped pass.
+
+    Rows are grouped by their (generalized) quasi-identifier values and a
+    class x sensitive-value contingency table is built with one
+    ``np.bincount``. From it each class gets its number of distinct values,
+    its entropy l (``exp`` of the Shannon entropy) and its Earth Mover's
+    Distance to the overall distribution: the normalized cumulative
+    difference for ordinal attributes (ORDINAL_SENSITIVE) and the total
+    variation distance for nominal ones. Missing sensitive values are left
+    out of the distributions.
+
+    Args:
+        df: Records, typically the output of :func:`apply_k_anonymity`
+        sensitive: Sensitive attribute (default from settings)
+        qi_columns: Columns defining the classes (default: DEFAULT_QUASI_IDENTIFIERS present in df)
+
+    Returns:
+        Tuple of (class id per row, frame indexed by class id with size,
+        distinct, entropy_l and emd)
+    """
+    sensitive = sensitive or settings.sensitive_attribute
+    if qi_columns is None:
+        qi_columns = [qi.column for qi in DEFAULT_QUASI_IDENTIFIERS if qi.column in df.columns]
+    qi_columns = [c for c in qi_columns if c in df.columns and c != sensitive]
+
+    if qi_columns:
+        class_ids = df.groupby(qi_columns, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+    else:
+        class_ids = np.zeros(len(df), dtype=np.int64)
+    n_classes = int(class_ids.max()) + 1 if len(df) else 0
+
+    values, m, ordinal = _sensitive_codes(df[sensitive], sensitive)
+    valid = values >= 0
+    table = np.bincount(class_ids[valid] * m + values[valid], minlength=n_classes * m).reshape(n_classes, m).astype("float64")
+    totals = table.sum(axis=1, keepdims=True)
+    dist = np.divide(table, totals, out=np.zeros_like(table), where=totals > 0)
+    overall = table.sum(axis=0) / max(table.sum(), 1.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(dist > 0, dist * np.log(dist), 0.0).sum(axis=1)
+    if ordinal:
+        emd = np.abs(np.cumsum(dist - overall, axis=1)).sum(axis=1) / max(m - 1, 1)
+    else:
+        emd = np.abs(dist - overall).sum(axis=1) / 2
+    # 沒有任何敏感值的類別視為最差情況
+    emd[totals.ravel() == 0] = 1.0
+
+    stats = pd.DataFrame({
+        "size": np.bincount(class_ids, minlength=n_classes),
+        "distinct": (table > 0).sum(axis=1),
+        "entropy_l": np.exp(entropy),
+        "emd": emd,
+    })
+    return class_ids, stats
+
+
+def _diversity_report(stats: pd.DataFrame, sensitive: str) -> Dict[str, float]:
+    """Worst-class l and t of a statistics frame."""
+    if stats.empty:
+        return {"sensitive": sensitive, "classes": 0, "distinct_l": 0, "entropy_l": 0.0, "t": 0.0}
+    return {
+        "sensitive": sensitive,
+        "classes": len(stats),
+        "distinct_l": int(stats["distinct"].min()),
+        "entropy_l": round(float(stats["entropy_l"].min()), 4),
+        "t": round(float(stats["emd"].max()), 4),
+    }
+
+
+def evaluate_diversity(df: pd.DataFrame, sensitive: str = None, qi_columns: Sequence[str] = None) -> Dict[str, float]:
+    """
+    Report the l-diversity (distinct and entropy) and t-closeness a release achieves.
+
+    Returns:
+        Report with the smallest distinct and entropy l and the largest EMD over classes
+    """
+    sensitive = sensitive or settings.sensitive_attribute
+    if sensitive not in df.columns:
+        return _diversity_report(pd.DataFrame(), sensitive)
+    return _diversity_report(diversity_statistics(df, sensitive, qi_columns)[1], sensitive)
+
+
+def _generalize_to_root(series: pd.Series, rows: np.ndarray) -> pd.Series:
+    """Replace the values of the selected rows by the top-level label."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if ROOT not in series.cat.categories:
+            series = series.cat.add_categories([ROOT])
+        return series.where(~rows, ROOT)
+    return series.astype(object).where(~rows, ROOT)
+
+
+def _enforce_diversity(df: pd.DataFrame, violates: Callable[[pd.DataFrame], pd.Series], sensitive: str,
+                       qi_columns: Optional[Sequence[str]]) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Merge violating classes into one fully generalized class; suppress it if it still violates.
+
+    Merging only joins whole classes, so every class keeps at least k records.
+    """
+    sensitive = sensitive or settings.sensitive_attribute
+    if sensitive not in df.columns or df.empty:
+        return df, {**_diversity_report(pd.DataFrame(), sensitive), "merged_classes": 0, "merged_records": 0, "suppressed": 0}
+    if qi_columns is None:
+        qi_columns = [qi.column for qi in DEFAULT_QUASI_IDENTIFIERS if qi.column in df.columns]
+    qi_columns = [c for c in qi_columns if c in df.columns and c != sensitive]
+
+    class_ids, stats = diversity_statistics(df, sensitive, qi_columns)
+    bad = violates(stats).to_numpy()
+    rows = bad[class_ids]
+    merged_classes, merged_records = int(bad.sum()), int(rows.sum())
+
+    result = df
+    if merged_records:
+        result = df.assign(**{col: _generalize_to_root(df[col], rows) for col in qi_columns})
+        class_ids, stats = diversity_statistics(result, sensitive, qi_columns)
+        bad = violates(stats).to_numpy()
+        rows = bad[class_ids]
+        if rows.any():
+            result = result[~rows]
+
+    report = _diversity_report(stats[~bad], sensitive)
+    report.update({"merged_classes": merged_classes, "merged_records": merged_records, "suppressed": int(rows.sum())})
+    return result, report
+
+
+def enforce_l_diversity(df: pd.DataFrame, l: int = None, kind: str = None, sensitive: str = None,
+                        qi_columns: Sequence[str] = None) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Make every equivalence class l-diverse in its sensitive attribute.
+
+    Args:
+        df: K-anonymous records (see :func:`apply_k_anonymity`)
+        l: Required diversity (default from settings)
+        kind: "distinct" (at least l different values) or "entropy" (entropy of at least log l)
+        sensitive: Sensitive attribute (default from settings)
+        qi_columns: Columns defining the classes (default: DEFAULT_QUASI_IDENTIFIERS present in df)
+
+    Returns:
+        Tuple of (l-diverse DataFrame, report)
+    """
+    l = settings.l_diversity if l is None else l
+    kind = kind or settings.l_diversity_kind
+    if kind == "distinct":
+        violates = lambda stats: stats["distinct"] < l
+    elif kind == "entropy":
+        violates = lambda stats: stats["entropy_l"] < l - 1e-9
+    else:
+        raise ValueError(f"Unknown l-diversity kind: {kind}")
+    return _enforce_diversity(df, violates, sensitive, qi_columns)
+
+
+def enforce_t_closeness(df: pd.DataFrame, t: float = None, sensitive: str = None,
+                        qi_columns: Sequence[str] = None) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Keep every class's sensitive distribution within EMD t of the overall distribution.
+
+    Args:
+        df: K-anonymous records (see :func:`apply_k_anonymity`)
+        t: Largest allowed Earth Mover's Distance (default from settings)
+        sensitive: Sensitive attribute (default from settings)
+        qi_columns: Columns defining the classes (default: DEFAULT_QUASI_IDENTIFIERS present in df)
+
+    Returns:
+        Tuple of (t-close DataFrame, report)
+    """
+    t = settings.t_closeness if t is None else t
+    return _enforce_diversity(df, lambda stats: stats["emd"] > t + 1e-9, sensitive, qi_columns)
+
+
+def apply_l_diversity(df: pd.DataFrame, l: int = None, k: int = None, kind: str = None,
+                      quasi_identifiers: Sequence[QuasiIdentifier] = None) -> pd.DataFrame:
+    """K-anonymize, then enforce l-diversity on the resulting classes."""
+    anon = apply_k_anonymity(df, k, quasi_identifiers)
+    qi_columns = None if quasi_identifiers is None else [qi.column for qi in quasi_identifiers]
+    return enforce_l_diversity(anon, l, kind, qi_columns=qi_columns)[0]
+
+
+def apply_t_closeness(df: pd.DataFrame, t: float = None, k: int = None,
+                      quasi_identifiers: Sequence[QuasiIdentifier] = None) -> pd.DataFrame:
+    """K-anonymize, then enforce t-closeness on the resulting classes."""
+    anon = apply_k_anonymity(df, k, quasi_identifiers)
+    qi_columns = None if quasi_identifiers is None else [qi.column for qi in quasi_identifiers]
+    return enforce_t_closeness(anon, t, qi_columns=qi_columns)[0]
+
+
+# 明顯是人數的欄位名稱（即使位於第一欄也視為人數）
+COUNT_COLUMN_PATTERN = r"(?i)(count|^n$|^n_|_n$|^num|_num|^total$|patients|freq|人數|人次|個案數|病患數|數量|筆數|次數)"
+# 由人數推導、需隨之遮蔽的比例欄位
+PERCENT_COLUMN_PATTERN = r"(?i)(percent|pct|ratio|rate|proportion|share|%|比例|百分比|佔比|比率)"
+# 名稱像人數但其實是維度的欄位
+NON_COUNT_PATTERN = r"(?i)(^(year|month|age|年|年度|年份|月|年齡|收案年)$|_(year|month|id|code)$|date|日期|編號|代碼)"
+
+
+def find_count_columns(df: pd.DataFrame) -> List[str]:
+    """
+    Non-negative integer-valued columns that are not dimensions.
+
+    The name is only a hint: any such column counts (e.g. the diagnosis
+    columns of a ``year x diagnosis`` pivot) unless its name looks like a
+    dimension or a percentage, or it is the first (index) column and its
+    name does not look like a count.
+    """
+    columns = []
+    for i, col in enumerate(df.columns):
+        name = str(col)
+        if not pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            continue
+        if re.search(NON_COUNT_PATTERN, name) or re.search(PERCENT_COLUMN_PATTERN, name):
+            continue
+        if i == 0 and not re.search(COUNT_COLUMN_PATTERN, name):
+            continue
+        values = df[col].dropna().to_numpy(dtype="float64")
+        if (values >= 0).all() and (values == np.round(values)).all():
+            columns.append(col)
+    return columns
+
+
+def _complementary_suppression(values: np.ndarray, mask: np.ndarray, families: List[np.ndarray]) -> np.ndarray:
+    """
+    Extend a suppression mask until no line has exactly one suppressed cell.
+
+    Each family assigns every cell to a line whose total may be known (a
+    column total, a row total, a marginal of one dimension). A lone
+    suppressed cell in a line can be recovered by subtraction, so another
+    positive cell of that line is suppressed too, preferring cells that
+    also close an exposed line of another family, then the smallest value.
+
+    Args:
+        values: Flat cell values
+        mask: Flat primary suppression mask
+        families: Flat line ids per family
+
+    Returns:
+        Extended mask
+    """
+    mask = mask.copy()
+    changed = True
+    while changed:
+        changed = False
+        exposed = [np.bincount(lines, weights=mask)[lines] == 1 for lines in families]
+        for f, lines in enumerate(families):
+            available = exposed[f] & ~mask & (values > 0)
+            if not available.any():
+                continue
+            cells = np.flatnonzero(available)
+            priority = np.zeros(len(cells), dtype=np.int64)
+            for g in range(len(families)):
+                if g != f:
+                    priority += exposed[g][cells]
+            order = cells[np.lexsort((values[cells], -priority, lines[cells]))]
+            _, first = np.unique(lines[order], return_index=True)
+            mask[order[first]] = True
+            exposed = [np.bincount(other, weights=mask)[other] == 1 for other in families]
+            changed = True
+    return mask
+
+
+def suppress_small_cells(df: pd.DataFrame, k: int = None, method: str = None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Protect count cells below k in an aggregate table.
+
+    With ``method="suppress"`` cells with ``0 < count < k`` are blanked, and
+    complementary cells are blanked wherever a suppressed cell could be
+    recovered by subtraction: within each count column, within each row
+    (across count columns), and within each group of every dimension column.
+    With ``method="round"`` every count is rounded to a multiple of k
+    instead, which makes differencing uninformative.
+    Percentage columns are blanked on rows that had a small count.
+
+    Args:
+        df: Aggregate table
+        k: Small-cell threshold (default from settings)
+        method: "suppress" or "round" (default from settings)
+
+    Returns:
+        Tuple of (protected table, report with primary and complementary cell counts)
+    """
     if k is None:
         k = settings.k_anonymity
-    
-    if len(df) < k:
-        # Dataset too small for k-anonymity
-        return pd.DataFrame()
-    
-    # Simple k-anonymity implementation
-    # In production, use more sophisticated algorithms
-    if len(df) >= k:
-        # Group by first column and ensure each group has at least k members
-        grouped = df.groupby(df.columns[0]).filter(lambda x: len(x) >= k)
-        return grouped
-    
-    return pd.DataFrame()
+    if method is None:
+        method = settings.small_cell_method
+    if method not in ("suppress", "round"):
+        raise ValueError(f"Unknown small-cell method: {method}")
+
+    counts = find_count_columns(df)
+    report = {"count_columns": len(counts), "primary": 0, "complementary": 0, "rounded": 0}
+    if not counts or df.empty:
+        return df, report
+
+    values = df[counts].to_numpy(dtype="float64", na_value=np.nan)
+    filled = np.nan_to_num(values, nan=0.0)
+    primary = (filled > 0) & (filled < k)
+    report["primary"] = int(primary.sum())
+
+    result = df.copy()
+    if method == "round":
+        rounded = np.floor(filled / k + 0.5) * k
+        rounded[np.isnan(values)] = np.nan
+        report["rounded"] = int((rounded != values)[~np.isnan(values)].sum())
+        for j, col in enumerate(counts):
+            result[col] = pd.array(rounded[:, j], dtype="Int64")
+        mask = primary
+    else:
+        # 互補抑制：各人數欄合計、各列合計、各維度分組小計都不得只有一格被抑制
+        dims = [
+            col for col in df.columns
+            if col not in counts and not pd.api.types.is_float_dtype(df[col]) and not re.search(PERCENT_COLUMN_PATTERN, str(col))
+        ]
+        n_rows, n_cols = values.shape
+        row_ids, col_ids = np.divmod(np.arange(n_rows * n_cols), n_cols)
+        families = [col_ids]
+        if n_cols > 1:
+            families.append(row_ids)
+        for col in dims:
+            codes = pd.factorize(df[col], use_na_sentinel=False)[0]
+            if codes.max() + 1 < n_rows:
+                families.append(codes[row_ids] * n_cols + col_ids)
+        mask = _complementary_suppression(filled.ravel(), primary.ravel(), families).reshape(primary.shape)
+        report["complementary"] = int(mask.sum()) - report["primary"]
+        for j, col in enumerate(counts):
+            result[col] = pd.array(np.where(mask[:, j], np.nan, values[:, j]), dtype="Int64")
+
+    rows = mask.any(axis=1)
+    if rows.any():
+        for col in df.columns:
+            if col not in counts and re.search(PERCENT_COLUMN_PATTERN, str(col)) and pd.api.types.is_numeric_dtype(df[col]):
+                result[col] = result[col].mask(rows)
+    return result, report
+
+
+# 彙總表中敏感屬性可能使用的欄位名稱（原始欄名、立方體維度、FHIR 扁平化欄位）
+SENSITIVE_COLUMN_ALIASES: Dict[str, List[str]] = {
+    "失智程度": ["失智程度", "severity", "cdr_score"],
+}
+
+
+def enforce_table_diversity(df: pd.DataFrame, privacy_level: str, sensitive: str = None) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    Enforce l-diversity (``l_diverse``) or t-closeness (``t_close``) on an aggregate table.
+
+    Every row is a cell of ``count`` patients; the dimension columns other
+    than the sensitive one define the classes. The cells are expanded into
+    records, run through :func:`enforce_l_diversity` or
+    :func:`enforce_t_closeness` and counted again, so violating classes are
+    merged into one ``*`` class or dropped exactly as for record-level data.
+    Untouched rows are kept verbatim; merged rows have their other columns
+    blanked. A table breaking a sensitive attribute down that cannot be
+    checked (no single count column, or the sensitive values spread over
+    columns) is withheld. Other privacy levels and tables without the
+    sensitive attribute are returned unchanged.
+
+    Returns:
+        Tuple of (protected table, diversity report)
+    """
+    if privacy_level not in ("l_diverse", "t_close"):
+        return df, {}
+    sensitive = sensitive or settings.sensitive_attribute
+    column = next((c for c in SENSITIVE_COLUMN_ALIASES.get(sensitive, [sensitive]) if c in df.columns), None)
+    counts = find_count_columns(df)
+    labels = {label for label in ORDINAL_SENSITIVE.get(sensitive, {}) if not label[0].isdigit()}
+    if column is None and not any(str(col) in labels for col in df.columns):
+        return df, {}
+    if column is None or len(counts) != 1:
+        return df.iloc[0:0], {"withheld": 1}
+    if df.empty:
+        return df, {}
+
+    count = counts[0]
+    dims = [
+        col for col in df.columns
+        if col != count and not pd.api.types.is_float_dtype(df[col]) and not re.search(PERCENT_COLUMN_PATTERN, str(col))
+    ]
+    qi_columns = [col for col in dims if col != column]
+    weights = df[count].fillna(0).to_numpy(dtype="int64")
+    rows = np.repeat(np.arange(len(df)), weights)
+    records = df.iloc[rows][dims].rename(columns={column: sensitive}).reset_index(drop=True)
+
+    if privacy_level == "l_diverse":
+        enforced, report = enforce_l_diversity(records, sensitive=sensitive, qi_columns=qi_columns)
+    else:
+        enforced, report = enforce_t_closeness(records, sensitive=sensitive, qi_columns=qi_columns)
+    if not report["merged_records"] and not report["suppressed"]:
+        return df, report
+
+    merged = (enforced[qi_columns] == ROOT).all(axis=1).to_numpy() if qi_columns else np.zeros(len(enforced), dtype=bool)
+    kept = np.zeros(len(df), dtype=bool)
+    kept[rows[enforced.index.to_numpy()[~merged]]] = True
+    # 被抑制的儲存格沒有紀錄：所屬類別未受影響才保留
+    classes = df[qi_columns].astype(str).agg("\x1f".join, axis=1) if qi_columns else pd.Series("", index=df.index)
+    touched = set(classes[(weights > 0) & ~kept])
+    kept |= (weights == 0) & ~classes.isin(touched).to_numpy()
+
+    merged_rows = (
+        enforced[merged].rename(columns={sensitive: column})
+        .groupby(dims, observed=True, dropna=False, sort=False).size().rename(count).reset_index()
+    )
+    result = pd.concat([df[kept], merged_rows], ignore_index=True)[list(df.columns)]
+    result[count] = result[count].astype("Int64")
+    return result, report
+
+
+def sanitize_artifacts(artifacts_dir: Union[str, Path], privacy_level: str = None, k: int = None) -> Dict[str, Dict[str, int]]:
+    """
+    Apply small-cell protection to every tabular artifact of a job in place.
+
+    CSV files and Arrow IPC streams (``result.arrow``) are rewritten only if
+    a cell changed. ``l_diverse`` and ``t_close`` jobs additionally get
+    :func:`enforce_table_diversity`. Public jobs and differential-privacy
+    jobs (whose counts are already noisy) are left untouched.
+
+    Returns:
+        Per-file suppression report
+    """
+    reports = {}
+    artifacts_dir = Path(artifacts_dir)
+    if privacy_level in ("public", "differential_privacy") or not artifacts_dir.exists():
+        return reports
+
+    def protect(table: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int], bool]:
+        table, report = suppress_small_cells(table, k)
+        changed = bool(report["primary"] or report["rounded"])
+        table, diversity = enforce_table_diversity(table, privacy_level)
+        if diversity.get("withheld") or diversity.get("merged_records") or diversity.get("suppressed"):
+            report["diversity"] = diversity
+            changed = True
+        return table, report, changed
+
+    for path in sorted(artifacts_dir.iterdir()):
+        if path.suffix == ".csv":
+            table, report, changed = protect(pd.read_csv(path))
+            if changed:
+                table.to_csv(path, index=False)
+            reports[path.name] = report
+        elif path.suffix == ".arrow":
+            try:
+                import pyarrow as pa
+            except ImportError:
+                # 無法檢查的表格不得釋出
+                path.unlink()
+                reports[path.name] = {"removed": 1}
+                continue
+            # 先讀入記憶體：改寫同一檔案時不可仍引用其內容
+            with pa.ipc.open_stream(pa.py_buffer(path.read_bytes())) as reader:
+                table, report, changed = protect(reader.read_pandas())
+            if changed:
+                arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+                with pa.ipc.new_stream(str(path), arrow_table.schema) as writer:
+                    writer.write_table(arrow_table)
+            reports[path.name] = report
+    return reports
+
 
 def aggregate_data(df: pd.DataFrame, columns: List[str] = None) -> pd.DataFrame:
     """
@@ -82,6 +1008,12 @@ def sanitize_outputs(df: pd.DataFrame, privacy_level: str) -> pd.DataFrame:
     elif privacy_level == "k_anonymous":
         return apply_k_anonymity(df)
     
+    elif privacy_level == "l_diverse":
+        return apply_l_diversity(df)
+    
+    elif privacy_level == "t_close":
+        return apply_t_closeness(df)
+    
     else:
         # Default to most restrictive
         return apply_k_anonymity(df)
@@ -0,0 +1,132 @@
+"""
+Shared pseudonymization for direct identifiers.
+
+Identifiers are replaced by keyed HMAC-SHA256 tokens, so they cannot be
+reversed by hashing candidate values (e.g. every possible national ID)
+without the secret. Each distinct value is hashed once per column via
+``pd.factorize`` and memoized, so the cost scales with distinct IDs rather
+than rows. The same person gets the same token in every output that uses
+the same secret, and the token cache can be persisted as an encrypted file
+so that later runs reuse earlier tokens.
+"""
+
+import hmac
+import json
+import base64
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+
+TOKEN_LENGTH = 16
+
+# 直接識別欄位 -> 雜湊網域（同一網域內相同值得到相同代碼，不同網域互不相通）
+DIRECT_IDENTIFIERS: Dict[str, str] = {
+    "個案姓名": "name",
+    "身分證字號": "national_id",
+    "病歷號": "medical_record",
+    "個案編號": "case_id",
+}
+
+# 隱私敏感欄位：直接識別欄位加上需另外泛化的出生日期/年齡
+SENSITIVE_COLUMNS = list(DIRECT_IDENTIFIERS) + ["生日/年齡"]
+
+
+class Pseudonymizer:
+    """Keyed, memoized pseudonym generator."""
+
+    def __init__(self, secret: Union[str, bytes], map_path: Optional[Union[str, Path]] = None):
+        if not secret:
+            raise ValueError("Pseudonymization requires a secret (set PSEUDONYM_SECRET)")
+        self._key = secret.encode() if isinstance(secret, str) else secret
+        self.map_path = Path(map_path) if map_path else None
+        self._tokens: Dict[str, Dict[str, str]] = {}
+        self._dirty = False
+        if self.map_path is not None and self.map_path.exists():
+            self._tokens = self._read_map(self.map_path)
+
+    @staticmethod
+    def normalize(values: pd.Series) -> pd.Series:
+        """Canonical form used before hashing (trimmed, upper-case, no float suffix)."""
+        text = values.astype("string").str.strip().str.upper()
+        return text.str.replace(r"^(\d+)\.0$", r"\1", regex=True)
+
+    def _hmac(self, domain: str, value: str) -> str:
+        message = f"{domain}\x1f{value}".encode()
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()[:TOKEN_LENGTH]
+
+    def token(self, value, domain: str) -> Optional[str]:
+        """Pseudonymize a single value."""
+        return self.pseudonymize_series(pd.Series([value], dtype="object"), domain).iloc[0]
+
+    def pseudonymize_series(self, values: pd.Series, domain: str) -> pd.Series:
+        """
+        Replace every value of a Series by its token.
+
+        Args:
+            values: Identifier column
+            domain: Identifier domain (see DIRECT_IDENTIFIERS)
+
+        Returns:
+            Object Series of tokens, NaN where the input was missing or blank
+        """
+        normalized = self.normalize(values)
+        normalized = normalized.where(normalized != "")
+        codes, uniques = pd.factorize(normalized, use_na_sentinel=True)
+
+        cache = self._tokens.setdefault(domain, {})
+        tokens = np.empty(len(uniques) + 1, dtype=object)
+        tokens[-1] = np.nan
+        for i, value in enumerate(uniques):
+            token = cache.get(value)
+            if token is None:
+                token = cache[value] = self._hmac(domain, value)
+                self._dirty = True
+            tokens[i] = token
+
+        return pd.Series(tokens[codes], index=values.index, dtype="object")
+
+    def pseudonymize_frame(self, df: pd.DataFrame, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Return a copy of ``df`` with identifier columns replaced by tokens.
+
+        Args:
+            df: Input DataFrame
+            columns: Columns to pseudonymize (default: DIRECT_IDENTIFIERS present in df)
+        """
+        columns = [c for c in (columns or DIRECT_IDENTIFIERS) if c in df.columns]
+        replaced = {col: self.pseudonymize_series(df[col], DIRECT_IDENTIFIERS.get(col, col)) for col in columns}
+        return df.assign(**replaced)
+
+    def _fernet(self):
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError as e:
+            raise RuntimeError("Persistent pseudonym maps require the 'cryptography' package") from e
+        # 以 HMAC 金鑰衍生出獨立的加密金鑰
+        derived = hmac.new(self._key, b"pseudonym-map-encryption", hashlib.sha256).digest()
+        return Fernet(base64.urlsafe_b64encode(derived))
+
+    def _read_map(self, path: Path) -> Dict[str, Dict[str, str]]:
+        payload = self._fernet().decrypt(path.read_bytes())
+        return json.loads(payload.decode("utf-8"))
+
+    def save(self):
+        """Persist the token cache, encrypted, if a map path is configured and it changed."""
+        if self.map_path is None or not self._dirty:
+            return
+        payload = json.dumps(self._tokens, ensure_ascii=False).encode("utf-8")
+        self.map_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.map_path.with_suffix(self.map_path.suffix + ".tmp")
+        tmp_path.write_bytes(self._fernet().encrypt(payload))
+        tmp_path.replace(self.map_path)
+        self._dirty = False
+
+
+@lru_cache(maxsize=1)
+def get_pseudonymizer() -> Pseudonymizer:
+    """Process-wide pseudonymizer configured from settings."""
+    return Pseudonymizer(settings.pseudonym_secret, settings.pseudonym_map_path)
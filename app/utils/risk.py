@@ -0,0 +1,177 @@
+"""
+Re-identification risk estimation for released record-level files.
+
+Every quasi-identifier column is factorized once; each combination of
+columns is then packed into a single int64 key (mixed radix) so that
+equivalence classes come from one ``np.bincount`` (small key spaces) or
+``np.unique`` (large key spaces) per combination.
+"""
+
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+
+# 釋出檔案中可能被用來連結外部資料的欄位
+RISK_QUASI_IDENTIFIERS = [
+    "生日/年齡", "性別", "收案日期", "失智程度", "失智症診斷", "主治醫師", "APOE", "醫院",
+]
+
+# 風險報告中列出的最差組合數
+WORST_COMBINATIONS = 5
+
+
+def _encode(df: pd.DataFrame, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Factorize each column once (missing values form their own code)."""
+    encoded = {}
+    for col in columns:
+        codes, _ = pd.factorize(df[col], use_na_sentinel=False)
+        encoded[col] = codes.astype(np.int64)
+    return encoded
+
+
+def class_counts(codes: List[np.ndarray]) -> np.ndarray:
+    """
+    Sizes of the non-empty equivalence classes of one column combination.
+
+    Args:
+        codes: Factorized codes of each column in the combination
+
+    Returns:
+        Array with one entry per equivalence class
+    """
+    n = len(codes[0])
+    key = np.zeros(n, dtype=np.int64)
+    space = 1
+    for col_codes in codes:
+        radix = int(col_codes.max()) + 1 if n else 1
+        if space * radix >= 2 ** 62:
+            # 鍵值空間過大時先壓縮目前的鍵
+            _, key = np.unique(key, return_inverse=True)
+            key = key.ravel().astype(np.int64)
+            space = int(key.max()) + 1
+        key = key * radix + col_codes
+        space *= radix
+
+    if space <= 4 * n + 1024:
+        counts = np.bincount(key, minlength=space)
+        return counts[counts > 0]
+    return np.unique(key, return_counts=True)[1]
+
+
+def _metrics(counts: np.ndarray, k: int, sampling_fraction: float) -> Dict[str, float]:
+    """
+    Risk metrics from class sizes alone.
+
+    Every record of a class of size ``f`` has prosecutor risk ``1/f``, so the
+    record average is ``classes / n``. Population class sizes are estimated
+    as ``f / sampling_fraction`` (never smaller than ``f``).
+    """
+    n = int(counts.sum())
+    if n == 0:
+        return {"classes": 0, "uniques": 0, "unique_share": 0.0, "min_class_size": 0,
+                "prosecutor_max": 0.0, "prosecutor_avg": 0.0, "journalist_max": 0.0,
+                "journalist_avg": 0.0, "records_below_k": 0.0}
+    smallest = int(counts.min())
+    uniques = int((counts == 1).sum())
+    return {
+        "classes": len(counts),
+        "uniques": uniques,
+        "unique_share": round(uniques / n, 6),
+        "min_class_size": smallest,
+        "prosecutor_max": round(1.0 / smallest, 6),
+        "prosecutor_avg": round(len(counts) / n, 6),
+        "journalist_max": round(sampling_fraction / smallest, 6),
+        "journalist_avg": round(sampling_fraction * len(counts) / n, 6),
+        "records_below_k": round(float(counts[counts < k].sum()) / n, 6),
+    }
+
+
+def assess_risk(df: pd.DataFrame, quasi_identifiers: Optional[Sequence[str]] = None, max_combination: int = 3,
+                k: Optional[int] = None, sampling_fraction: float = 1.0,
+                combos: Optional[Sequence[Sequence[str]]] = None) -> Dict:
+    """
+    Estimate re-identification risk over quasi-identifier combinations.
+
+    Prosecutor risk assumes the attacker knows the target is in the file
+    (risk ``1/f`` for a class of size ``f``); journalist risk assumes the
+    target is drawn from the population, whose class sizes are estimated as
+    ``f / sampling_fraction``.
+
+    Args:
+        df: Released records
+        quasi_identifiers: Candidate QI columns (default: RISK_QUASI_IDENTIFIERS present in df)
+        max_combination: Largest combination size to evaluate (the full QI set is always included)
+        k: Class-size threshold for the at-risk share (default from settings)
+        sampling_fraction: Share of the population contained in the file
+        combos: Explicit combinations to evaluate instead of all subsets
+
+    Returns:
+        Report with overall metrics, per-combination metrics and the worst combinations
+    """
+    if k is None:
+        k = settings.k_anonymity
+    if not 0 < sampling_fraction <= 1:
+        raise ValueError("sampling_fraction must be in (0, 1]")
+    columns = [c for c in (quasi_identifiers or RISK_QUASI_IDENTIFIERS) if c in df.columns]
+
+    if combos is None:
+        combos = [list(c) for size in range(1, min(max_combination, len(columns)) + 1) for c in combinations(columns, size)]
+        if len(columns) > max_combination:
+            combos.append(list(columns))
+    combos = [list(c) for c in combos if c and all(col in df.columns for col in c)]
+
+    encoded = _encode(df, sorted(set(columns) | {col for combo in combos for col in combo}))
+    results = []
+    for combo in combos:
+        counts = class_counts([encoded[col] for col in combo])
+        results.append({"columns": combo, **_metrics(counts, k, sampling_fraction)})
+
+    results.sort(key=lambda r: (r["unique_share"], r["prosecutor_avg"]), reverse=True)
+    overall = next((r for r in results if r["columns"] == list(columns)), None)
+    if overall is None and columns:
+        overall = {"columns": list(columns), **_metrics(class_counts([encoded[c] for c in columns]), k, sampling_fraction)}
+
+    return {
+        "records": len(df),
+        "k": k,
+        "sampling_fraction": sampling_fraction,
+        "quasi_identifiers": columns,
+        "overall": overall,
+        "worst": results[:WORST_COMBINATIONS],
+        "combinations": results,
+    }
+
+
+def load_release(paths: Sequence[Union[str, Path]], columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Read the given columns of released CSV files as one frame of strings.
+
+    Only the requested columns are parsed, so memory stays proportional to
+    them rather than to the full files.
+    """
+    wanted = set(columns)
+    frames = [pd.read_csv(path, usecols=lambda c: c in wanted, dtype=str) for path in paths]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def assess_files(paths: Sequence[Union[str, Path]], quasi_identifiers: Optional[Sequence[str]] = None, **kwargs) -> Dict:
+    """Run :func:`assess_risk` over released CSV files taken together."""
+    df = load_release(paths, quasi_identifiers or RISK_QUASI_IDENTIFIERS)
+    return assess_risk(df, quasi_identifiers, **kwargs)
+
+
+def format_risk_report(report: Dict) -> str:
+    """Render a risk report as printable lines."""
+    lines = [f"  記錄數: {report['records']}，準識別欄位: {', '.join(report['quasi_identifiers']) or '無'}"]
+    overall = report.get("overall")
+    if overall:
+        lines.append(
+            f"  全部欄位：唯一記錄 {overall['unique_share']:.1%}，起訴者風險 平均 {overall['prosecutor_avg']:.3f} / 最大 {overall['prosecutor_max']:.3f}，"
+            f"記者風險 平均 {overall['journalist_avg']:.3f}，少於 k={report['k']} 的記錄 {overall['records_below_k']:.1%}"
+        )
+    for r in report["worst"]:
+        lines.append(f"  {' + '.join(r['columns'])}: 唯一記錄 {r['unique_share']:.1%}，最小類別 {r['min_class_size']}")
+    return "\n".join(lines)
@@ -0,0 +1,310 @@
+"""
+Synthetic cohort generation with the schema of the yearly cohort files.
+
+A profile describes every column (kind, value distribution, missing rate).
+It can be learned from real files with :func:`learn_profile` or taken from
+DEFAULT_PROFILE. Columns are drawn independently from their marginals, so
+the output matches per-column distributions and missingness but carries no
+joint structure from any real patient. Rows are generated in chunks whose
+random streams depend only on ``(seed, chunk index)``, so output is
+deterministic for a given seed and chunk size.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.utils.dates import ROC_OFFSET, parse_dates
+from app.utils.pseudonymize import DIRECT_IDENTIFIERS
+
+# 可供學習的類別值上限；超過時視為數值或日期欄位
+MAX_CATEGORIES = 50
+
+# 分位數網格（不含極端值，避免洩漏單一病患的最小/最大值）
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+# 原始檔案中出現的日期格式（"roc" 為民國年 0YYY/MM/DD）
+DATE_FORMATS = {
+    "%Y-%m-%d 0:00:00": r"\d{4}-\d{2}-\d{2} 0:00:00",
+    "%Y-%m-%d": r"\d{4}-\d{2}-\d{2}",
+}
+_SLASH_PATTERN = r"(\d{3,4})/\d{2}/\d{2}"
+
+SURNAMES = list("陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周徐蘇葉莊呂江何蕭羅高")
+GIVEN_NAMES = list("淑美麗秀玉金月惠春雪英珠梅雲文明志偉建國榮德嘉俊宏傑信")
+
+DEFAULT_PROFILE: Dict = {
+    "columns": [
+        {"name": "編號", "kind": "sequence"},
+        {"name": "個案編號", "kind": "identifier", "pattern": "case_id"},
+        {"name": "個案姓名", "kind": "identifier", "pattern": "name"},
+        {"name": "性別", "kind": "categorical", "values": ["女", "男"], "weights": [0.58, 0.42], "missing": 0.0},
+        {"name": "身分證字號", "kind": "identifier", "pattern": "national_id"},
+        {"name": "病歷號", "kind": "identifier", "pattern": "medical_record"},
+        {"name": "生日/年齡", "kind": "date", "quantiles": [-16000.0, -5000.0], "missing": 0.05,
+         "formats": {"%Y/%m/%d": 0.7, "roc": 0.3}},
+        {"name": "收案日期", "kind": "date", "quantiles": [17300.0, 20000.0], "missing": 0.01,
+         "formats": {"%Y-%m-%d 0:00:00": 0.9, "roc": 0.1}},
+        {"name": "失智程度", "kind": "categorical",
+         "values": ["極輕度失智", "輕度失智", "中度失智", "重度失智", "0.5", "1", "2", "3"],
+         "weights": [0.36, 0.23, 0.09, 0.03, 0.1, 0.05, 0.02, 0.01], "missing": 0.11},
+        {"name": "0.5程度分級", "kind": "categorical", "values": ["MCI", "VMD", "SCD"],
+         "weights": [0.5, 0.42, 0.08], "missing": 0.8},
+        {"name": "失智症診斷", "kind": "categorical",
+         "values": ["阿茲海默症", "血管型失智症", "其他", "混合性", "不確定或不知道", "帕金森氏失智症"],
+         "weights": [0.47, 0.15, 0.12, 0.12, 0.08, 0.06], "missing": 0.1},
+        {"name": "有無精神行為症狀診斷碼", "kind": "categorical",
+         "values": ["F03.91失智症，有BPSD", "F03.90失智症，無BPSD", "F01.51血管型失智症，有BPSD", "F01.50血管型失智症，無BPSD"],
+         "weights": [0.56, 0.2, 0.18, 0.06], "missing": 0.9},
+        {"name": "主治醫師", "kind": "categorical", "values": ["胡朝榮", "官怡君", "鄔定宇", "陳柏志", "陳龍", "黃立楷"],
+         "weights": [0.4, 0.17, 0.13, 0.13, 0.09, 0.08], "missing": 0.05},
+        {"name": "失智診斷情況負責醫師", "kind": "categorical", "values": ["黃立楷", "趙書屏", "官怡君", "胡副"],
+         "weights": [0.38, 0.26, 0.19, 0.17], "missing": 0.6},
+        {"name": "備註", "kind": "categorical", "values": ["宜追蹤", "MCI", "AD+VAD"], "weights": [0.5, 0.3, 0.2], "missing": 0.95},
+        {"name": "NCV檢查", "kind": "categorical",
+         "values": ["N", "F20015A12,F20024A12,", "F20016A12,F20024A12,", "F20015A12,F20023A12,"],
+         "weights": [0.77, 0.11, 0.06, 0.06], "missing": 0.5},
+        {"name": "APOE", "kind": "categorical", "values": ["3/3", "3/4", "4/4", "2/3", "?"],
+         "weights": [0.55, 0.2, 0.05, 0.05, 0.15], "missing": 0.98},
+    ]
+}
+
+
+def _date_formats(values: pd.Series) -> Dict[str, float]:
+    """Share of each known date format among non-missing values."""
+    text = values.astype("string").str.strip()
+    found = pd.Series(None, index=text.index, dtype="object")
+    for fmt, pattern in DATE_FORMATS.items():
+        found = found.mask(text.str.fullmatch(pattern).fillna(False).to_numpy(dtype=bool), fmt)
+    year = pd.to_numeric(text.str.extract(f"^{_SLASH_PATTERN}$")[0], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    found = found.mask(year >= ROC_OFFSET, "%Y/%m/%d")
+    found = found.mask(year < ROC_OFFSET, "roc")
+    shares = found.value_counts(normalize=True)
+    if shares.empty:
+        return {"%Y-%m-%d": 1.0}
+    return {str(fmt): round(float(share), 4) for fmt, share in shares.items()}
+
+
+def _is_sequence(series: pd.Series) -> bool:
+    """Whether a column is a running row number (unique, increasing integers)."""
+    numbers = pd.to_numeric(series, errors="coerce")
+    return bool(len(numbers) and numbers.notna().all() and numbers.is_unique and numbers.is_monotonic_increasing)
+
+
+def learn_column(name: str, series: pd.Series, k: Optional[int] = None) -> Dict:
+    """
+    Learn one column's profile entry.
+
+    Direct identifiers are never learned, only their format. Categorical
+    values seen fewer than ``k`` times are dropped so that rare free-text
+    values cannot leak into the profile.
+    """
+    k = settings.k_anonymity if k is None else k
+    if name in DIRECT_IDENTIFIERS:
+        return {"name": name, "kind": "identifier", "pattern": DIRECT_IDENTIFIERS[name]}
+
+    present = series.dropna()
+    present = present[present.astype("string").str.strip() != ""]
+    missing = round(1 - len(present) / max(len(series), 1), 4)
+    if present.empty:
+        return {"name": name, "kind": "categorical", "values": [], "weights": [], "missing": 1.0}
+
+    if _is_sequence(series):
+        return {"name": name, "kind": "sequence"}
+
+    numbers = pd.to_numeric(present, errors="coerce")
+    counts = present.astype("string").str.strip().value_counts()
+    if len(counts) > MAX_CATEGORIES:
+        if numbers.notna().mean() >= 0.95:
+            values = numbers.dropna()
+            return {
+                "name": name, "kind": "numeric", "missing": missing,
+                "quantiles": [round(float(q), 4) for q in values.quantile(QUANTILES)],
+                "integer": bool((values == values.round()).all()),
+            }
+        parts = parse_dates(present)
+        if parts["year"].notna().mean() >= 0.9:
+            valid = parts.dropna(subset=["year", "month"])
+            days = pd.to_datetime(pd.DataFrame({
+                "year": valid["year"], "month": valid["month"], "day": valid["day"].fillna(1)
+            }), errors="coerce").dropna()
+            days = (days - pd.Timestamp("1970-01-01")).dt.days
+            return {
+                "name": name, "kind": "date", "missing": missing,
+                "quantiles": [round(float(q), 1) for q in days.quantile(QUANTILES)],
+                "formats": _date_formats(present),
+            }
+
+    kept = counts[counts >= k].head(MAX_CATEGORIES)
+    return {
+        "name": name, "kind": "categorical", "missing": missing,
+        "values": [str(v) for v in kept.index],
+        "weights": [round(float(w), 6) for w in kept / kept.sum()] if len(kept) else [],
+    }
+
+
+def learn_profile(paths: Sequence[Union[str, Path]], k: Optional[int] = None) -> Dict:
+    """Learn a profile from existing cohort CSV files (all read as strings)."""
+    frames = [pd.read_csv(path, dtype=str) for path in paths]
+    df = pd.concat(frames, ignore_index=True)
+    # 各年度檔案各自從 1 開始編號
+    sequences = {name for name in df.columns if all(name in f.columns and _is_sequence(f[name]) for f in frames)}
+    return {"columns": [
+        {"name": name, "kind": "sequence"} if name in sequences else learn_column(name, df[name], k)
+        for name in df.columns
+    ]}
+
+
+def _inverse_cdf(u: np.ndarray, quantiles: Sequence[float]) -> np.ndarray:
+    """Draw from a distribution given by evenly spaced quantiles."""
+    grid = np.linspace(0, 1, len(quantiles))
+    return np.interp(u, grid, quantiles)
+
+
+def _format_days(days: np.ndarray, fmt: str) -> np.ndarray:
+    """Format day numbers (days since 1970-01-01) as strings in one of DATE_FORMATS."""
+    dates = pd.to_datetime(days, unit="D")
+    if fmt == "roc":
+        return np.array([f"{d.year - ROC_OFFSET:04d}/{d.month:02d}/{d.day:02d}" for d in dates], dtype=object)
+    return np.asarray(dates.strftime(fmt), dtype=object)
+
+
+def _fixed_width(numbers: np.ndarray, width: int, prefix: Optional[np.ndarray] = None) -> pd.Series:
+    """Zero-padded decimal strings built as a byte matrix, without per-row Python formatting."""
+    digits = (numbers[:, None] // 10 ** np.arange(width - 1, -1, -1)) % 10 + ord("0")
+    if prefix is not None:
+        digits = np.concatenate([prefix, digits], axis=1)
+    raw = np.ascontiguousarray(digits, dtype=np.uint8).view(f"S{digits.shape[1]}").ravel()
+    return pd.Series(raw.astype(f"U{digits.shape[1]}"), dtype=object)
+
+
+def _generate_column(spec: Dict, start: int, n: int, rng: np.random.Generator) -> pd.Series:
+    kind = spec["kind"]
+    rows = np.arange(start, start + n, dtype=np.int64)
+
+    if kind == "sequence":
+        return pd.Series(rows + 1)
+
+    if kind == "identifier":
+        pattern = spec.get("pattern")
+        if pattern == "name":
+            names = np.array([s + g1 + g2 for s in SURNAMES for g1 in GIVEN_NAMES for g2 in GIVEN_NAMES], dtype=object)
+            return pd.Series(pd.Categorical.from_codes(rng.integers(0, len(names), n), categories=names))
+        # 以與 10 互質的乘數在 10^8 內一對一打散列號，保證不重複
+        scrambled = (rows * 48271 + 12345) % 10 ** 8
+        if pattern == "national_id":
+            letters = np.frombuffer(b"ABCDEFGHJKLMNPQRSTUVXYWZIO", dtype=np.uint8)
+            prefix = np.stack([letters[rng.integers(0, len(letters), n)], rng.integers(1, 3, n) + ord("0")], axis=1)
+            return _fixed_width(scrambled, 8, prefix)
+        if pattern == "case_id":
+            return _fixed_width(rows + 1, 8, np.full((n, 1), ord("C")))
+        return _fixed_width(scrambled, 8)
+
+    missing = rng.random(n) < spec.get("missing", 0.0)
+
+    if kind == "categorical":
+        values = spec.get("values", [])
+        if not values:
+            return pd.Series(pd.Categorical.from_codes(np.full(n, -1), categories=[]))
+        cumulative = np.cumsum(spec["weights"])
+        codes = np.minimum(np.searchsorted(cumulative / cumulative[-1], rng.random(n), side="right"), len(values) - 1)
+        return pd.Series(pd.Categorical.from_codes(np.where(missing, -1, codes), categories=values))
+
+    values = _inverse_cdf(rng.random(n), spec["quantiles"])
+    if kind == "numeric":
+        if spec.get("integer"):
+            values = np.round(values)
+        series = pd.Series(values)
+        return series.astype("Int64").where(~missing) if spec.get("integer") else series.where(~missing)
+
+    if kind == "date":
+        # 每個日期只格式化一次，各列以代碼查表
+        days = np.round(values).astype(np.int64)
+        first = int(days.min())
+        span = np.arange(first, int(days.max()) + 1)
+        formats = list(spec.get("formats", {"%Y-%m-%d": 1.0}).items())
+        cumulative = np.cumsum([share for _, share in formats])
+        choice = np.minimum(np.searchsorted(cumulative / cumulative[-1], rng.random(n), side="right"), len(formats) - 1)
+        table = np.concatenate([_format_days(span, fmt) for fmt, _ in formats])
+        codes = choice * len(span) + (days - first)
+        return pd.Series(pd.Categorical.from_codes(np.where(missing, -1, codes), categories=table))
+
+    raise ValueError(f"Unknown column kind: {kind}")
+
+
+def generate_chunks(n_rows: int, profile: Optional[Dict] = None, seed: int = 0,
+                    chunksize: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    """
+    Yield synthetic rows in chunks.
+
+    Args:
+        n_rows: Total number of rows
+        profile: Column profile (default: DEFAULT_PROFILE)
+        seed: Random seed; chunk ``i`` uses the stream ``(seed, i)``
+        chunksize: Rows per chunk
+
+    Yields:
+        DataFrames with the profile's columns, in order
+    """
+    profile = profile or DEFAULT_PROFILE
+    for index, start in enumerate(range(0, n_rows, chunksize)):
+        n = min(chunksize, n_rows - start)
+        rng = np.random.default_rng([seed, index])
+        yield pd.DataFrame({spec["name"]: _generate_column(spec, start, n, rng) for spec in profile["columns"]})
+
+
+def _to_arrow(chunk: pd.DataFrame):
+    """Arrow table with every column as plain strings (same schema for every chunk)."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    return table.cast(pa.schema([pa.field(name, pa.string()) for name in table.column_names]))
+
+
+def write_synthetic(n_rows: int, csv_path: Optional[Union[str, Path]] = None,
+                    parquet_dir: Optional[Union[str, Path]] = None, profile: Optional[Dict] = None,
+                    seed: int = 0, chunksize: int = 1_000_000) -> Dict[str, int]:
+    """
+    Generate a synthetic cohort straight to CSV and/or a directory of Parquet parts.
+
+    Each chunk is appended to ``csv_path`` and written as
+    ``parquet_dir/part-<i>.parquet``, so memory is bounded by the chunk size.
+    When pyarrow is installed the CSV is written by its C++ writer (string
+    values quoted); otherwise pandas writes it. Parquet output requires pyarrow.
+
+    Returns:
+        Number of rows and chunks written
+    """
+    try:
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        if parquet_dir is not None:
+            raise ImportError("pyarrow is required for Parquet output")
+        pa_csv = pq = None
+
+    if parquet_dir is not None:
+        parquet_dir = Path(parquet_dir)
+        parquet_dir.mkdir(parents=True, exist_ok=True)
+        for old in parquet_dir.glob("part-*.parquet"):
+            old.unlink()
+
+    chunks = 0
+    csv_writer = None
+    try:
+        for index, chunk in enumerate(generate_chunks(n_rows, profile, seed, chunksize)):
+            table = _to_arrow(chunk) if pa_csv is not None else None
+            if csv_path is not None:
+                if table is None:
+                    chunk.to_csv(csv_path, mode="w" if index == 0 else "a", header=index == 0, index=False)
+                else:
+                    if csv_writer is None:
+                        csv_writer = pa_csv.CSVWriter(str(csv_path), table.schema)
+                    csv_writer.write_table(table)
+            if parquet_dir is not None:
+                pq.write_table(table, parquet_dir / f"part-{index}.parquet")
+            chunks += 1
+    finally:
+        if csv_writer is not None:
+            csv_writer.close()
+    return {"rows": n_rows, "chunks": chunks}
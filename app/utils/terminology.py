@@ -0,0 +1,258 @@
+"""
+Terminology service over the cohort's CodeSystems and ValueSets.
+
+Every CodeSystem is loaded into hash maps once: code -> concept for
+``$lookup``/``$validate-code``, and normalized display/designation ->
+code for mapping source values (e.g. ``血管型失智症`` -> ``VD``) during
+conversion. Mapping results are cached per ``(system, value)``, so each
+distinct source value is resolved only once per process.
+"""
+
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.utils.fhir import FHIR_BASE
+
+DIAGNOSIS_SYSTEM = f"{FHIR_BASE}/diagnosis"
+SEVERITY_SYSTEM = f"{FHIR_BASE}/dementia-severity"
+OBSERVATION_SYSTEM = f"{FHIR_BASE}/observation"
+
+
+def _concept(code: str, display: str, *synonyms: str) -> Dict:
+    concept = {"code": code, "display": display}
+    if synonyms:
+        concept["designation"] = [{"value": synonym} for synonym in synonyms]
+    return concept
+
+
+def _code_system(id_: str, url: str, name: str, title: str, concepts: List[Dict]) -> Dict:
+    return {
+        "resourceType": "CodeSystem",
+        "id": id_,
+        "url": url,
+        "version": "1.0.0",
+        "name": name,
+        "title": title,
+        "status": "active",
+        "content": "complete",
+        "valueSet": f"{FHIR_BASE}/ValueSet/{id_}",
+        "concept": concepts,
+    }
+
+
+# 代碼系統；designation 列出來源資料中對應到同一代碼的寫法
+CODE_SYSTEMS: List[Dict] = [
+    _code_system("tmu-alzheimers-diagnosis", DIAGNOSIS_SYSTEM, "TaiwanAlzheimersDiagnosis", "臺灣失智症診斷代碼系統", [
+        _concept("AD", "阿茲海默症", "阿茲海默氏症", "Alzheimer's disease", "G30"),
+        _concept("VD", "血管性失智症", "血管型失智症", "Vascular dementia", "F01"),
+        _concept("MCI", "輕度認知障礙", "Mild cognitive impairment", "G31.84"),
+        _concept("MIX", "混合型失智症", "混合性", "混合型", "Mixed dementia"),
+        _concept("PDD", "帕金森氏失智症", "帕金森氏症失智症", "Parkinson's disease dementia"),
+        _concept("OTH", "其他失智症", "其他"),
+        _concept("UNK", "不確定", "不確定或不知道", "不知道"),
+    ]),
+    _code_system("tmu-alzheimers-severity", SEVERITY_SYSTEM, "TaiwanAlzheimersSeverity", "臺灣失智症嚴重程度代碼系統", [
+        _concept("0.5", "極輕度", "極輕度失智"),
+        _concept("1", "輕度", "輕度失智", "1.0"),
+        _concept("2", "中度", "中度失智", "2.0"),
+        _concept("3", "重度", "重度失智", "3.0"),
+    ]),
+    _code_system("tmu-alzheimers-observation", OBSERVATION_SYSTEM, "TaiwanAlzheimersObservation", "臺灣失智症觀察項目代碼系統", [
+        _concept("record-number", "編號"),
+        _concept("enrollment-date", "收案日期"),
+        _concept("attending-physician", "主治醫師"),
+        _concept("cdr-0.5-stage", "0.5程度分級"),
+        _concept("bpsd-code", "有無精神行為症狀診斷碼"),
+        _concept("note", "備註"),
+        _concept("ncv", "NCV檢查"),
+        _concept("apoe", "APOE"),
+    ]),
+]
+
+# 每個代碼系統的「全部代碼」值集
+VALUE_SETS: List[Dict] = [
+    {
+        "resourceType": "ValueSet",
+        "id": code_system["id"],
+        "url": code_system["valueSet"],
+        "version": code_system["version"],
+        "name": f"{code_system['name']}Codes",
+        "title": f"{code_system['title']}（全部代碼）",
+        "status": "active",
+        "compose": {"include": [{"system": code_system["url"]}]},
+    }
+    for code_system in CODE_SYSTEMS
+]
+
+
+def normalize(text) -> str:
+    """Normalization used for matching source values and displays (NFKC, trimmed, case-folded)."""
+    return unicodedata.normalize("NFKC", str(text)).strip().casefold()
+
+
+class Terminology:
+    """
+    Hash-map indexes over CodeSystems and ValueSets.
+
+    Args:
+        code_systems: CodeSystem resources (``concept`` may nest child concepts)
+        value_sets: ValueSet resources with ``compose.include`` by system and/or concept list
+    """
+
+    def __init__(self, code_systems: Iterable[Dict] = (), value_sets: Iterable[Dict] = ()):
+        self.code_systems: Dict[str, Dict] = {}
+        self._concepts: Dict[str, Dict[str, Dict]] = {}
+        self._designations: Dict[str, Dict[str, str]] = {}
+        self.value_sets: Dict[str, Dict] = {}
+        self._mapped: Dict[Tuple[str, str], Optional[Dict]] = {}
+        for code_system in code_systems:
+            self.add_code_system(code_system)
+        for value_set in value_sets:
+            self.value_sets[value_set["url"]] = value_set
+
+    def add_code_system(self, code_system: Dict):
+        """Index one CodeSystem (replacing an earlier one with the same url)."""
+        url = code_system["url"]
+        concepts: Dict[str, Dict] = {}
+        designations: Dict[str, str] = {}
+        pending = list(code_system.get("concept", []))
+        while pending:
+            concept = pending.pop(0)
+            concepts[concept["code"]] = concept
+            names = [concept["code"], concept.get("display")] + [d.get("value") for d in concept.get("designation", [])]
+            for name in names:
+                if name:
+                    designations.setdefault(normalize(name), concept["code"])
+            pending.extend(concept.get("concept", []))
+        self.code_systems[url] = code_system
+        self._concepts[url] = concepts
+        self._designations[url] = designations
+        self._mapped = {key: value for key, value in self._mapped.items() if key[0] != url}
+
+    def concept(self, system: str, code: str) -> Optional[Dict]:
+        """Concept of ``code`` in ``system``, or None."""
+        return self._concepts.get(system, {}).get(code)
+
+    def map_value(self, system: str, value) -> Optional[Dict]:
+        """
+        Canonical concept for a source value (code, display or designation), or None if unmapped.
+
+        Results (including misses) are cached per ``(system, value)``.
+        """
+        key = (system, str(value))
+        if key not in self._mapped:
+            code = self._designations.get(system, {}).get(normalize(value))
+            self._mapped[key] = None if code is None else self._concepts[system][code]
+        return self._mapped[key]
+
+    def lookup(self, system: str, code: str) -> Optional[Dict]:
+        """
+        ``$lookup`` result as a Parameters resource, or None if the code is unknown.
+        """
+        concept = self.concept(system, code)
+        if concept is None:
+            return None
+        code_system = self.code_systems[system]
+        parameters = [
+            {"name": "name", "valueString": code_system.get("name", system)},
+            {"name": "version", "valueString": code_system.get("version", "")},
+            {"name": "display", "valueString": concept.get("display", "")},
+        ]
+        for designation in concept.get("designation", []):
+            parameters.append({"name": "designation", "part": [{"name": "value", "valueString": designation["value"]}]})
+        return {"resourceType": "Parameters", "parameter": parameters}
+
+    def validate_code(self, code: str, system: Optional[str] = None, url: Optional[str] = None,
+                      display: Optional[str] = None) -> Dict:
+        """
+        ``$validate-code`` against a CodeSystem (``system``) or a ValueSet (``url``).
+
+        A display that does not match the concept's display or a designation
+        makes the result false.
+
+        Raises:
+            KeyError: Unknown CodeSystem or ValueSet
+        """
+        if url is not None:
+            if url not in self.value_sets:
+                raise KeyError(url)
+            members = self._members(self.value_sets[url])
+            found = [(s, c) for s, c in members if c["code"] == code and (system is None or s == system)]
+            concept = found[0][1] if found else None
+            where = f"ValueSet {url}"
+        else:
+            if system not in self.code_systems:
+                raise KeyError(system)
+            concept = self.concept(system, code)
+            where = f"CodeSystem {system}"
+
+        if concept is None:
+            result, message = False, f"Code {code} is not in {where}"
+        elif display is not None and display != concept.get("display") and \
+                self._designations.get(system or found[0][0], {}).get(normalize(display)) != code:
+            result, message = False, f"Display '{display}' does not match code {code} (expected '{concept.get('display')}')"
+        else:
+            result, message = True, None
+
+        parameters = [{"name": "result", "valueBoolean": result}]
+        if concept is not None:
+            parameters.append({"name": "display", "valueString": concept.get("display", "")})
+        if message:
+            parameters.append({"name": "message", "valueString": message})
+        return {"resourceType": "Parameters", "parameter": parameters}
+
+    def _members(self, value_set: Dict) -> List[Tuple[str, Dict]]:
+        """``(system, concept)`` of every code included by a ValueSet's compose."""
+        members = []
+        for include in value_set.get("compose", {}).get("include", []):
+            system = include.get("system")
+            concepts = self._concepts.get(system, {})
+            if include.get("concept"):
+                members.extend((system, concepts[c["code"]]) for c in include["concept"] if c["code"] in concepts)
+            else:
+                members.extend((system, concept) for concept in concepts.values())
+        return members
+
+    def expand(self, url: str, filter_text: Optional[str] = None, offset: int = 0, count: Optional[int] = None) -> Dict:
+        """
+        ``$expand`` of a ValueSet, optionally filtered by a substring of code, display or designation.
+
+        Raises:
+            KeyError: Unknown ValueSet
+        """
+        value_set = self.value_sets[url]
+        members = self._members(value_set)
+        if filter_text:
+            needle = normalize(filter_text)
+            members = [
+                (system, concept) for system, concept in members
+                if any(needle in normalize(name) for name in
+                       [concept["code"], concept.get("display", "")] + [d["value"] for d in concept.get("designation", [])])
+            ]
+        page = members[offset:offset + count if count is not None else None]
+        return {
+            "resourceType": "ValueSet",
+            "id": value_set.get("id"),
+            "url": url,
+            "status": value_set.get("status", "active"),
+            "expansion": {
+                "total": len(members),
+                "offset": offset,
+                "contains": [{"system": system, "code": c["code"], "display": c.get("display", "")} for system, c in page],
+            },
+        }
+
+    def tokens(self, url: str) -> List[str]:
+        """``system|code`` search tokens of every code in a ValueSet (for ``:in`` searches)."""
+        return [f"{system}|{concept['code']}" for system, concept in self._members(self.value_sets[url])]
+
+    def text_tokens(self, text: str) -> List[str]:
+        """``system|code`` tokens of every concept whose display or designation equals ``text`` (for ``:text`` searches)."""
+        key = normalize(text)
+        return [f"{system}|{codes[key]}" for system, codes in self._designations.items() if key in codes]
+
+
+@lru_cache(maxsize=1)
+def get_terminology() -> Terminology:
+    """Terminology over the cohort's CodeSystems and ValueSets."""
+    return Terminology(CODE_SYSTEMS, VALUE_SETS)
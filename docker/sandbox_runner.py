@@ -12,6 +12,177 @@ from pathlib import Path
 import pandas as pd
 import matplotlib.pyplot as plt
 import duckdb
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Rows per Arrow record batch when streaming SQL results
+ARROW_BATCH_ROWS = 65536
+# Maximum result rows kept in memory for chart rendering
+CHART_MAX_ROWS = 10000
+
+def connect_duckdb():
+    """Open a DuckDB connection configured for multithreaded, out-of-core execution."""
+    con = duckdb.connect(database=':memory:')
+    con.execute(f"SET threads TO {int(os.environ.get('DUCKDB_THREADS', os.cpu_count() or 1))}")
+    con.execute(f"SET memory_limit = '{os.environ.get('DUCKDB_MEMORY_LIMIT', '384MB')}'")
+    # Spill to disk instead of failing when aggregations exceed memory_limit
+    con.execute(f"SET temp_directory = '{os.environ.get('DUCKDB_TEMP_DIR', '/tmp/duckdb')}'")
+    con.execute("SET preserve_insertion_order = false")
+    return con
+
+def register_views(con, dataset_path: str) -> list:
+    """
+    Register cohort Parquet files as DuckDB views.
+
+    Views:
+        patients: whole cohort (hive-partitioned cohort/year=*/ or patients.parquet)
+        patients_<year>: one view per yearly partition
+        observations, conditions, patient_views: FHIR-flattened tables under fhir_views/
+    """
+    root = Path(dataset_path)
+    views = []
+    
+    cohort_dir = root / 'cohort'
+    partitions = sorted(p for p in cohort_dir.glob('year=*') if p.is_dir()) if cohort_dir.exists() else []
+    if partitions:
+        con.execute(
+            f"CREATE VIEW patients AS SELECT * FROM read_parquet('{cohort_dir}/*/*.parquet', hive_partitioning = true)"
+        )
+        views.append('patients')
+        for partition in partitions:
+            year = partition.name.split('=', 1)[1]
+            con.execute(f"CREATE VIEW patients_{year} AS SELECT * FROM read_parquet('{partition}/*.parquet')")
+            views.append(f'patients_{year}')
+    elif (root / 'patients.parquet').exists():
+        con.execute(f"CREATE VIEW patients AS SELECT * FROM read_parquet('{root / 'patients.parquet'}')")
+        views.append('patients')
+    
+    fhir_dir = root / 'fhir_views'
+    for view_name, file_name in [('observations', 'observation'), ('conditions', 'condition'), ('patient_views', 'patient')]:
+        view_path = fhir_dir / f'{file_name}.parquet'
+        if view_path.exists():
+            con.execute(f"CREATE VIEW {view_name} AS SELECT * FROM read_parquet('{view_path}')")
+            views.append(view_name)
+    
+    return views
+
+def aggregate_functions(con) -> set:
+    """Names of DuckDB's aggregate functions."""
+    rows = con.execute("SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'").fetchall()
+    return {row[0] for row in rows}
+
+def _has_aggregate(expr, aggregates: set) -> bool:
+    """Whether an expression calls an aggregate (window functions and subqueries do not count)."""
+    if isinstance(expr, list):
+        return any(_has_aggregate(item, aggregates) for item in expr)
+    if not isinstance(expr, dict) or expr.get('class') in ('WINDOW', 'SUBQUERY'):
+        return False
+    if expr.get('class') == 'FUNCTION' and expr.get('function_name') in aggregates:
+        return True
+    return any(_has_aggregate(value, aggregates) for value in expr.values())
+
+def _is_aggregate_node(node: dict, ctes: dict, aggregates: set) -> bool:
+    """
+    Whether every output row of a query node is an aggregate over a group.
+
+    A SELECT qualifies if its select list calls an aggregate and has no ``*``,
+    or if it only filters/orders/projects an aggregated subquery or CTE.
+    """
+    if node.get('type') == 'SET_OPERATION_NODE':
+        children = node.get('children') or [node.get('left'), node.get('right')]
+        return all(child is not None and _is_aggregate_node(child, ctes, aggregates) for child in children)
+    if node.get('type') != 'SELECT_NODE':
+        return False
+    ctes = {**ctes, **{entry['key']: entry['value']['query']['node'] for entry in node.get('cte_map', {}).get('map', [])}}
+    select_list = node.get('select_list', [])
+    if any(expr.get('class') == 'STAR' for expr in select_list):
+        aggregated = False
+    else:
+        aggregated = any(_has_aggregate(expr, aggregates) for expr in select_list)
+    if aggregated:
+        return True
+    if node.get('group_expressions') or node.get('aggregate_handling') != 'STANDARD_HANDLING':
+        return False
+    source = node.get('from_table') or {}
+    if source.get('type') == 'SUBQUERY':
+        return _is_aggregate_node(source['subquery']['node'], ctes, aggregates)
+    if source.get('type') == 'BASE_TABLE' and source.get('table_name') in ctes:
+        return _is_aggregate_node(ctes[source['table_name']], ctes, aggregates)
+    return False
+
+def check_aggregate_sql(con, sql: str):
+    """
+    Reject SQL whose result is not an aggregate table.
+
+    The views hold one row per patient (or per observation/condition), so a
+    plain SELECT would stream record-level quasi-identifiers into the
+    artifacts, where small-cell suppression cannot see them (there is no
+    count column to protect).
+
+    Raises:
+        ValueError: If the SQL is not a single SELECT or its rows are not aggregates
+    """
+    parsed = json.loads(con.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    if parsed.get('error'):
+        raise ValueError(f"Only a single SELECT statement is allowed: {parsed.get('error_message')}")
+    statements = parsed.get('statements', [])
+    if len(statements) != 1:
+        raise ValueError("Only a single SELECT statement is allowed")
+    if not _is_aggregate_node(statements[0]['node'], {}, aggregate_functions(con)):
+        raise ValueError("SQL results must be aggregates (GROUP BY with COUNT/SUM/AVG ...); record-level rows are not released")
+
+def render_chart(data: pd.DataFrame, chart: dict, output_path: Path):
+    """Render a chart spec ({'type', 'x', 'y', 'title'}) from SQL results."""
+    chart_type = chart.get('type', 'bar')
+    x = chart.get('x') or data.columns[0]
+    y = chart.get('y') or [c for c in data.columns if c != x]
+    
+    plt.figure(figsize=(12, 6))
+    ax = plt.gca()
+    if chart_type == 'pie':
+        data.set_index(x)[y if isinstance(y, str) else y[0]].plot(kind='pie', ax=ax, autopct='%1.1f%%')
+        ax.set_ylabel('')
+    elif chart_type == 'line':
+        data.plot(x=x, y=y, kind='line', ax=ax, marker='o')
+    else:
+        data.plot(x=x, y=y, kind='bar', ax=ax)
+    ax.set_title(chart.get('title', ''), fontsize=16, fontweight='bold')
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    plt.close()
+
+def run_sql(con, sql: str, chart: dict, artifacts_dir: str) -> list:
+    """
+    Execute aggregate SQL and stream the result to Arrow and CSV batch by batch.
+
+    Returns:
+        Names of the outputs that were written
+    """
+    # 先檢查再執行，明細資料不會寫入任何產出檔
+    check_aggregate_sql(con, sql)
+    artifacts_path = Path(artifacts_dir)
+    artifacts_path.mkdir(exist_ok=True)
+    
+    reader = con.execute(sql).fetch_record_batch(ARROW_BATCH_ROWS)
+    chart_batches = []
+    chart_rows = 0
+    
+    with pa.ipc.new_stream(str(artifacts_path / 'result.arrow'), reader.schema) as arrow_writer, \
+            pa_csv.CSVWriter(str(artifacts_path / 'summary.csv'), reader.schema) as csv_writer:
+        for batch in reader:
+            arrow_writer.write_batch(batch)
+            csv_writer.write_batch(batch)
+            if chart and chart_rows < CHART_MAX_ROWS:
+                chart_batches.append(batch)
+                chart_rows += batch.num_rows
+    
+    outputs = ['table']
+    if chart and chart_batches:
+        data = pa.Table.from_batches(chart_batches).slice(0, CHART_MAX_ROWS).to_pandas()
+        render_chart(data, chart, artifacts_path / 'plot.png')
+        outputs.append('plot')
+    
+    return outputs
 
 def load_dataset():
     """Load dataset from DATASET_PATH, preferring Parquet over Excel."""
@@ -49,11 +220,27 @@ def save_artifacts(artifacts_dir: str, outputs: dict):
 def main():
     """Main execution function."""
     try:
-        # Load dataset
-        df = load_dataset()
-        
         # Read input from stdin (JSON)
         input_data = json.loads(sys.stdin.read())
+        artifacts_dir = os.environ.get('ARTIFACT_DIR', '/artifacts')
+        
+        # Register cohort views for both execution modes
+        con = connect_duckdb()
+        views = register_views(con, os.environ.get('DATASET_PATH', '/data'))
+        
+        # SQL mode: query the views directly, no row-level DataFrame is loaded
+        if input_data.get('mode') == 'sql':
+            outputs = run_sql(con, input_data.get('sql', ''), input_data.get('chart'), artifacts_dir)
+            print(json.dumps({
+                'status': 'success',
+                'outputs': outputs,
+                'views': views,
+                'error': None
+            }))
+            return
+        
+        # Load dataset
+        df = load_dataset()
         code = input_data.get('code', '')
         
         # Execute the code in a controlled environment
@@ -62,6 +249,7 @@ def main():
             'pd': pd,
             'plt': plt,
             'duckdb': duckdb,
+            'con': con,
             'os': os,
             'Path': Path
         }
@@ -85,7 +273,6 @@ def main():
             outputs['explanation'] = str(local_vars['explanation'])
         
         # Save artifacts
-        artifacts_dir = os.environ.get('ARTIFACT_DIR', '/artifacts')
         save_artifacts(artifacts_dir, outputs)
         
         # Return success
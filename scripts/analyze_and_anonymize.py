@@ -10,7 +10,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
-import hashlib
 import json
 from datetime import datetime
 
@@ -18,58 +17,96 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 導入隱私保護工具
-from app.utils.privacy import apply_k_anonymity, aggregate_data, sanitize_outputs
+from app.utils.privacy import (
+    k_anonymize, stream_k_anonymize, enforce_l_diversity, enforce_t_closeness, aggregate_data, sanitize_outputs
+)
+from app.utils.dates import parse_ages
+from app.utils.pseudonymize import get_pseudonymizer
 
 # 設定
 DATA_DIR = "data/alzheimers_cohort_v1"
 OUTPUT_DIR = "artifacts/anonymized_data"
 ANALYSIS_DIR = "artifacts/analysis_results"
 K_ANONYMITY_VALUE = 10
+L_DIVERSITY_VALUE = 3  # 每個等價類別至少包含的不同失智程度數
+T_CLOSENESS_VALUE = 0.3  # 等價類別失智程度分布與整體分布的最大 EMD 距離
+STREAM_THRESHOLD_MB = 200  # 超過此大小的檔案改用分批串流處理
+CHUNK_SIZE = 100_000
 
 # 確保輸出目錄存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(ANALYSIS_DIR, exist_ok=True)
 
-# 隱私敏感欄位 (這些欄位將被特別處理)
-SENSITIVE_COLUMNS = [
-    "個案姓名", "身分證字號", "病歷號", "生日/年齡", "個案編號"
-]
-
-def hash_value(value):
-    """將值雜湊化以保護隱私"""
-    if pd.isna(value):
-        return np.nan
-    return hashlib.sha256(str(value).encode()).hexdigest()[:16]
-
 def anonymize_dataframe(df, k=K_ANONYMITY_VALUE):
     """對資料進行去識別化處理"""
-    # 複製資料框以避免修改原始資料
-    anon_df = df.copy()
+    # 1. 處理敏感欄位：直接識別欄位以金鑰雜湊代碼取代（回傳新的資料框，不修改原始資料）
+    anon_df = get_pseudonymizer().pseudonymize_frame(df)
     
-    # 1. 處理敏感欄位
-    for col in SENSITIVE_COLUMNS:
-        if col in anon_df.columns:
-            if col == "生日/年齡":
-                # 將年齡轉換為年齡段
-                try:
-                    anon_df[col] = pd.to_numeric(anon_df[col], errors='coerce')
-                    anon_df[col] = pd.cut(anon_df[col], 
-                                         bins=[0, 50, 60, 70, 80, 90, 120],
-                                         labels=['<50歲', '50-59歲', '60-69歲', '70-79歲', '80-89歲', '90+歲'])
-                except:
-                    anon_df[col] = "未知年齡"
-            else:
-                # 其他敏感欄位進行雜湊化
-                anon_df[col] = anon_df[col].apply(hash_value)
+    # 2. 應用 k-匿名化：以 Mondrian 演算法泛化準識別欄位（年齡、性別、收案年月、醫院、診斷）
+    anon_df, report = k_anonymize(anon_df, k)
+    print(f"  k-匿名化: {report['classes']} 個等價類別，最小類別 {report['min_class_size']} 人，資訊損失 {report['information_loss']:.1%}")
     
-    # 2. 應用 k-匿名化
-    anon_df = apply_k_anonymity(anon_df, k)
+    # 3. l-多樣性與 t-相近性：敏感屬性（失智程度）過於集中的類別併入最上層，仍不符合者刪除
+    anon_df, report = enforce_l_diversity(anon_df, L_DIVERSITY_VALUE)
+    print(f"  l-多樣性: 合併 {report['merged_classes']} 個類別，刪除 {report['suppressed']} 筆，最小 l = {report['distinct_l']}")
+    anon_df, report = enforce_t_closeness(anon_df, T_CLOSENESS_VALUE)
+    print(f"  t-相近性: 合併 {report['merged_classes']} 個類別，刪除 {report['suppressed']} 筆，最大 EMD = {report['t']:.3f}")
     
     return anon_df
 
+def anonymize_csv_streaming(file_path, output_path, k=K_ANONYMITY_VALUE):
+    """
+    分批串流去識別化，記憶體用量與檔案大小無關
+    
+    第一輪只讀準識別欄位計算各組合人數，第二輪逐批泛化、雜湊識別欄位並寫出
+    """
+    pseudonymizer = get_pseudonymizer()
+    report = stream_k_anonymize(
+        file_path, output_path, k,
+        transform=pseudonymizer.pseudonymize_frame,
+        chunksize=CHUNK_SIZE
+    )
+    print(f"  k-匿名化: {report['classes']} 個等價類別，最小類別 {report['min_class_size']} 人，資訊損失 {report['information_loss']:.1%}")
+    return report
+
+def analyze_csv_streaming(file_path):
+    """大型 CSV 檔案的串流處理：只產生統計資訊與去識別化資料，不載入整個檔案"""
+    file_name = os.path.basename(file_path)
+    file_base = os.path.splitext(file_name)[0]
+    output_path = os.path.join(ANALYSIS_DIR, file_base)
+    os.makedirs(output_path, exist_ok=True)
+    
+    anon_output_path = os.path.join(OUTPUT_DIR, f"{file_base}_anonymized.csv")
+    report = anonymize_csv_streaming(file_path, anon_output_path)
+    
+    columns = list(pd.read_csv(file_path, nrows=0).columns)
+    stats = {
+        "file_name": file_name,
+        "record_count": report["records"] + report["suppressed"],
+        "column_count": len(columns),
+        "columns": columns,
+        "file_size": os.path.getsize(file_path) / (1024 * 1024),  # MB
+        "streamed": True,
+        "timestamp": datetime.now().isoformat()
+    }
+    with open(os.path.join(output_path, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    
+    print(f"  檔案較大，已使用串流模式處理（未產生視覺化圖表）")
+    return {
+        "file_name": file_name,
+        "original_path": file_path,
+        "anonymized_path": anon_output_path,
+        "analysis_path": output_path,
+        "status": "success"
+    }
+
 def analyze_csv(file_path):
     """分析 CSV 檔案並產生統計資訊"""
     try:
+        if os.path.getsize(file_path) > STREAM_THRESHOLD_MB * 1024 * 1024:
+            return analyze_csv_streaming(file_path)
+        
         # 讀取 CSV 檔案
         df = pd.read_csv(file_path)
         file_name = os.path.basename(file_path)
@@ -145,8 +182,7 @@ def generate_visualizations(df, anon_df, output_path, file_base):
                 
         if age_col:
             try:
-                ages = pd.to_numeric(df[age_col], errors='coerce')
-                ages = ages[(ages > 0) & (ages < 120)]  # 過濾有效年齡
+                ages = parse_ages(df[age_col]).dropna()  # 過濾有效年齡
                 
                 plt.figure(figsize=(10, 6))
                 sns.histplot(ages, bins=20, kde=True)
@@ -197,8 +233,7 @@ def generate_visualizations(df, anon_df, output_path, file_base):
         if age_col:
             try:
                 # 原始年齡分布
-                orig_ages = pd.to_numeric(df[age_col], errors='coerce')
-                orig_ages = orig_ages[(orig_ages > 0) & (orig_ages < 120)]
+                orig_ages = parse_ages(df[age_col]).dropna()
                 
                 plt.figure(figsize=(12, 6))
                 plt.subplot(1, 2, 1)
@@ -361,6 +396,9 @@ def main():
         results.append(result)
         print(f"完成 {file_path} 處理，狀態: {result['status']}")
     
+    # 保存代碼對照表，下次執行沿用相同代碼
+    get_pseudonymizer().save()
+    
     # 生成摘要報告
     summary = generate_summary_report(results)
     
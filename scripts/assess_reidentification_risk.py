@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+評估去識別化檔案的再識別風險（等價類別大小、起訴者/記者風險、唯一記錄比例）
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.risk import RISK_QUASI_IDENTIFIERS, assess_files, format_risk_report
+
+# 設定
+ANONYMIZED_DIR = "static/downloads/anonymized_csv"
+K_ANONYMITY_VALUE = 10
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="評估釋出檔案的再識別風險")
+    parser.add_argument("path", nargs="?", default=ANONYMIZED_DIR, help="CSV 檔案或資料夾")
+    parser.add_argument("--qi", nargs="+", default=RISK_QUASI_IDENTIFIERS, help="準識別欄位")
+    parser.add_argument("--max-combination", type=int, default=3, help="評估的欄位組合最大大小")
+    parser.add_argument("--k", type=int, default=K_ANONYMITY_VALUE, help="等價類別大小門檻")
+    parser.add_argument("--sampling-fraction", type=float, default=1.0, help="檔案佔母體的比例（記者風險）")
+    parser.add_argument("--output", help="將完整報告寫入 JSON 檔案")
+    return parser.parse_args()
+
+def main():
+    """主函數"""
+    args = parse_args()
+    
+    if os.path.isdir(args.path):
+        csv_files = [os.path.join(args.path, f) for f in sorted(os.listdir(args.path)) if f.endswith('.csv')]
+    else:
+        csv_files = [args.path]
+    
+    if not csv_files:
+        print(f"在 {args.path} 中找不到 CSV 檔案")
+        return
+    
+    print(f"評估 {len(csv_files)} 個 CSV 檔案的再識別風險...")
+    report = assess_files(
+        csv_files, args.qi,
+        max_combination=args.max_combination,
+        k=args.k,
+        sampling_fraction=args.sampling_fraction
+    )
+    print(format_risk_report(report))
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"完整報告已保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
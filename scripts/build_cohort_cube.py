@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+在資料匯入時建立預先彙總的世代資料立方體 (cohort cube)
+"""
+
+import argparse
+import os
+import sys
+import pandas as pd
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.services.cohort_cube import CohortCube
+from app.utils.fhir import PatientLinkage
+
+# 設定（輸出路徑與 k 預設取自 settings，與快速路徑載入的立方體一致）
+DATA_DIR = "data/alzheimers_cohort_v1"
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="建立預先彙總的世代資料立方體")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="世代資料 CSV 資料夾")
+    parser.add_argument("--output", default=settings.cube_path, help="立方體輸出路徑（預設為 CUBE_PATH）")
+    parser.add_argument("--k", type=int, default=settings.k_anonymity, help="小格門檻（預設為 K_ANONYMITY）")
+    return parser.parse_args()
+
+def main():
+    """主函數"""
+    args = parse_args()
+    print("開始建立世代資料立方體...")
+
+    # 獲取所有 CSV 檔案
+    csv_files = [os.path.join(args.data_dir, f) for f in sorted(os.listdir(args.data_dir)) if f.endswith('.csv')]
+
+    if not csv_files:
+        print(f"在 {args.data_dir} 中找不到 CSV 檔案")
+        return
+
+    print(f"找到 {len(csv_files)} 個 CSV 檔案")
+    df = pd.concat([pd.read_csv(f, dtype=str) for f in csv_files], ignore_index=True)
+
+    # 跨年度連結同一病患，記錄每位病患最多貢獻的列數（差分隱私的敏感度）
+    linkage = PatientLinkage()
+    linkage.add_frame(df)
+    patient_keys = linkage.freeze().resolve(df)
+    cube = CohortCube.from_dataframe(df, k=args.k, patient_keys=patient_keys)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    cube.save(args.output)
+
+    print(f"維度: {', '.join(f'{d}({len(cube.labels[d])})' for d in cube.dims)}")
+    print(f"總列數: {cube.total}（每位病患最多 {cube.max_contribution} 列）")
+    print(f"小於 k={args.k} 的小格數: {int(cube.small_cells.sum())}")
+    print(f"世代資料立方體已保存至: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+將 FHIR 資源攤平成 patient / observation / condition 表格並存成 Parquet，供 sandbox 的 DuckDB 查詢
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.fhir_views import materialize_views
+
+# 設定
+SOURCE_DIR = "fhir/resources"
+OUTPUT_DIR = "data/alzheimers_cohort_v1/fhir_views"
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="建立 FHIR 扁平化 Parquet 表格")
+    parser.add_argument("--source", default=SOURCE_DIR, help="逐檔 JSON 資源資料夾或 NDJSON 分片資料夾")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Parquet 輸出資料夾（sandbox 讀取 <資料集>/fhir_views）")
+    parser.add_argument("--manifest", help="資源內容雜湊清單（預設為 <source>/manifest.json）")
+    parser.add_argument("--full", action="store_true", help="忽略上次狀態，全部重建")
+    return parser.parse_args()
+
+def main():
+    """主函數"""
+    args = parse_args()
+    start = time.time()
+    summary = materialize_views(args.source, args.output_dir, args.manifest, full=args.full)
+    for name, stats in summary.items():
+        print(f"{name}: {stats['rows']} 列（重新攤平 {stats['refreshed']}，移除 {stats['removed']}）")
+    print(f"完成，耗時 {time.time() - start:.1f} 秒，輸出至: {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
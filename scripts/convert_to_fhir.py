@@ -9,7 +9,7 @@ import pandas as pd
 import numpy as np
 import json
 import hashlib
-import uuid
+import argparse
 from pathlib import Path
 from datetime import datetime, date
 import re
@@ -17,10 +17,19 @@ import re
 # 添加專案根目錄到路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from app.utils.fhir_manifest import MANIFEST_FILE, ResourceManifest
+from app.utils.fhir_parallel import build_linkage, convert_parallel
+from app.utils.fhir_references import REFERENCES_FILE, ReferenceIndex
+from app.utils.ndjson_store import DEFAULT_SHARD_BYTES, NDJSONWriter
+from app.utils.pseudonymize import get_pseudonymizer
+from app.utils.terminology import CODE_SYSTEMS, VALUE_SETS
+
 # 設定
 DATA_DIR = "data/alzheimers_cohort_v1"
 OUTPUT_DIR = "fhir/resources"
+NDJSON_DIR = "fhir/ndjson"
 K_ANONYMITY_VALUE = 10
+CHUNK_SIZE = 2000  # 每次讀入的 CSV 列數
 
 # 確保輸出目錄存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -39,284 +48,51 @@ RESOURCE_TYPES = {
 for dir_path in RESOURCE_TYPES.values():
     os.makedirs(dir_path, exist_ok=True)
 
-# 隱私敏感欄位
-SENSITIVE_COLUMNS = [
-    "個案姓名", "身分證字號", "病歷號", "生日/年齡", "個案編號"
-]
-
-def generate_uuid(value):
-    """生成一致的 UUID，相同輸入產生相同 UUID"""
-    if pd.isna(value):
-        return str(uuid.uuid4())
-    hash_obj = hashlib.md5(str(value).encode())
-    return str(uuid.UUID(hash_obj.hexdigest()))
-
-def hash_value(value):
-    """將值雜湊化以保護隱私"""
-    if pd.isna(value):
-        return None
-    return hashlib.sha256(str(value).encode()).hexdigest()[:16]
-
-def convert_to_age_group(age_value):
-    """將年齡轉換為年齡段"""
-    try:
-        age = float(age_value)
-        if age < 50:
-            return "<50歲"
-        elif age < 60:
-            return "50-59歲"
-        elif age < 70:
-            return "60-69歲"
-        elif age < 80:
-            return "70-79歲"
-        elif age < 90:
-            return "80-89歲"
-        else:
-            return "90+歲"
-    except (ValueError, TypeError):
-        return "未知年齡"
-
-def create_patient_resource(patient_data):
-    """創建 Patient 資源"""
-    patient_id = generate_uuid(patient_data.get("個案編號", "") + patient_data.get("身分證字號", ""))
-    
-    # 處理性別
-    gender = "unknown"
-    if "性別" in patient_data:
-        gender_value = patient_data["性別"]
-        if gender_value == "男":
-            gender = "male"
-        elif gender_value == "女":
-            gender = "female"
+def convert_files(csv_files, write_batch, linkage, workers):
+    """轉換全部檔案；同一病人跨檔合併為一個 Patient 後統一寫出（結果與行程數無關）"""
+    converted = {}
     
-    # 處理年齡
-    age_group = None
-    if "生日/年齡" in patient_data:
-        age_group = convert_to_age_group(patient_data["生日/年齡"])
+    def report(file_path, counts):
+        converted[file_path] = counts
+        print(f"  完成轉換 {os.path.basename(file_path)}: " + "，".join(f"{k} {v}" for k, v in counts.items()), flush=True)
     
-    # 創建 Patient 資源
-    patient_resource = {
-        "resourceType": "Patient",
-        "id": patient_id,
-        "meta": {
-            "profile": ["http://hl7.org/fhir/R4/patient.html"],
-            "versionId": "1",
-            "lastUpdated": datetime.now().isoformat()
-        },
-        "identifier": [
-            {
-                "system": "http://tmu.edu.tw/fhir/alzheimers/patient-id",
-                "value": hash_value(patient_data.get("個案編號", ""))
-            }
-        ],
-        "active": True,
-        "gender": gender,
-        "extension": []
-    }
-    
-    # 添加年齡段擴展
-    if age_group:
-        patient_resource["extension"].append({
-            "url": "http://tmu.edu.tw/fhir/alzheimers/age-group",
-            "valueString": age_group
-        })
-    
-    return patient_resource
-
-def create_condition_resource(condition_data, patient_id):
-    """創建 Condition 資源"""
-    condition_id = generate_uuid(f"{patient_id}_{condition_data.get('失智症診斷', '')}")
-    
-    # 處理失智程度
-    severity = None
-    if "失智程度" in condition_data:
-        severity = condition_data["失智程度"]
-    
-    # 創建 Condition 資源
-    condition_resource = {
-        "resourceType": "Condition",
-        "id": condition_id,
-        "meta": {
-            "profile": ["http://hl7.org/fhir/R4/condition.html"],
-            "versionId": "1",
-            "lastUpdated": datetime.now().isoformat()
-        },
-        "subject": {
-            "reference": f"Patient/{patient_id}"
-        },
-        "code": {
-            "coding": [
-                {
-                    "system": "http://tmu.edu.tw/fhir/alzheimers/diagnosis",
-                    "code": hash_value(condition_data.get("失智症診斷", "")),
-                    "display": "失智症"
-                }
-            ],
-            "text": "失智症"
-        },
-        "clinicalStatus": {
-            "coding": [
-                {
-                    "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
-                    "code": "active",
-                    "display": "Active"
-                }
-            ]
-        },
-        "verificationStatus": {
-            "coding": [
-                {
-                    "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
-                    "code": "confirmed",
-                    "display": "Confirmed"
-                }
-            ]
-        }
-    }
-    
-    # 添加嚴重程度
-    if severity:
-        condition_resource["severity"] = {
-            "coding": [
-                {
-                    "system": "http://tmu.edu.tw/fhir/alzheimers/dementia-severity",
-                    "code": hash_value(severity),
-                    "display": severity
-                }
-            ],
-            "text": severity
-        }
-    
-    return condition_resource
-
-def create_observation_resource(observation_data, patient_id):
-    """創建 Observation 資源"""
-    observation_id = generate_uuid(f"{patient_id}_{observation_data.get('觀察項目', '')}_{observation_data.get('觀察時間', '')}")
-    
-    # 創建 Observation 資源
-    observation_resource = {
-        "resourceType": "Observation",
-        "id": observation_id,
-        "meta": {
-            "profile": ["http://hl7.org/fhir/R4/observation.html"],
-            "versionId": "1",
-            "lastUpdated": datetime.now().isoformat()
-        },
-        "status": "final",
-        "subject": {
-            "reference": f"Patient/{patient_id}"
-        },
-        "code": {
-            "coding": [
-                {
-                    "system": "http://tmu.edu.tw/fhir/alzheimers/observation",
-                    "code": hash_value(observation_data.get("觀察項目", "")),
-                    "display": observation_data.get("觀察項目", "未知觀察")
-                }
-            ],
-            "text": observation_data.get("觀察項目", "未知觀察")
-        }
-    }
-    
-    # 添加觀察值
-    if "觀察值" in observation_data:
-        try:
-            value = float(observation_data["觀察值"])
-            observation_resource["valueQuantity"] = {
-                "value": value,
-                "unit": observation_data.get("單位", ""),
-                "system": "http://unitsofmeasure.org",
-                "code": observation_data.get("單位代碼", "")
-            }
-        except (ValueError, TypeError):
-            observation_resource["valueString"] = str(observation_data["觀察值"])
-    
-    return observation_resource
-
-def extract_observations_from_row(row, patient_id):
-    """從資料行中提取觀察項目"""
-    observations = []
-    
-    # 檢查可能的觀察項目欄位
-    for col in row.index:
-        # 跳過已知的非觀察項目欄位
-        if col in SENSITIVE_COLUMNS or col == "性別" or "失智" in col:
-            continue
-        
-        # 如果有值，創建觀察項目
-        if pd.notna(row[col]) and row[col] != "":
-            observation_data = {
-                "觀察項目": col,
-                "觀察值": row[col],
-                "觀察時間": row.get("收案日期", datetime.now().isoformat())
-            }
-            observations.append(create_observation_resource(observation_data, patient_id))
-    
-    return observations
-
-def process_csv_file(file_path):
-    """處理 CSV 檔案並轉換為 FHIR 資源"""
+    print(f"以 {max(workers, 1)} 個行程轉換 {len(csv_files)} 個檔案")
     try:
-        print(f"處理檔案: {file_path}")
-        df = pd.read_csv(file_path)
-        file_name = os.path.basename(file_path)
-        
-        patients = []
-        conditions = []
-        observations = []
-        
-        # 處理每一行資料
-        for _, row in df.iterrows():
-            # 創建 Patient 資源
-            patient_resource = create_patient_resource(row)
-            patient_id = patient_resource["id"]
-            patients.append(patient_resource)
-            
-            # 如果有失智症診斷，創建 Condition 資源
-            if "失智症診斷" in row and pd.notna(row["失智症診斷"]):
-                condition_resource = create_condition_resource(row, patient_id)
-                conditions.append(condition_resource)
-            
-            # 提取觀察項目
-            patient_observations = extract_observations_from_row(row, patient_id)
-            observations.extend(patient_observations)
-        
-        # 保存 FHIR 資源
-        save_resources("Patient", patients)
-        save_resources("Condition", conditions)
-        save_resources("Observation", observations)
-        
-        print(f"完成處理檔案: {file_path}")
-        print(f"創建了 {len(patients)} 個 Patient 資源")
-        print(f"創建了 {len(conditions)} 個 Condition 資源")
-        print(f"創建了 {len(observations)} 個 Observation 資源")
-        
-        return {
-            "file_name": file_name,
-            "patient_count": len(patients),
-            "condition_count": len(conditions),
-            "observation_count": len(observations),
-            "status": "success"
-        }
-        
+        counts = convert_parallel(csv_files, write_batch, linkage, workers, CHUNK_SIZE, on_file=report)
     except Exception as e:
-        print(f"處理 {file_path} 時發生錯誤: {e}")
-        return {
-            "file_name": os.path.basename(file_path),
-            "status": "error",
-            "error": str(e)
+        print(f"轉換時發生錯誤: {e}")
+        return [{"file_name": os.path.basename(p), "status": "error", "error": str(e)} for p in csv_files]
+    
+    print("合併後寫出: " + "，".join(f"{k} {v}" for k, v in counts.items()))
+    return [
+        {
+            "file_name": os.path.basename(p),
+            "patient_count": converted.get(p, {}).get("Patient", 0),
+            "condition_count": converted.get(p, {}).get("Condition", 0),
+            "observation_count": converted.get(p, {}).get("Observation", 0),
+            "status": "success"
         }
+        for p in csv_files
+    ]
+
+def file_fingerprint(file_path):
+    """來源檔案指紋（內容雜湊再經假名化金鑰處理，換金鑰或代碼系統變更時視為已變更）"""
+    digest = hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+    terminology = hashlib.sha256(json.dumps(CODE_SYSTEMS, sort_keys=True).encode()).hexdigest()
+    return get_pseudonymizer().token(f"{digest}:{terminology}", "source-file")
 
 def save_resources(resource_type, resources):
-    """保存 FHIR 資源到檔案"""
+    """保存 FHIR 資源到檔案（先寫暫存檔再改名，中斷時不會留下半個 JSON）"""
     output_dir = RESOURCE_TYPES[resource_type]
     
     for resource in resources:
         resource_id = resource["id"]
         output_path = os.path.join(output_dir, f"{resource_id}.json")
+        tmp_path = output_path + ".tmp"
         
-        with open(output_path, "w", encoding="utf-8") as f:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(resource, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, output_path)
 
 def create_bundle(resource_type, resources):
     """創建 FHIR Bundle 資源"""
@@ -394,6 +170,11 @@ def create_capability_statement():
                                 "name": "subject",
                                 "type": "reference",
                                 "documentation": "患者參考"
+                            },
+                            {
+                                "name": "code",
+                                "type": "token",
+                                "documentation": "診斷代碼（支援 :text 與 :in 修飾詞）"
                             }
                         ]
                     },
@@ -416,7 +197,33 @@ def create_capability_statement():
                             {
                                 "name": "code",
                                 "type": "token",
-                                "documentation": "觀察項目代碼"
+                                "documentation": "觀察項目代碼（支援 :text 與 :in 修飾詞）"
+                            }
+                        ]
+                    },
+                    {
+                        "type": "CodeSystem",
+                        "operation": [
+                            {
+                                "name": "lookup",
+                                "definition": "http://hl7.org/fhir/OperationDefinition/CodeSystem-lookup"
+                            },
+                            {
+                                "name": "validate-code",
+                                "definition": "http://hl7.org/fhir/OperationDefinition/CodeSystem-validate-code"
+                            }
+                        ]
+                    },
+                    {
+                        "type": "ValueSet",
+                        "operation": [
+                            {
+                                "name": "expand",
+                                "definition": "http://hl7.org/fhir/OperationDefinition/ValueSet-expand"
+                            },
+                            {
+                                "name": "validate-code",
+                                "definition": "http://hl7.org/fhir/OperationDefinition/ValueSet-validate-code"
                             }
                         ]
                     }
@@ -432,75 +239,39 @@ def create_capability_statement():
     return capability
 
 def create_code_systems():
-    """創建代碼系統資源"""
-    code_systems = [
-        {
-            "resourceType": "CodeSystem",
-            "id": "tmu-alzheimers-diagnosis",
-            "url": "http://tmu.edu.tw/fhir/alzheimers/diagnosis",
-            "version": "1.0.0",
-            "name": "TaiwanAlzheimersDiagnosis",
-            "title": "臺灣失智症診斷代碼系統",
-            "status": "active",
-            "content": "complete",
-            "concept": [
-                {
-                    "code": "AD",
-                    "display": "阿茲海默症"
-                },
-                {
-                    "code": "VD",
-                    "display": "血管性失智症"
-                },
-                {
-                    "code": "MCI",
-                    "display": "輕度認知障礙"
-                }
-            ]
-        },
-        {
-            "resourceType": "CodeSystem",
-            "id": "tmu-alzheimers-severity",
-            "url": "http://tmu.edu.tw/fhir/alzheimers/dementia-severity",
-            "version": "1.0.0",
-            "name": "TaiwanAlzheimersSeverity",
-            "title": "臺灣失智症嚴重程度代碼系統",
-            "status": "active",
-            "content": "complete",
-            "concept": [
-                {
-                    "code": "0.5",
-                    "display": "極輕度"
-                },
-                {
-                    "code": "1",
-                    "display": "輕度"
-                },
-                {
-                    "code": "2",
-                    "display": "中度"
-                },
-                {
-                    "code": "3",
-                    "display": "重度"
-                }
-            ]
-        }
-    ]
-    
-    for code_system in code_systems:
+    """創建代碼系統與值集資源（定義見 app.utils.terminology，轉換時以相同代碼對應）"""
+    for code_system in CODE_SYSTEMS:
         output_path = os.path.join(OUTPUT_DIR, f"codesystem-{code_system['id']}.json")
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(code_system, f, ensure_ascii=False, indent=2)
     
-    return code_systems
+    for value_set in VALUE_SETS:
+        output_path = os.path.join(OUTPUT_DIR, f"valueset-{value_set['id']}.json")
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(value_set, f, ensure_ascii=False, indent=2)
+    
+    return CODE_SYSTEMS
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="將 CSV 資料轉換為 FHIR 格式")
+    parser.add_argument("--format", choices=["json", "ndjson"], default="json",
+                        help="json：每個資源一個檔案；ndjson：每種資源分片的 NDJSON 加位移索引")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="none", help="NDJSON 分片壓縮")
+    parser.add_argument("--shard-mb", type=int, default=DEFAULT_SHARD_BYTES // (1024 * 1024), help="NDJSON 分片大小上限（MB）")
+    parser.add_argument("--ndjson-dir", default=NDJSON_DIR, help="NDJSON 輸出資料夾")
+    parser.add_argument("--force", action="store_true", help="內容未變更的資源也重新寫出")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="平行轉換的行程數；同一病人跨檔合併為一個 Patient，輸出與行程數無關")
+    return parser.parse_args()
 
 def main():
     """主函數"""
+    args = parse_args()
     print("開始將 CSV 資料轉換為 FHIR 格式...")
     
-    # 獲取所有 CSV 檔案
-    csv_files = [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+    # 獲取所有 CSV 檔案（依檔名排序，合併時較後的年度優先）
+    csv_files = sorted(os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith('.csv'))
     
     if not csv_files:
         print(f"在 {DATA_DIR} 中找不到 CSV 檔案")
@@ -508,28 +279,74 @@ def main():
     
     print(f"找到 {len(csv_files)} 個 CSV 檔案")
     
+    writer = None
+    if args.format == "ndjson":
+        compression = None if args.compression == "none" else args.compression
+        writer = NDJSONWriter(args.ndjson_dir, compression, shard_bytes=args.shard_mb * 1024 * 1024)
+    
+    # 內容雜湊清單：未變更的資源沿用原 versionId/lastUpdated，逐檔輸出時不重寫
+    # （NDJSON 分片每次整批重建，仍需寫出全部資源）
+    output_dir = args.ndjson_dir if writer else OUTPUT_DIR
+    manifest = ResourceManifest(os.path.join(output_dir, MANIFEST_FILE))
+    skip_unchanged = writer is None and not args.force
+    # 反向參照索引（Patient → 參照它的資源）隨寫出一併更新，伺服器載入時直接沿用
+    # （NDJSON 分片每次整批重建，索引也從頭建立；逐檔輸出則沿用並更新既有索引）
+    references = ReferenceIndex() if writer else ReferenceIndex.load(os.path.join(output_dir, REFERENCES_FILE))
+    write_batch = manifest.writer(references.writer(writer.write_batch if writer else save_resources),
+                                  skip_unchanged=skip_unchanged)
+    
+    fingerprints = {os.path.basename(p): file_fingerprint(p) for p in csv_files}
+    changed_files = [p for p in csv_files
+                     if not skip_unchanged or manifest.sources.get(os.path.basename(p)) != fingerprints[os.path.basename(p)]]
+    removed_files = sorted(set(manifest.sources) - set(fingerprints))
+    
     # 處理每個 CSV 檔案
     results = []
-    for file_path in csv_files:
-        result = process_csv_file(file_path)
-        results.append(result)
+    try:
+        if changed_files or removed_files:
+            # 病人連結鍵取決於全部檔案：任一檔案新增、變更或移除，其他檔案的病人 id 也可能改變，
+            # 因此全部重新轉換（內容未變更的資源仍不重寫）
+            print("建立病人連結鍵...")
+            linkage = build_linkage(csv_files, CHUNK_SIZE)
+            for file_name in removed_files:
+                del manifest.sources[file_name]
+            results = convert_files(csv_files, write_batch, linkage, args.workers)
+            for result in results:
+                if result["status"] == "success":
+                    manifest.sources[result["file_name"]] = fingerprints[result["file_name"]]
+        else:
+            for file_path in csv_files:
+                print(f"略過未變更的檔案: {file_path}")
+                results.append({"file_name": os.path.basename(file_path), "status": "unchanged"})
+    finally:
+        # 索引在關閉時寫出；中途失敗時已轉換的資源仍可讀取
+        if writer:
+            writer.close()
+        manifest.save()
+        references.save(os.path.join(output_dir, REFERENCES_FILE))
+    
+    # 保存代碼對照表，下次執行沿用相同代碼
+    get_pseudonymizer().save()
     
     # 創建能力聲明
     print("創建 CapabilityStatement 資源...")
     create_capability_statement()
     
     # 創建代碼系統
-    print("創建 CodeSystem 資源...")
+    print("創建 CodeSystem 與 ValueSet 資源...")
     create_code_systems()
     
     # 輸出處理結果
     success_count = sum(1 for r in results if r["status"] == "success")
     error_count = sum(1 for r in results if r["status"] == "error")
+    unchanged_count = sum(1 for r in results if r["status"] == "unchanged")
     
     print(f"FHIR 轉換處理完成")
     print(f"成功處理: {success_count} 個檔案")
     print(f"處理失敗: {error_count} 個檔案")
-    print(f"FHIR 資源已保存至: {OUTPUT_DIR}")
+    print(f"未變更略過: {unchanged_count} 個檔案")
+    print(f"內容變更: {sum(manifest.changed.values())} 個資源，未變更: {sum(manifest.unchanged.values())} 個資源")
+    print(f"FHIR 資源已保存至: {output_dir}")
 
 if __name__ == "__main__":
     main()
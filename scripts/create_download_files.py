@@ -8,129 +8,58 @@ import sys
 import pandas as pd
 import numpy as np
 import json
-import hashlib
 import zipfile
-import re
 from pathlib import Path
 from datetime import datetime
 
 # 添加專案根目錄到路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from app.utils.dates import normalize_year_month_columns, merge_reports, format_report
+from app.utils.pseudonymize import get_pseudonymizer
+from app.core.config import settings
+from app.utils.privacy import evaluate_diversity
+from app.utils.risk import RISK_QUASI_IDENTIFIERS, assess_risk, format_risk_report, load_release
+
 # 設定
 DATA_DIR = "data/alzheimers_cohort_v1"
 OUTPUT_DIR = "static/downloads"
 ANONYMIZED_DIR = f"{OUTPUT_DIR}/anonymized_csv"
 ANONYMIZED_ZIP_PATH = f"{OUTPUT_DIR}/anonymized_csv.zip"
+CHUNK_SIZE = 100_000  # 每批讀取的列數
+
+# 只保留年-月的出生日期相關欄位
+DATE_COLUMNS = ["生日/年齡", "西元", "出生日期", "生日", "年齡"]
 
 # 確保輸出目錄存在
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(ANONYMIZED_DIR, exist_ok=True)
 
-# 隱私敏感欄位
-SENSITIVE_COLUMNS = [
-    "個案姓名", "身分證字號", "病歷號", "個案編號"
-]
-
-def hash_value(value):
-    """將值雜湊化以保護隱私"""
-    if pd.isna(value):
-        return np.nan
-    return hashlib.sha256(str(value).encode()).hexdigest()[:16]
-
-def convert_to_year_month(value):
-    """將出生日期轉換為年-月格式，隱藏具體日期"""
-    try:
-        if pd.isna(value):
-            return "未知"
-        
-        # 如果是數字（可能是年齡），保持原樣
-        if isinstance(value, (int, float)) and value > 0 and value < 120:
-            return f"{int(value)}歲"
-        
-        value_str = str(value).strip()
-        
-        # 處理各種日期格式，只保留年-月
-        date_patterns = [
-            # YYYY/MM/DD 格式
-            r'(\d{4})/(\d{1,2})/\d{1,2}',
-            # YYYY-MM-DD 格式
-            r'(\d{4})-(\d{1,2})-\d{1,2}',
-            # YYYY年MM月DD日 格式
-            r'(\d{4})年(\d{1,2})月\d{1,2}日',
-            # YYYY.MM.DD 格式
-            r'(\d{4})\.(\d{1,2})\.\d{1,2}',
-            # YYYY/MM/DD HH:MM:SS 格式
-            r'(\d{4})/(\d{1,2})/\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2}',
-            # YYYY-MM-DD HH:MM:SS 格式
-            r'(\d{4})-(\d{1,2})-\d{1,2}\s+\d{1,2}:\d{1,2}:\d{1,2}',
-            # 0YYY/MM/DD 格式（民國年）
-            r'0(\d{3})/(\d{1,2})/\d{1,2}',
-            # 0YYY-MM-DD 格式（民國年）
-            r'0(\d{3})-(\d{1,2})-\d{1,2}',
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, value_str)
-            if match:
-                year = match.group(1)
-                month = int(match.group(2))
-                
-                # 如果是民國年，轉換為西元年
-                if year.startswith('0') and len(year) == 4:
-                    # 民國年轉西元年：民國年 + 1911
-                    western_year = int(year) + 1911
-                    return f"{western_year}-{month:02d}"
-                else:
-                    return f"{year}-{month:02d}"
-        
-        # 如果無法解析，嘗試其他格式
-        # 處理 YYYY/MM 格式（只有年-月）
-        year_month_pattern = r'(\d{4})/(\d{1,2})'
-        match = re.search(year_month_pattern, value_str)
-        if match:
-            year = match.group(1)
-            month = int(match.group(2))
-            return f"{year}-{month:02d}"
-        
-        # 處理 YYYY-MM 格式（只有年-月）
-        year_month_pattern2 = r'(\d{4})-(\d{1,2})'
-        match = re.search(year_month_pattern2, value_str)
-        if match:
-            year = match.group(1)
-            month = int(match.group(2))
-            return f"{year}-{month:02d}"
-        
-        # 如果都無法解析，返回原值
-        return value
-        
-    except Exception as e:
-        print(f"處理日期值 '{value}' 時發生錯誤: {e}")
-        return value
+def anonymize_chunk(df):
+    """對單一資料區塊進行去識別化，回傳處理後的資料與日期解析報告"""
+    # 處理敏感欄位：以金鑰雜湊代碼取代直接識別欄位
+    df = get_pseudonymizer().pseudonymize_frame(df)
+    
+    # 處理各種可能的出生日期欄位，只保留年-月
+    return normalize_year_month_columns(df, DATE_COLUMNS)
 
 def anonymize_csv(file_path, output_path):
-    """對 CSV 檔案進行去識別化處理"""
+    """對 CSV 檔案進行去識別化處理（分批讀寫，記憶體用量與檔案大小無關）"""
     try:
-        df = pd.read_csv(file_path)
-        
-        # 處理敏感欄位
-        for col in SENSITIVE_COLUMNS:
-            if col in df.columns:
-                # 對敏感欄位進行雜湊化
-                df[col] = df[col].apply(hash_value)
+        reports = []
+        header = True
+        for chunk in pd.read_csv(file_path, chunksize=CHUNK_SIZE):
+            chunk, report = anonymize_chunk(chunk)
+            reports.append(report)
+            
+            # 逐批寫出去識別化後的 CSV
+            chunk.to_csv(output_path, mode="w" if header else "a", header=header, index=False)
+            header = False
         
-        # 處理各種可能的出生日期欄位，只保留年-月
-        date_columns = [
-            "生日/年齡", "西元", "出生日期", "生日", "年齡"
-        ]
-        
-        for col in date_columns:
-            if col in df.columns:
-                print(f"  處理欄位 '{col}'，轉換為年-月格式...")
-                df[col] = df[col].apply(convert_to_year_month)
-        
-        # 保存去識別化後的 CSV
-        df.to_csv(output_path, index=False)
+        report = merge_reports(reports)
+        if report:
+            print("  轉換為年-月格式，各欄位解析率：")
+            print(format_report(report))
         return True
     except Exception as e:
         print(f"處理 {file_path} 時發生錯誤: {e}")
@@ -157,6 +86,9 @@ def create_anonymized_csv_files():
         if anonymize_csv(file_path, output_path):
             success_count += 1
     
+    # 保存代碼對照表，下次執行沿用相同代碼
+    get_pseudonymizer().save()
+    
     print(f"完成 {success_count}/{len(csv_files)} 個 CSV 檔案的去識別化")
     return success_count > 0
 
@@ -194,6 +126,24 @@ def create_download_info():
         }
     }
     
+    # 附上再識別風險與敏感屬性多樣性評估（只讀取準識別欄位與敏感屬性）
+    # 下載檔為未泛化的逐筆資料，多樣性只評估、不強制；需 l-多樣性 / t-接近性請改用 analyze_and_anonymize.py
+    csv_files = [os.path.join(ANONYMIZED_DIR, f) for f in sorted(os.listdir(ANONYMIZED_DIR)) if f.endswith('.csv')]
+    if csv_files:
+        released = load_release(csv_files, RISK_QUASI_IDENTIFIERS + [settings.sensitive_attribute])
+        risk = assess_risk(released)
+        print(format_risk_report(risk))
+        diversity = {**evaluate_diversity(released, qi_columns=RISK_QUASI_IDENTIFIERS), "enforced": False}
+        print(f"  {diversity['sensitive']}（僅評估，未強制）: 最小 l = {diversity['distinct_l']}（熵 l = {diversity['entropy_l']}），最大 t = {diversity['t']}")
+        info["anonymized_csv"]["risk_assessment"] = {
+            "records": risk["records"],
+            "k": risk["k"],
+            "quasi_identifiers": risk["quasi_identifiers"],
+            "overall": risk["overall"],
+            "worst": risk["worst"],
+            "diversity": diversity
+        }
+    
     # 保存下載資訊
     with open(f"{OUTPUT_DIR}/download_info.json", "w", encoding="utf-8") as f:
         json.dump(info, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+將各年度 CSV 匯出為依年度分區的 Parquet，供 sandbox 的 DuckDB views 查詢
+"""
+
+import os
+import sys
+import shutil
+import pandas as pd
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.pseudonymize import get_pseudonymizer
+
+# 設定
+DATA_DIR = "data/alzheimers_cohort_v1"
+COHORT_DIR = os.path.join(DATA_DIR, "cohort")
+
+def export_csv(file_path):
+    """將單一年度 CSV 轉為 cohort/year=<年度>/part-0.parquet"""
+    year = os.path.splitext(os.path.basename(file_path))[0]
+    partition_dir = os.path.join(COHORT_DIR, f"year={year}")
+    os.makedirs(partition_dir, exist_ok=True)
+
+    df = pd.read_csv(file_path, dtype=str)
+    # 直接識別欄位以代碼取代，仍可計算不重複病患數
+    df = get_pseudonymizer().pseudonymize_frame(df)
+    df.to_parquet(os.path.join(partition_dir, "part-0.parquet"), index=False)
+    return len(df)
+
+def main():
+    """主函數"""
+    print("開始匯出年度分區 Parquet...")
+
+    csv_files = [os.path.join(DATA_DIR, f) for f in sorted(os.listdir(DATA_DIR)) if f.endswith('.csv')]
+
+    if not csv_files:
+        print(f"在 {DATA_DIR} 中找不到 CSV 檔案")
+        return
+
+    # 重新產生所有分區，避免殘留舊年度
+    if os.path.exists(COHORT_DIR):
+        shutil.rmtree(COHORT_DIR)
+
+    for file_path in csv_files:
+        rows = export_csv(file_path)
+        print(f"  {os.path.basename(file_path)}: {rows} 筆")
+
+    get_pseudonymizer().save()
+    print(f"Parquet 分區已保存至: {COHORT_DIR}")
+
+if __name__ == "__main__":
+    main()
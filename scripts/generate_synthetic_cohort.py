@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+產生合成的失智症世代資料（與各年度 CSV 相同的中文欄位、值分布與缺值比例），供隱私與效能測試使用
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.synthetic import DEFAULT_PROFILE, learn_profile, write_synthetic
+
+# 設定
+DATA_DIR = "data/alzheimers_cohort_v1"
+OUTPUT_DIR = "data/synthetic_cohort"
+CHUNK_SIZE = 1_000_000
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="產生合成世代資料")
+    parser.add_argument("--rows", type=int, default=100_000, help="每個年度檔案的列數")
+    parser.add_argument("--years", nargs="+", default=["113"], help="要產生的年度檔案（民國年）")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子（相同種子產生相同資料）")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="每批產生的列數")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="輸出資料夾")
+    parser.add_argument("--format", choices=["csv", "parquet", "both"], default="both", help="輸出格式")
+    parser.add_argument("--learn-from", help="從此資料夾的 CSV 學習欄位分布（預設使用內建設定）")
+    parser.add_argument("--profile", help="欄位分布設定 JSON 檔")
+    parser.add_argument("--save-profile", help="將使用的欄位分布設定存成 JSON 檔")
+    return parser.parse_args()
+
+def load_profile(args):
+    """取得欄位分布設定：設定檔 > 從現有資料學習 > 內建設定"""
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as f:
+            return json.load(f)
+    if args.learn_from:
+        csv_files = [os.path.join(args.learn_from, f) for f in sorted(os.listdir(args.learn_from)) if f.endswith('.csv')]
+        if csv_files:
+            print(f"從 {len(csv_files)} 個 CSV 檔案學習欄位分布...")
+            return learn_profile(csv_files)
+        print(f"在 {args.learn_from} 中找不到 CSV 檔案，改用內建設定")
+    return DEFAULT_PROFILE
+
+def main():
+    """主函數"""
+    args = parse_args()
+    profile = load_profile(args)
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.save_profile:
+        with open(args.save_profile, "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        print(f"欄位分布設定已保存至: {args.save_profile}")
+    
+    for year in args.years:
+        started = time.perf_counter()
+        csv_path = os.path.join(args.output_dir, f"{year}.csv") if args.format in ("csv", "both") else None
+        parquet_dir = os.path.join(args.output_dir, "cohort", f"year={year}") if args.format in ("parquet", "both") else None
+        
+        # 各年度使用不同但固定的亂數串流
+        result = write_synthetic(
+            args.rows, csv_path, parquet_dir, profile,
+            seed=args.seed * 1000 + int(year), chunksize=args.chunksize
+        )
+        elapsed = time.perf_counter() - started
+        print(f"  {year}: {result['rows']} 筆（{result['chunks']} 批），{elapsed:.1f} 秒")
+    
+    print(f"合成資料已保存至: {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+將 fhir/resources 下逐檔的 JSON 資源打包成分片 NDJSON 與位移索引
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 添加專案根目錄到路徑
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.ndjson_store import DEFAULT_SHARD_BYTES, pack_directory
+
+# 設定
+SOURCE_DIR = "fhir/resources"
+OUTPUT_DIR = "fhir/ndjson"
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="將 FHIR JSON 檔打包成 NDJSON 分片")
+    parser.add_argument("--source", default=SOURCE_DIR, help="逐檔 JSON 資源資料夾")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="NDJSON 輸出資料夾")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="gzip", help="分片壓縮")
+    parser.add_argument("--shard-mb", type=int, default=DEFAULT_SHARD_BYTES // (1024 * 1024), help="分片大小上限（MB）")
+    return parser.parse_args()
+
+def _size(path):
+    """資料夾內檔案總大小（位元組）"""
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def main():
+    """主函數"""
+    args = parse_args()
+    compression = None if args.compression == "none" else args.compression
+
+    start = time.time()
+    counts = pack_directory(args.source, args.output_dir, compression, shard_bytes=args.shard_mb * 1024 * 1024)
+    elapsed = time.time() - start
+
+    for resource_type, count in counts.items():
+        print(f"{resource_type}: {count} 個資源")
+    print(f"打包完成，耗時 {elapsed:.1f} 秒")
+    print(f"原始大小 {_size(args.source) / 1e6:.1f} MB → {_size(args.output_dir) / 1e6:.1f} MB（{args.output_dir}）")
+
+if __name__ == "__main__":
+    main()
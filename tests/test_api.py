@@ -30,7 +30,7 @@ def test_ask_endpoint():
         "question": "What is the average age of patients?",
         "dataset_id": "alzheimers_cohort_v1",
         "outputs": ["plot", "table"],
-        "privacy_level": "k_anonymous"
+        "privacy_level": "public"
     }
     
     response = client.post("/api/v1/ask", json=request_data)
@@ -39,6 +39,17 @@ def test_ask_endpoint():
     assert "job_id" in data
     assert data["status"] == "queued"
 
+def test_ask_endpoint_rejects_unaudited_questions():
+    """Test that non-public questions outside the cohort cube are not sent down the unaudited LLM path."""
+    request_data = {
+        "question": "What is the average age of patients?",
+        "outputs": ["plot", "table"],
+        "privacy_level": "k_anonymous"
+    }
+    response = client.post("/api/v1/ask", json=request_data)
+    assert response.status_code == 400
+    assert "pre-computed aggregates" in response.json()["detail"]
+
 def test_get_job_result():
     """Test get job result endpoint."""
     # First create a job
@@ -56,3 +67,45 @@ def test_get_job_result():
     assert response.status_code == 200
     data = response.json()
     assert data["job_id"] == job_id
+
+def test_router_stats():
+    """Test router statistics endpoint."""
+    response = client.get("/api/v1/router/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert "hit_ratio" in data
+    assert "latency_saved_seconds" in data
+
+def test_job_result_etag_and_long_poll():
+    """Test 304 for an unchanged job state and a long-poll that returns on the next change."""
+    import threading
+    import time
+    from datetime import datetime
+    from app.models.schemas import JobResult, JobStatus
+    from app.services.job_service import job_service
+
+    job_service.jobs["poll-job"] = JobResult(job_id="poll-job", status=JobStatus.PROCESSING, created_at=datetime(2024, 1, 1))
+    job_service._publish_status("poll-job")
+    response = client.get("/api/v1/result/poll-job")
+    etag = response.headers["etag"]
+    assert response.json()["status"] == "processing"
+    assert client.get("/api/v1/result/poll-job", headers={"If-None-Match": etag}).status_code == 304
+    # 非有限的等待秒數會失去逾時上限，必須拒絕
+    for wait in ("nan", "inf", "-1"):
+        assert client.get("/api/v1/result/poll-job", params={"wait": wait}).status_code == 422
+
+    def complete():
+        time.sleep(0.2)
+        job_service._complete_job("poll-job", "q", "hash", "public", [])
+
+    threading.Thread(target=complete).start()
+    started = time.monotonic()
+    response = client.get("/api/v1/result/poll-job", params={"wait": 5}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed"
+    assert time.monotonic() - started < 4
+
+    # 已結束的工作不會再變動，長輪詢立即回應
+    started = time.monotonic()
+    assert client.get("/api/v1/result/poll-job", params={"wait": 5}, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    assert time.monotonic() - started < 1
@@ -0,0 +1,63 @@
+"""
+Tests for the pre-aggregated cohort cube.
+"""
+
+import pandas as pd
+from app.services.cohort_cube import CohortCube
+
+def make_cohort():
+    return pd.DataFrame({
+        "收案日期": ["2018-06-01 0:00:00", "0110/10/29", "2018/01/02", None] * 5,
+        "生日/年齡": [84, 45, 72, 91] * 5,
+        "性別": ["男", "女", "女", "男"] * 5,
+        "失智程度": ["極輕度失智", "0.5", "輕度失智", "重度失智"] * 5,
+        "APOE": ["3/3", "?", "3/4", None] * 5,
+        "失智症診斷": ["阿茲海默症", "其他", "阿茲海默症", None] * 5,
+    })
+
+def test_rollup_by_year():
+    """Test roll-up to intake year, including ROC dates."""
+    cube = CohortCube.from_dataframe(make_cohort(), k=10)
+    table = cube.rollup(["intake_year"]).to_frame()
+    counts = dict(zip(table["intake_year"], table["count"]))
+    assert counts == {"2018": 10, "2021": 5, "未知": 5}
+    assert cube.total == 20
+
+def test_small_cells_flagged():
+    """Test that cells below k are flagged for suppression."""
+    cube = CohortCube.from_dataframe(make_cohort(), k=10)
+    table = cube.rollup(["gender", "severity"]).to_frame()
+    assert table["suppressed"].all()
+    assert not cube.rollup(["gender"]).to_frame()["suppressed"].any()
+
+def test_slice_and_dice():
+    """Test slicing and dicing on labels."""
+    cube = CohortCube.from_dataframe(make_cohort(), k=10)
+    women = cube.slice("gender", "女")
+    assert "gender" not in women.dims
+    assert women.total == 10
+    diced = cube.dice(severity=["極輕度失智", "重度失智"])
+    assert diced.total == 15
+    assert list(diced.labels["severity"]) == ["極輕度失智", "重度失智"]
+
+def test_save_and_load(tmp_path):
+    """Test round trip through the npz archive."""
+    cube = CohortCube.from_dataframe(make_cohort(), k=5)
+    path = tmp_path / "cube.npz"
+    cube.save(path)
+    loaded = CohortCube.load(path)
+    assert loaded.dims == cube.dims
+    assert loaded.k == 5
+    assert (loaded.counts == cube.counts).all()
+
+def test_max_contribution_per_patient(tmp_path):
+    """Test that the rows contributed by one linked patient bound the cube's sensitivity."""
+    df = make_cohort()
+    keys = pd.Series(["p1", "p1", "p1"] + [None] * (len(df) - 3), index=df.index)
+    cube = CohortCube.from_dataframe(df, k=5, patient_keys=keys)
+    assert cube.max_contribution == 3
+    assert cube.dice(gender=["男"]).rollup(["severity"]).max_contribution == 3
+    assert CohortCube.from_dataframe(df).max_contribution == 1
+
+    cube.save(tmp_path / "cube.npz")
+    assert CohortCube.load(tmp_path / "cube.npz").max_contribution == 3
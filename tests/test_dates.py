@@ -0,0 +1,35 @@
+"""
+Tests for vectorized date and age normalization.
+"""
+
+import pandas as pd
+from app.utils.dates import parse_dates, to_age_band, to_year_month
+
+def test_parse_gregorian_and_roc_dates():
+    """Test the supported Gregorian and ROC date formats."""
+    values = pd.Series([
+        "2018/06/01", "2018-06-01 0:00:00", "2018年6月1日", "2018.06.01",
+        "0110/10/29", "110-10-29", "20180601", "2018/13/01", None,
+    ])
+    parts = parse_dates(values)
+    assert parts["year"].tolist()[:7] == [2018, 2018, 2018, 2018, 2021, 2021, 2018]
+    assert parts["month"].tolist()[:7] == [6, 6, 6, 6, 10, 10, 6]
+    assert parts["year"].iloc[7:].isna().all()
+
+def test_gregorian_years_before_1911_are_kept():
+    """Test that only 3-digit and zero-padded years are treated as ROC years."""
+    values = pd.Series(["1905/03/01", "19050301", "1910-12-31", "0099/01/01", "099/01/01"])
+    assert parse_dates(values)["year"].tolist() == [1905, 1905, 1910, 2010, 2010]
+    assert to_year_month(values)[0].tolist()[:3] == ["1905-03", "1905-03", "1910-12"]
+
+def test_to_year_month_with_report():
+    """Test year-month output, ages and the parse-rate report."""
+    values = pd.Series(["1935/01/10", "0110/10/29", 84, "84.0", None, "abc"])
+    result, report = to_year_month(values)
+    assert result.tolist() == ["1935-01", "2021-10", "84歲", "84歲", "未知", "abc"]
+    assert report == {"total": 6, "missing": 1, "dates": 2, "ages": 2, "unparsed": 1, "parse_rate": 0.8}
+
+def test_age_bands():
+    """Test bucketing ages into the standard bands."""
+    bands = to_age_band(pd.Series([45, "72", 89.5, 91, 130, "1935/01/10", None]))
+    assert bands.tolist() == ["<50歲", "70-79歲", "80-89歲", "90+歲", "未知年齡", "未知年齡", "未知年齡"]
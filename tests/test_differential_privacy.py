@@ -0,0 +1,73 @@
+"""
+Tests for differentially private aggregates and the budget ledger.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from app.models.schemas import OutputType, PrivacyLevel
+from app.services.privacy_budget import PrivacyBudgetExceeded, PrivacyBudgetLedger
+from app.utils.differential_privacy import make_consistent, noise_scale, noisy_counts, noisy_table
+from tests.test_question_router import make_router
+
+def test_noisy_counts_are_consistent():
+    """Test that noisy histograms are non-negative integers summing to the noisy total."""
+    rng = np.random.default_rng(0)
+    counts = np.array([120, 3, 0, 57, 980])
+    noisy = noisy_counts(counts, epsilon=1.0, rng=rng)
+    assert noisy.dtype == np.int64 and (noisy >= 0).all()
+    assert abs(int(noisy.sum()) - counts.sum()) < 20
+    assert list(make_consistent(np.array([-2.0, 5.4, 6.6]), total=12)) == [0, 5, 7]
+    assert noise_scale(1.0, 0.5, "laplace") == 2.0
+
+def test_noise_scales_with_rows_per_patient():
+    """Test that noise is calibrated to the most rows one patient contributes."""
+    table = pd.DataFrame({"gender": ["男", "女"], "count": [120, 80]})
+    _, single = noisy_table(table, "count", epsilon=1.0, mechanism="laplace", rng=np.random.default_rng(0))
+    _, repeated = noisy_table(table, "count", epsilon=1.0, mechanism="laplace", rng=np.random.default_rng(0), sensitivity=3)
+    assert repeated["noise_scale"] == pytest.approx(3 * single["noise_scale"])
+
+    spread = np.std(noisy_counts(np.full(4000, 50), 1.0, "laplace", np.random.default_rng(1), sensitivity=3) - 50)
+    assert spread > 2 * np.std(noisy_counts(np.full(4000, 50), 1.0, "laplace", np.random.default_rng(1)) - 50)
+
+def test_ledger_charges_atomically(tmp_path):
+    """Test that concurrent charges never exceed the budget."""
+    ledger = PrivacyBudgetLedger(tmp_path / "budget.sqlite3", budget=1.0)
+    results = []
+
+    def charge():
+        try:
+            ledger.charge("alice", 0.3)
+            results.append(True)
+        except PrivacyBudgetExceeded:
+            results.append(False)
+
+    threads = [threading.Thread(target=charge) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 3
+    assert ledger.spent("alice") == pytest.approx(0.9)
+    assert ledger.remaining("bob") == 1.0
+    assert PrivacyBudgetLedger(tmp_path / "budget.sqlite3", budget=1.0).spent("alice") == pytest.approx(0.9)
+
+def test_ledger_creates_missing_directory(tmp_path):
+    """Test that the ledger creates its directory on first use."""
+    path = tmp_path / "privacy" / "nested" / "budget.sqlite3"
+    ledger = PrivacyBudgetLedger(path, budget=1.0)
+    assert ledger.charge("alice", 0.4) == pytest.approx(0.6)
+    assert path.exists()
+
+def test_router_serves_noisy_answers(tmp_path):
+    """Test that differential_privacy answers keep small cells but add noise."""
+    router = make_router()
+    table = router.build_table(router.parse("男女人數"), PrivacyLevel.DIFFERENTIAL_PRIVACY, epsilon=1.0)
+    assert set(table["gender"]) <= {"男", "女"}
+    assert (table["patient_count"] >= 0).all()
+
+    result = router.answer("男女人數", [OutputType.EXPLANATION], PrivacyLevel.DIFFERENTIAL_PRIVACY, tmp_path, epsilon=1.0)
+    assert "差分隱私" in (tmp_path / "explanation.txt").read_text(encoding="utf-8")
+    assert result["source"] == "cohort_cube"
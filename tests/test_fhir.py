@@ -0,0 +1,70 @@
+"""
+Tests for the columnar FHIR conversion.
+"""
+
+import numpy as np
+import pandas as pd
+from app.utils.fhir import convert_frame, generate_uuid, iter_resources, patient_ids, write_resources
+
+def _cohort():
+    return pd.DataFrame({
+        "個案編號": ["c1", "c2", "c1"],
+        "身分證字號": ["n1", "n2", "n1"],
+        "性別": ["男", "女", None],
+        "生日/年齡": [72, 85, 72],
+        "收案日期": ["2023-01-05", "2023-02-10", "2023-03-01"],
+        "失智症診斷": ["G30", None, "G30"],
+        "失智程度": ["輕度", None, np.nan],
+        "APOE": ["e3/e4", "", "e3/e3"],
+        "NCV檢查": [1.5, np.nan, 2.0],
+    })
+
+def test_patients_and_conditions():
+    """Test deterministic patient ids, gender mapping and condition severity."""
+    resources = convert_frame(_cohort(), last_updated="2024-01-01T00:00:00")
+    patients = resources["Patient"]
+    assert [p["id"] for p in patients] == [generate_uuid("c1n1"), generate_uuid("c2n2"), generate_uuid("c1n1")]
+    assert [p["gender"] for p in patients] == ["male", "female", "unknown"]
+    assert patients[0]["meta"]["lastUpdated"] == "2024-01-01T00:00:00"
+
+    conditions = resources["Condition"]
+    assert len(conditions) == 2
+    assert conditions[0]["subject"]["reference"] == f"Patient/{patients[0]['id']}"
+    assert conditions[0]["severity"]["text"] == "輕度"
+    assert conditions[0]["code"]["coding"][0]["code"] == "AD"
+    assert conditions[0]["severity"]["coding"][0]["code"] == "1"
+    assert "severity" not in conditions[1]
+
+def test_rows_without_identifiers_keep_separate_ids():
+    """Test that rows without case number and national ID get distinct, reproducible ids."""
+    rows = pd.DataFrame({"個案編號": [None, None, "c1"], "身分證字號": [None, None, "n1"], "生日/年齡": [70, 81, 72]})
+    ids = patient_ids(rows)
+    assert len(set(ids)) == 3
+    assert list(ids) == list(patient_ids(rows.copy()))
+    assert ids[2] == generate_uuid("c1n1")
+
+def test_observations_follow_row_order():
+    """Test that one observation is produced per non-empty cell, in row order."""
+    observations = convert_frame(_cohort())["Observation"]
+    texts = [o["code"]["text"] for o in observations]
+    assert texts == ["收案日期", "APOE", "NCV檢查", "收案日期", "收案日期", "APOE", "NCV檢查"]
+    assert observations[2]["valueQuantity"]["value"] == 1.5
+    assert observations[1]["valueString"] == "e3/e4"
+    assert observations[0]["id"] == generate_uuid(f"{generate_uuid('c1n1')}_收案日期_2023-01-05")
+    assert len({o["id"] for o in observations}) == len(observations)
+
+def test_streaming_writer_flushes_in_batches():
+    """Test that chunked conversion matches whole-frame conversion and is written in bounded batches."""
+    cohort = pd.concat([_cohort()] * 5, ignore_index=True)
+    expected = convert_frame(cohort, last_updated="T")
+    chunks = (cohort.iloc[i:i + 4] for i in range(0, len(cohort), 4))
+
+    written, progress = {}, []
+    def write_batch(resource_type, batch):
+        assert len(batch) <= 3
+        written.setdefault(resource_type, []).extend(batch)
+
+    counts = write_resources(iter_resources(chunks, last_updated="T"), write_batch, batch_size=3, on_batch=progress.append)
+    assert counts == {k: len(v) for k, v in expected.items()}
+    assert written == expected
+    assert progress[-1] == counts
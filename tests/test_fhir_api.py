@@ -0,0 +1,198 @@
+"""
+Tests for the FHIR REST endpoints (read, search, $everything, terminology and bulk export).
+"""
+
+import json
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.bulk_export import bulk_export_service
+from app.core.config import settings
+from app.services.fhir_store import FHIRStore, InvalidSearch, get_fhir_store, reload_fhir_store
+from app.utils.fhir_references import REFERENCES_FILE, ReferenceIndex
+from app.utils.ndjson_store import NDJSONWriter
+
+def _resources():
+    resources = [{"resourceType": "Patient", "id": f"p{i}", "gender": "female" if i % 2 else "male"} for i in range(5)]
+    for i in range(12):
+        resources.append({
+            "resourceType": "Observation",
+            "id": f"o{i}",
+            "status": "final",
+            "subject": {"reference": f"Patient/p{i % 3}"},
+            "code": {"coding": [{"system": "http://example.org/obs", "code": "apoe" if i % 4 == 0 else "ncv"}]},
+        })
+    return resources
+
+@pytest.fixture
+def client():
+    store = FHIRStore(_resources())
+    app.dependency_overrides[get_fhir_store] = lambda: store
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+def test_read_and_not_found(client):
+    """Test reading one resource and the OperationOutcome for unknown ids."""
+    response = client.get("/fhir/Patient/p3")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/fhir+json")
+    assert response.json() == {"resourceType": "Patient", "id": "p3", "gender": "female"}
+
+    response = client.get("/fhir/Patient/missing")
+    assert response.status_code == 404
+    assert response.json()["resourceType"] == "OperationOutcome"
+
+def test_search_indexes_and_paging(client):
+    """Test token/reference searches, AND/OR semantics and searchset paging."""
+    bundle = client.get("/fhir/Patient", params={"gender": "female"}).json()
+    assert bundle["type"] == "searchset"
+    assert [e["resource"]["id"] for e in bundle["entry"]] == ["p1", "p3"]
+    assert bundle["entry"][0]["fullUrl"].endswith("/fhir/Patient/p1")
+
+    assert client.get("/fhir/Observation?subject=p0").json()["total"] == 4
+    assert client.get("/fhir/Observation?subject=Patient/p0,Patient/p1").json()["total"] == 8
+    both = client.get("/fhir/Observation?subject=p0&code=http://example.org/obs|apoe").json()
+    assert [e["resource"]["id"] for e in both["entry"]] == ["o0"]
+
+    page = client.get("/fhir/Observation?code=ncv&_count=3&_offset=3").json()
+    assert page["total"] == 9
+    assert [e["resource"]["id"] for e in page["entry"]] == ["o5", "o6", "o7"]
+    assert {link["relation"] for link in page["link"]} == {"self", "next", "previous"}
+
+    response = client.get("/fhir/Patient?birthdate=1950")
+    assert response.status_code == 400
+
+def test_patient_everything(client):
+    """Test that $everything returns the patient first and every resource referencing it."""
+    bundle = client.get("/fhir/Patient/p1/$everything").json()
+    assert [(e["resource"]["resourceType"], e["resource"]["id"]) for e in bundle["entry"]] == [
+        ("Patient", "p1"), ("Observation", "o1"), ("Observation", "o4"), ("Observation", "o7"), ("Observation", "o10")]
+    assert bundle["total"] == 5
+
+    only = client.get("/fhir/Patient/p1/$everything", params={"_type": "Observation", "_count": 2}).json()
+    assert [e["resource"]["id"] for e in only["entry"]] == ["o1", "o4"]
+    assert any(link["relation"] == "next" for link in only["link"])
+
+    assert client.get("/fhir/Patient/p4/$everything").json()["total"] == 1
+    assert client.get("/fhir/Patient/missing/$everything").status_code == 404
+
+def test_store_uses_persisted_references(tmp_path):
+    """Test that a converted store uses the converter's reference index instead of rebuilding it."""
+    resources = _resources()
+    with NDJSONWriter(tmp_path) as writer:
+        for resource in resources:
+            writer.write(resource)
+    assert FHIRStore.from_ndjson(tmp_path).references.referencing("Patient/p1") == ["Observation/o1", "Observation/o4", "Observation/o7", "Observation/o10"]
+
+    references = ReferenceIndex()
+    references.add(resources[-1])
+    references.save(tmp_path / REFERENCES_FILE)
+    store = FHIRStore.from_ndjson(tmp_path)
+    assert store.references.forward == {"Observation/o11": ["Patient/p2"]}
+    assert [key for key, _, _ in store.everything("Patient", "p2")] == ["Patient", "Observation"]
+
+def test_include_and_revinclude(client):
+    """Test _include/_revinclude entries are added once with search mode include."""
+    bundle = client.get("/fhir/Observation", params={"code": "apoe", "_include": "Observation:subject"}).json()
+    entries = [(e["resource"]["id"], e["search"]["mode"]) for e in bundle["entry"]]
+    assert entries == [("o0", "match"), ("o4", "match"), ("o8", "match"), ("p0", "include"), ("p1", "include"), ("p2", "include")]
+    assert bundle["total"] == 3
+
+    bundle = client.get("/fhir/Patient", params={"_id": "p2", "_revinclude": "Observation:subject"}).json()
+    assert [e["resource"]["id"] for e in bundle["entry"]] == ["p2", "o2", "o5", "o8", "o11"]
+    assert "_revinclude=Observation%3Asubject" in bundle["link"][0]["url"]
+
+    assert client.get("/fhir/Patient", params={"_include": "Observation:code"}).status_code == 400
+    assert client.get("/fhir/Patient", params={"_revinclude": "Observation:focus"}).status_code == 400
+
+def test_terminology_operations(client):
+    """Test $lookup, $validate-code and $expand over the generated CodeSystems."""
+    from app.utils.terminology import DIAGNOSIS_SYSTEM
+    value_set = f"{DIAGNOSIS_SYSTEM.rsplit('/', 1)[0]}/ValueSet/tmu-alzheimers-diagnosis"
+
+    lookup = client.get("/fhir/CodeSystem/$lookup", params={"system": DIAGNOSIS_SYSTEM, "code": "VD"}).json()
+    assert {"name": "display", "valueString": "血管性失智症"} in lookup["parameter"]
+    assert client.get("/fhir/CodeSystem/$lookup", params={"system": DIAGNOSIS_SYSTEM, "code": "X"}).status_code == 404
+
+    valid = client.get("/fhir/CodeSystem/$validate-code", params={"url": DIAGNOSIS_SYSTEM, "code": "AD", "display": "阿茲海默症"}).json()
+    assert valid["parameter"][0] == {"name": "result", "valueBoolean": True}
+    wrong = client.get("/fhir/ValueSet/$validate-code", params={"url": value_set, "code": "AD", "display": "中度"}).json()
+    assert wrong["parameter"][0]["valueBoolean"] is False
+
+    expansion = client.get("/fhir/ValueSet/$expand", params={"url": value_set, "filter": "失智", "count": 2}).json()["expansion"]
+    assert expansion["total"] == 4
+    assert [c["code"] for c in expansion["contains"]] == ["VD", "MIX"]
+    assert client.get("/fhir/ValueSet/$expand", params={"url": "unknown"}).status_code == 404
+
+def test_code_search_modifiers():
+    """Test that :text and :in searches resolve through the terminology indexes."""
+    from app.utils.terminology import DIAGNOSIS_SYSTEM
+    conditions = [
+        {"resourceType": "Condition", "id": f"c{i}", "code": {"coding": [{"system": DIAGNOSIS_SYSTEM, "code": code}]}}
+        for i, code in enumerate(["AD", "VD", "MIX"])
+    ]
+    store = FHIRStore(conditions)
+    assert store.search("Condition", [("code:text", "血管型失智症")]).tolist() == [1]
+    assert store.search("Condition", [("code:text", "阿茲海默症,混合性")]).tolist() == [0, 2]
+    value_set = f"{DIAGNOSIS_SYSTEM.rsplit('/', 1)[0]}/ValueSet/tmu-alzheimers-diagnosis"
+    assert store.search("Condition", [("code:in", value_set)]).tolist() == [0, 1, 2]
+    with pytest.raises(InvalidSearch):
+        store.search("Condition", [("subject:text", "x")])
+
+def _wait(client, status_url):
+    for _ in range(200):
+        response = client.get(status_url)
+        if response.status_code != 202:
+            return response
+        time.sleep(0.01)
+    raise AssertionError("export did not finish")
+
+def test_bulk_export_with_type_and_since(client, tmp_path, monkeypatch):
+    """Test the async $export kick-off, status manifest, file download and _type/_since filters."""
+    resources = _resources()
+    for resource in resources:
+        stamp = "2024-01-01T00:00:00" if resource["id"] in ("p0", "o1") else "2023-01-01T00:00:00"
+        resource["meta"] = {"lastUpdated": stamp}
+    resources.append({"resourceType": "Organization", "id": "org1", "meta": {"lastUpdated": "2024-01-01T00:00:00"}})
+    store = FHIRStore(resources)
+    monkeypatch.setattr(bulk_export_service, "store_provider", lambda: store)
+    monkeypatch.setattr(bulk_export_service, "output_dir", tmp_path)
+
+    assert client.get("/fhir/$export").status_code == 400
+    response = client.get("/fhir/$export", headers={"Prefer": "respond-async"})
+    assert response.status_code == 202
+    manifest = _wait(client, response.headers["Content-Location"]).json()
+    assert {o["type"]: o["count"] for o in manifest["output"]} == {"Patient": 5, "Observation": 12, "Organization": 1}
+
+    response = client.get("/fhir/Patient/$export", params={"_type": "Patient,Observation", "_since": "2023-06-01T00:00:00Z"},
+                          headers={"Prefer": "respond-async"})
+    status_url = response.headers["Content-Location"]
+    manifest = _wait(client, status_url).json()
+    assert manifest["transactionTime"]
+    outputs = {o["type"]: o for o in manifest["output"]}
+    assert set(outputs) == {"Patient", "Observation"}
+    lines = client.get(outputs["Observation"]["url"]).text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["o1"]
+
+    assert client.delete(status_url).status_code == 202
+    assert client.get(status_url).status_code == 404
+    response = client.get("/fhir/Patient/$export", params={"_type": "Organization"}, headers={"Prefer": "respond-async"})
+    assert response.status_code == 400
+
+def test_store_reloads_after_conversion(tmp_path, monkeypatch):
+    """Test that the shared store picks up a rerun of the converter without a restart."""
+    monkeypatch.setattr(settings, "fhir_ndjson_dir", str(tmp_path / "ndjson"))
+    monkeypatch.setattr(settings, "fhir_resource_dir", str(tmp_path / "resources"))
+    patients = [{"resourceType": "Patient", "id": f"p{i}", "gender": "female"} for i in range(3)]
+    with NDJSONWriter(tmp_path / "ndjson") as writer:
+        writer.write_batch("Patient", patients[:2])
+    store = get_fhir_store()
+    assert store.count("Patient") == 2
+    assert get_fhir_store() is store
+
+    with NDJSONWriter(tmp_path / "ndjson") as writer:
+        writer.write_batch("Patient", patients)
+    reloaded = get_fhir_store()
+    assert reloaded.count("Patient") == 3
+    assert reload_fhir_store() is not reloaded
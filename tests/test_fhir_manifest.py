@@ -0,0 +1,73 @@
+"""
+Tests for the content-hash resource manifest.
+"""
+
+import pandas as pd
+import pytest
+from app.utils.fhir import convert_frame
+from app.utils.fhir_manifest import ResourceManifest, content_hash
+
+def _patient(gender, last_updated):
+    return {"resourceType": "Patient", "id": "p1", "gender": gender,
+            "meta": {"profile": ["x"], "versionId": "1", "lastUpdated": last_updated}}
+
+def test_content_hash_ignores_volatile_meta():
+    """Test that only versionId/lastUpdated are excluded from the hash."""
+    assert content_hash(_patient("male", "2024-01-01")) == content_hash(_patient("male", "2025-06-30"))
+    assert content_hash(_patient("male", "2024-01-01")) != content_hash(_patient("female", "2024-01-01"))
+
+def test_incremental_writes_keep_stable_versions(tmp_path):
+    """Test that unchanged resources are skipped and keep versionId/lastUpdated across runs."""
+    path = tmp_path / "manifest.json"
+    written = []
+    write = lambda resource_type, batch: written.extend(r["meta"]["versionId"] for r in batch)
+
+    first = ResourceManifest(path, run_time="2024-01-01T00:00:00Z")
+    first.writer(write)("Patient", [_patient("male", "now")])
+    first.sources["2023.csv"] = "abc"
+    first.save()
+
+    second = ResourceManifest(path, run_time="2024-02-01T00:00:00Z")
+    resource = _patient("male", "now")
+    second.writer(write)("Patient", [resource])
+    assert written == ["1"]
+    assert resource["meta"]["lastUpdated"] == "2024-01-01T00:00:00Z"
+    assert second.unchanged["Patient"] == 1
+    assert second.sources == {"2023.csv": "abc"}
+
+    changed = _patient("female", "now")
+    second.writer(write)("Patient", [changed])
+    assert written == ["1", "2"]
+    assert changed["meta"] == {"profile": ["x"], "versionId": "2", "lastUpdated": "2024-02-01T00:00:00Z"}
+    assert second.changed_since("2024-01-15T00:00:00Z") == ["Patient/p1"]
+
+    # NDJSON 分片整批重建時未變更的資源仍要寫出
+    rewritten = []
+    second.writer(lambda t, batch: rewritten.extend(batch), skip_unchanged=False)("Patient", [_patient("female", "now")])
+    assert rewritten[0]["meta"]["versionId"] == "2"
+
+@pytest.mark.parametrize("skip_unchanged", [True, False])
+def test_ids_repeated_across_files_keep_versions(tmp_path, skip_unchanged):
+    """Test that an id produced by two yearly files with different content is stable across reruns."""
+    files = [
+        pd.DataFrame({"個案編號": ["c1"], "身分證字號": ["n1"], "生日/年齡": [age], "失智症診斷": ["阿茲海默症"], "失智程度": [severity]})
+        for age, severity in ((79, "輕度"), (81, "中度"))
+    ]
+    path = tmp_path / "manifest.json"
+    disk = {}
+    for run in range(3):
+        manifest = ResourceManifest(path, run_time=f"2024-0{run + 1}-01T00:00:00Z")
+        write = manifest.writer(lambda resource_type, batch: disk.update({(resource_type, r["id"]): r for r in batch}),
+                                skip_unchanged=skip_unchanged)
+        for frame in files:
+            for resource_type, resources in convert_frame(frame).items():
+                write(resource_type, resources)
+        manifest.save()
+
+    entries = ResourceManifest(path).entries
+    assert {entry[1] for entry in entries.values()} == {"1"}
+    assert {entry[2] for entry in entries.values()} == {"2024-01-01T00:00:00Z"}
+    # 最後寫出的仍是最後一個檔案的內容
+    condition = next(r for (resource_type, _), r in disk.items() if resource_type == "Condition")
+    assert condition["severity"]["text"] == "中度"
+    assert condition["meta"]["versionId"] == "1"
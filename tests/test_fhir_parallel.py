@@ -0,0 +1,92 @@
+"""
+Tests for patient linkage and the parallel FHIR conversion.
+"""
+
+import pandas as pd
+from app.core.config import settings
+from app.utils.fhir import PatientLinkage, generate_uuid, patient_ids
+from app.utils.fhir_parallel import build_linkage, convert_parallel, merge_patient
+from app.utils.pseudonymize import get_pseudonymizer
+
+def test_linkage_joins_identifiers_across_rows():
+    """Test that rows sharing any identifier get one deterministic id, independent of row order."""
+    first = pd.DataFrame({"個案編號": ["c2", None], "身分證字號": ["n2", None], "病歷號": ["m1", "m1"]})
+    second = pd.DataFrame({"個案編號": ["c1"], "身分證字號": ["n1"], "病歷號": ["m1"]})
+
+    linkage = PatientLinkage()
+    linkage.add_frame(first)
+    linkage.add_frame(second)
+    linkage.freeze()
+    reversed_order = PatientLinkage()
+    reversed_order.add_frame(second)
+    reversed_order.add_frame(first)
+    assert linkage.keys == reversed_order.freeze().keys
+
+    ids = patient_ids(pd.concat([first, second], ignore_index=True), linkage)
+    assert set(ids) == {generate_uuid("c1n1")}
+
+def test_rows_without_identifiers_get_stable_ids():
+    """Test that rows without any identifier no longer get random ids."""
+    rows = pd.DataFrame({"個案編號": [None, None], "收案日期": ["2023-01-01", "2023-02-01"]})
+    assert list(patient_ids(rows)) == list(patient_ids(rows.copy()))
+    assert len(set(patient_ids(rows))) == 2
+
+def test_merge_patient_prefers_known_values():
+    """Test that later values win unless unknown and identifiers/extensions are unioned."""
+    merged = merge_patient(
+        {"id": "p", "gender": "female", "identifier": [{"system": "s", "value": "a"}], "extension": [{"url": "u", "valueString": "70-79"}]},
+        {"id": "p", "gender": "unknown", "identifier": [{"system": "s", "value": None}], "extension": [{"url": "u", "valueString": "80-89"}]},
+    )
+    assert merged["gender"] == "female"
+    assert merged["identifier"] == [{"system": "s", "value": "a"}]
+    assert merged["extension"] == [{"url": "u", "valueString": "80-89"}]
+
+def test_parallel_conversion_is_deterministic(tmp_path, monkeypatch):
+    """Test that duplicate patients are merged and the output does not depend on the worker count."""
+    monkeypatch.setattr(settings, "pseudonym_secret", "secret")
+    monkeypatch.setattr(settings, "pseudonym_map_path", None)
+    get_pseudonymizer.cache_clear()
+    try:
+        paths = []
+        for year, gender in ((2022, "女"), (2023, None)):
+            path = tmp_path / f"{year}.csv"
+            pd.DataFrame({
+                "個案編號": ["c1", "c2"], "身分證字號": ["n1", "n2"], "性別": [gender, "男"],
+                "收案日期": [f"{year}-01-01", f"{year}-02-01"], "失智症診斷": ["阿茲海默症", None],
+            }).to_csv(path, index=False)
+            paths.append(str(path))
+        linkage = build_linkage(paths, chunksize=1)
+
+        outputs = []
+        for workers in (1, 2):
+            written = []
+            write = lambda resource_type, batch, digests: written.extend(zip(batch, digests))
+            counts = convert_parallel(paths, write, linkage, workers=workers, chunksize=1, last_updated="T")
+            outputs.append(written)
+        assert outputs[0] == outputs[1]
+        assert counts == {"Patient": 2, "Condition": 1, "Observation": 4}
+        patients = [resource for resource, _ in outputs[0] if resource["resourceType"] == "Patient"]
+        assert [p["gender"] for p in patients] == ["female", "male"]
+    finally:
+        get_pseudonymizer.cache_clear()
+
+def test_single_worker_uses_the_same_reduce_in_process(tmp_path, monkeypatch):
+    """Test that one worker merges patients like N workers without starting a process pool."""
+    from app.utils import fhir_parallel
+    monkeypatch.setattr(settings, "pseudonym_secret", "secret")
+    monkeypatch.setattr(settings, "pseudonym_map_path", None)
+    monkeypatch.setattr(fhir_parallel, "ProcessPoolExecutor", None)
+    get_pseudonymizer.cache_clear()
+    try:
+        paths = []
+        for year, case, gender in ((2022, "c2", "男"), (2023, "c1", None)):
+            path = tmp_path / f"{year}.csv"
+            pd.DataFrame({"個案編號": [case], "身分證字號": ["n1"], "性別": [gender], "收案日期": [f"{year}-01-01"]}).to_csv(path, index=False)
+            paths.append(str(path))
+        written = []
+        write = lambda resource_type, batch, digests: written.extend(batch)
+        counts = convert_parallel(paths, write, build_linkage(paths, chunksize=1), workers=1, chunksize=1, last_updated="T")
+        assert counts["Patient"] == 1
+        assert [r["gender"] for r in written if r["resourceType"] == "Patient"] == ["male"]
+    finally:
+        get_pseudonymizer.cache_clear()
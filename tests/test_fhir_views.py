@@ -0,0 +1,67 @@
+"""
+Tests for the flattened FHIR views.
+"""
+
+import json
+import pytest
+from app.utils.fhir import FHIR_BASE
+from app.utils.fhir_manifest import ResourceManifest
+from app.utils.fhir_views import VIEW_DEFINITIONS, evaluate, materialize_views
+
+PATIENT = {
+    "resourceType": "Patient", "id": "p1", "gender": "female",
+    "extension": [{"url": "other", "valueString": "x"}, {"url": f"{FHIR_BASE}/age-group", "valueString": "80-89"}],
+}
+
+def _observation(i, value):
+    return {
+        "resourceType": "Observation", "id": f"o{i}", "status": "final",
+        "subject": {"reference": "Patient/p1"},
+        "code": {"coding": [{"system": "s", "code": f"c{i}"}, {"code": "second"}], "text": "NCV檢查"},
+        **value,
+    }
+
+def test_fhirpath_subset():
+    """Test member access, first(), where() and getReferenceKey()."""
+    observation = _observation(1, {"valueQuantity": {"value": 1.5}})
+    assert evaluate(PATIENT, f"extension.where(url='{FHIR_BASE}/age-group').valueString") == ["80-89"]
+    assert evaluate(observation, "code.coding.code") == ["c1", "second"]
+    assert evaluate(observation, "code.coding.first().code") == ["c1"]
+    assert evaluate(observation, "subject.getReferenceKey(Patient)") == ["p1"]
+    assert evaluate(observation, "subject.getReferenceKey(Group)") == []
+    assert evaluate(observation, "valueString") == []
+
+def test_incremental_materialization(tmp_path):
+    """Test that a refresh re-flattens only changed resources and drops removed ones."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    source, output = tmp_path / "resources", tmp_path / "views"
+    manifest = ResourceManifest(source / "manifest.json", run_time="2024-01-01T00:00:00Z")
+
+    def write(resource_type, batch):
+        (source / resource_type).mkdir(parents=True, exist_ok=True)
+        for resource in batch:
+            (source / resource_type / f"{resource['id']}.json").write_text(json.dumps(resource), encoding="utf-8")
+
+    writer = manifest.writer(write)
+    writer("Patient", [PATIENT])
+    writer("Observation", [_observation(1, {"valueQuantity": {"value": 1.5}}), _observation(2, {"valueString": "e3/e4"})])
+    manifest.save()
+
+    summary = materialize_views(source, output)
+    assert summary["observation"] == {"rows": 2, "refreshed": 2, "removed": 0}
+    patients = pq.read_table(output / "patient.parquet")
+    assert patients.schema.field("gender").type.value_type == "string"
+    assert patients.to_pylist()[0]["age_group"] == "80-89"
+
+    writer("Observation", [_observation(2, {"valueString": "e4/e4"}), _observation(3, {"valueQuantity": {"value": 2}})])
+    del manifest.entries["Observation/o1"]
+    manifest.save()
+
+    summary = materialize_views(source, output)
+    assert summary["patient"] == {"rows": 1, "refreshed": 0, "removed": 0}
+    assert summary["observation"] == {"rows": 2, "refreshed": 2, "removed": 1}
+    rows = {r["id"]: r for r in pq.read_table(output / "observation.parquet").to_pylist()}
+    assert rows["o2"]["value_string"] == "e4/e4"
+    assert rows["o3"]["value_quantity"] == 2.0
+    assert rows["o3"]["subject"] == "p1"
+    assert [view["name"] for view in VIEW_DEFINITIONS] == ["patient", "observation", "condition"]
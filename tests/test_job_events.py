@@ -0,0 +1,64 @@
+"""
+Tests for the job event hub and the Server-Sent Events endpoints.
+"""
+
+import asyncio
+import threading
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.job_events import JobEventHub
+
+def _parse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(("retry", ":")))
+        if fields:
+            events.append(fields)
+    return events
+
+def test_hub_replays_after_last_event_id():
+    """Test sequential ids, replay after an id and eviction of old events."""
+    hub = JobEventHub(history=3)
+    for i in range(5):
+        hub.publish("j", "log", {"message": str(i)})
+    assert [e.id for e in hub.events_after("j", 0)] == [3, 4, 5]
+    assert [e.data["message"] for e in hub.events_after("j", 3)] == ["3", "4"]
+    assert hub.events_after("j", 5) == []
+    assert not hub.is_closed("j")
+    hub.publish("j", "status", {"status": "completed"})
+    assert hub.is_closed("j")
+
+def test_hub_wakes_thread_and_async_subscribers():
+    """Test that one publish wakes both a blocked thread and an asyncio waiter."""
+    hub = JobEventHub()
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(hub.wait("j", 0, timeout=5)))
+    thread.start()
+
+    async def subscribe():
+        waiter = asyncio.create_task(hub.wait_async("j", 0, timeout=5))
+        await asyncio.sleep(0.05)
+        hub.publish("j", "log", {"message": "hello"})
+        return await waiter
+
+    events = asyncio.run(subscribe())
+    thread.join(5)
+    assert [e.data["message"] for e in events] == ["hello"]
+    assert [e.data["message"] for e in received] == ["hello"]
+    assert asyncio.run(hub.wait_async("j", 1, timeout=0.01)) == []
+
+def test_fastapi_event_stream_and_resume():
+    """Test that a job's stream ends with the final status and resumes after Last-Event-ID."""
+    client = TestClient(app)
+    job_id = client.post("/api/v1/ask", json={"question": "Test question", "outputs": ["table"], "privacy_level": "public"}).json()["job_id"]
+
+    response = client.get(f"/api/v1/jobs/{job_id}/events")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse(response.text)
+    assert events[0]["event"] == "status" and '"queued"' in events[0]["data"]
+    assert events[-1]["event"] == "status" and '"completed"' in events[-1]["data"]
+    assert any(e["event"] == "artifact" for e in events)
+
+    resumed = _parse(client.get(f"/api/v1/jobs/{job_id}/events", headers={"Last-Event-ID": events[-2]["id"]}).text)
+    assert resumed == events[-1:]
+    assert client.get("/api/v1/jobs/missing/events").status_code == 404
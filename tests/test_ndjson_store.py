@@ -0,0 +1,53 @@
+"""
+Tests for packed NDJSON resource storage.
+"""
+
+import gzip
+import json
+import pytest
+from app.utils.ndjson_store import NDJSONStore, NDJSONWriter, pack_directory
+
+def _resources(n):
+    return [{"resourceType": "Observation", "id": f"obs-{i}", "status": "final", "valueString": "值" * (i % 7)} for i in range(n)]
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_random_and_sequential_access(tmp_path, compression):
+    """Test id lookups, storage-order iteration and size-based sharding."""
+    resources = _resources(500)
+    with NDJSONWriter(tmp_path, compression, shard_bytes=4096, block_bytes=1024) as writer:
+        writer.write_batch("Observation", resources[:300])
+        writer.write_batch("Observation", resources[300:])
+        writer.write({**resources[10], "status": "amended"})
+
+    index = json.loads((tmp_path / "Observation.index.json").read_text(encoding="utf-8"))
+    assert len(index["shards"]) > 1
+
+    with NDJSONStore(tmp_path) as store:
+        assert store.count("Observation") == 500
+        assert store.get("Observation", "obs-123") == resources[123]
+        assert store.get("Observation", "obs-10")["status"] == "amended"
+        assert store.get("Observation", "missing") is None
+        assert ("Observation", "obs-499") in store
+        ids = [r["id"] for r in store.iter_resources("Observation")]
+    assert sorted(ids) == sorted(r["id"] for r in resources)
+
+    if compression == "gzip":
+        # 分片本身是標準 gzip 檔，可直接串流讀取
+        with gzip.open(tmp_path / index["shards"][0], "rt", encoding="utf-8") as f:
+            assert json.loads(f.readline()) == resources[0]
+
+def test_pack_directory(tmp_path):
+    """Test packing a per-file JSON tree."""
+    source = tmp_path / "resources"
+    (source / "Patient").mkdir(parents=True)
+    (source / "Encounter").mkdir()
+    for i in range(3):
+        resource = {"resourceType": "Patient", "id": f"p{i}", "gender": "female"}
+        (source / "Patient" / f"p{i}.json").write_text(json.dumps(resource, indent=2), encoding="utf-8")
+
+    counts = pack_directory(source, tmp_path / "ndjson")
+    assert counts == {"Patient": 3}
+    store = NDJSONStore(tmp_path / "ndjson")
+    assert store.resource_types() == ["Patient"]
+    assert store.read_raw("Patient", "p1") == b'{"resourceType":"Patient","id":"p1","gender":"female"}'
+    store.close()
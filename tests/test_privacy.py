@@ -0,0 +1,169 @@
+"""
+Tests for the Mondrian k-anonymity engine.
+"""
+
+import numpy as np
+import pandas as pd
+from app.utils.privacy import (
+    QuasiIdentifier, apply_k_anonymity, diversity_statistics, enforce_l_diversity, enforce_t_closeness,
+    enforce_table_diversity, evaluate_diversity, k_anonymize, mondrian_partition, sanitize_artifacts, stream_k_anonymize,
+    suppress_small_cells
+)
+
+QIS = ["生日/年齡", "性別", "收案日期", "失智症診斷"]
+
+def make_records(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "個案編號": [f"P{i:05d}" for i in range(n)],
+        "生日/年齡": rng.integers(55, 95, n),
+        "性別": rng.choice(["男", "女"], n),
+        "收案日期": rng.choice(["2019-03-02", "0109/07/15", "2021/11/30 0:00:00", None], n),
+        "失智症診斷": rng.choice(["阿茲海默症", "血管性失智症", "路易氏體失智症"], n),
+    })
+
+def test_every_class_has_at_least_k_records():
+    """Test that generalized quasi-identifiers form classes of size >= k."""
+    df = make_records()
+    anon, report = k_anonymize(df, k=10)
+    assert len(anon) == len(df)
+    sizes = anon.groupby(QIS, observed=True, dropna=False).size()
+    assert sizes.min() >= 10
+    assert report["min_class_size"] >= 10
+    assert report["classes"] == len(sizes) > 1
+    assert 0 < report["information_loss"] < 1
+    assert (anon["個案編號"] == df["個案編號"]).all()
+
+def test_generalization_labels():
+    """Test range labels for ordered attributes and hierarchy ancestors for categories."""
+    df = pd.DataFrame({
+        "生日/年齡": [70, 71, 72, 73, 80, 81, 82, 83],
+        "失智症診斷": ["阿茲海默症", "路易氏體失智症"] * 2 + ["阿茲海默症", "血管性失智症"] * 2,
+    })
+    anon = apply_k_anonymity(df, k=4)
+    assert list(anon["生日/年齡"].astype(str)) == ["70-73歲"] * 4 + ["80-83歲"] * 4
+    assert list(anon["失智症診斷"].astype(str)) == ["退化性失智症"] * 4 + ["失智症"] * 4
+
+    codes, domain = QuasiIdentifier("收案日期", "year_month").encode(pd.Series(["2019-03-02", "0108/03/09", None]))
+    assert codes[0] == codes[1] and codes[2] == len(domain)
+
+def test_small_dataset_is_withheld():
+    """Test that datasets smaller than k are not released."""
+    assert apply_k_anonymity(make_records(n=5), k=10).empty
+
+def test_partition_respects_weights():
+    """Test that combination weights count towards the k threshold."""
+    codes = np.arange(6, dtype=np.int32).reshape(-1, 1)
+    part = mondrian_partition(codes, np.array([5.0, 5.0, 1.0, 1.0, 1.0, 7.0]), k=10)
+    assert list(part) == [0, 0, 1, 1, 1, 1]
+
+def test_streaming_matches_in_memory(tmp_path):
+    """Test that two-pass chunked anonymization gives the in-memory result."""
+    source, output = tmp_path / "cohort.csv", tmp_path / "anonymized.csv"
+    make_records(n=1000).to_csv(source, index=False)
+    report = stream_k_anonymize(source, output, k=10, chunksize=128)
+    expected, expected_report = k_anonymize(pd.read_csv(source), k=10)
+    assert report == expected_report
+    expected.to_csv(tmp_path / "expected.csv", index=False)
+    assert output.read_text(encoding="utf-8") == (tmp_path / "expected.csv").read_text(encoding="utf-8")
+
+def test_small_cells_get_complementary_suppression():
+    """Test that a lone small cell cannot be recovered from row or column totals."""
+    table = pd.DataFrame({
+        "year": [2018, 2018, 2019, 2019, 2020, 2020],
+        "性別": ["男", "女"] * 3,
+        "patient_count": [30, 4, 25, 22, 40, 41],
+        "percentage": [10.0, 1.5, 9.5, 8.0, 15.0, 16.0],
+    })
+    protected, report = suppress_small_cells(table, k=10)
+    hidden = protected["patient_count"].isna()
+    assert report["primary"] == 1 and report["complementary"] == 3
+    assert list(hidden) == [True, True, True, True, False, False]
+    assert protected["percentage"].isna().equals(hidden)
+    assert (hidden.groupby(table["year"]).sum() != 1).all()
+    assert (hidden.groupby(table["性別"]).sum() != 1).all()
+
+    rounded, _ = suppress_small_cells(table, k=10, method="round")
+    assert list(rounded["patient_count"]) == [30, 0, 30, 20, 40, 40]
+
+def test_sanitize_artifacts_rewrites_tables(tmp_path):
+    """Test that job artifacts are protected in place unless the job is public."""
+    table = pd.DataFrame({"診斷": ["A", "B", "C"], "人數": [30, 5, 20]})
+    table.to_csv(tmp_path / "summary.csv", index=False)
+    assert sanitize_artifacts(tmp_path, "public") == {}
+    reports = sanitize_artifacts(tmp_path, "k_anonymous", k=10)
+    assert reports["summary.csv"]["primary"] == 1
+    assert pd.read_csv(tmp_path / "summary.csv")["人數"].isna().sum() == 2
+
+def test_sanitize_artifacts_protects_pivot_tables(tmp_path):
+    """Test that count columns are found by value, not only by name (pivot / crosstab artifacts)."""
+    table = pd.DataFrame({"year": [2019, 2020], "阿茲海默症": [2, 30], "血管性失智症": [1, 25]})
+    table.to_csv(tmp_path / "pivot.csv", index=False)
+    reports = sanitize_artifacts(tmp_path, "k_anonymous", k=10)
+    assert reports["pivot.csv"]["count_columns"] == 2
+    assert reports["pivot.csv"]["primary"] == 2
+    protected = pd.read_csv(tmp_path / "pivot.csv")
+    assert list(protected["year"]) == [2019, 2020]
+    assert protected.loc[0, ["阿茲海默症", "血管性失智症"]].isna().all()
+
+def make_homogeneous_classes():
+    """Two 3-row classes with a single severity each, one mixed class."""
+    return pd.DataFrame({
+        "性別": ["男"] * 3 + ["女"] * 3 + ["未知"] * 3,
+        "失智程度": ["3", "3", "3", "0.5", "0.5", "0.5", "1", "2", "0.5"],
+    })
+
+def test_diversity_statistics_distinct_entropy_and_ordinal_emd():
+    """Test per-class distinct l, entropy l and ordinal EMD."""
+    df = make_homogeneous_classes()
+    class_ids, stats = diversity_statistics(df, "失智程度", ["性別"])
+    assert stats["size"].tolist() == [3, 3, 3]
+    assert stats["distinct"].tolist() == [1, 1, 3]
+    assert np.allclose(stats["entropy_l"], [1, 1, 3])
+    # 整體分布 (4/9, 1/9, 1/9, 3/9)；全為重度的類別距離 = 累積差 (4+5+6)/9 / 3
+    assert np.isclose(stats["emd"].iloc[0], 15 / 27)
+    assert evaluate_diversity(df, "失智程度", ["性別"])["distinct_l"] == 1
+
+def test_enforcers_merge_violating_classes_and_suppress_leftovers():
+    """Test that violating classes are merged to the top level, or suppressed if still violating."""
+    df = make_homogeneous_classes()
+    diverse, report = enforce_l_diversity(df, l=2, qi_columns=["性別"])
+    assert len(diverse) == 9
+    assert report["merged_classes"] == 2 and report["suppressed"] == 0
+    assert (diverse["性別"].iloc[:6] == "*").all()
+    assert evaluate_diversity(diverse, "失智程度", ["性別"])["distinct_l"] >= 2
+
+    close, report = enforce_t_closeness(df, t=0.1, qi_columns=["性別"])
+    assert evaluate_diversity(close, "失智程度", ["性別"])["t"] <= 0.1
+    assert report["suppressed"] == len(df) - len(close)
+
+def test_enforce_table_diversity_merges_aggregate_classes(tmp_path):
+    """Test that l_diverse / t_close job tables get their homogeneous classes merged."""
+    table = pd.DataFrame({
+        "gender": ["男", "女", "女", "女", "未知", "未知"],
+        "severity": ["重度失智", "極輕度失智", "輕度失智", "中度失智", "極輕度失智", "輕度失智"],
+        "patient_count": [12, 10, 11, 10, 10, 10],
+        "percentage": [19.0, 15.9, 17.5, 15.9, 15.9, 15.9],
+    })
+    assert enforce_table_diversity(table, "k_anonymous")[0] is table
+
+    diverse, report = enforce_table_diversity(table, "l_diverse")
+    assert report["merged_classes"] == 2 and report["suppressed"] == 0
+    assert diverse["patient_count"].sum() == table["patient_count"].sum()
+    assert list(diverse["gender"]) == ["女", "女", "女", "*", "*", "*"]
+    assert diverse["percentage"].iloc[3:].isna().all()
+    assert evaluate_diversity(diverse.loc[diverse.index.repeat(diverse["patient_count"])]
+                              .rename(columns={"severity": "失智程度"}), "失智程度", ["gender"])["distinct_l"] >= 2
+
+    table.to_csv(tmp_path / "summary.csv", index=False)
+    reports = sanitize_artifacts(tmp_path, "t_close", k=10)
+    assert reports["summary.csv"]["diversity"]["t"] <= 0.3
+    assert "男" not in set(pd.read_csv(tmp_path / "summary.csv")["gender"])
+
+def test_enforce_table_diversity_withholds_uncheckable_tables():
+    """Test that sensitive breakdowns without a single count column are withheld, others pass."""
+    wide = pd.DataFrame({"gender": ["男", "女"], "輕度失智": [10, 12], "重度失智": [11, 10]})
+    withheld, report = enforce_table_diversity(wide, "l_diverse")
+    assert withheld.empty and report == {"withheld": 1}
+    plain = pd.DataFrame({"gender": ["男", "女"], "patient_count": [10, 12]})
+    assert enforce_table_diversity(plain, "t_close")[0] is plain
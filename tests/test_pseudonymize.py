@@ -0,0 +1,35 @@
+"""
+Tests for keyed pseudonymization.
+"""
+
+import hashlib
+import pandas as pd
+from app.utils.pseudonymize import Pseudonymizer
+
+def test_tokens_are_keyed_and_consistent():
+    """Test that tokens depend on the secret and are stable across frames."""
+    first = Pseudonymizer("secret-a")
+    ids = pd.Series(["A123456789", " a123456789 ", None, "B987654321"])
+    tokens = first.pseudonymize_series(ids, "national_id")
+    assert tokens[0] == tokens[1]
+    assert pd.isna(tokens[2])
+    assert tokens[0] != hashlib.sha256(b"A123456789").hexdigest()[:16]
+
+    other_file = pd.DataFrame({"身分證字號": ["A123456789"], "個案編號": ["A123456789"]})
+    pseudo = first.pseudonymize_frame(other_file)
+    assert pseudo["身分證字號"][0] == tokens[0]
+    assert pseudo["個案編號"][0] != tokens[0]
+
+    assert Pseudonymizer("secret-b").token("A123456789", "national_id") != tokens[0]
+
+def test_encrypted_map_round_trip(tmp_path):
+    """Test that the persisted map is encrypted and reused."""
+    path = tmp_path / "map.enc"
+    pseudonymizer = Pseudonymizer("secret", path)
+    token = pseudonymizer.token("12345", "case_id")
+    pseudonymizer.save()
+    assert b"12345" not in path.read_bytes()
+
+    reloaded = Pseudonymizer("secret", path)
+    assert reloaded._tokens["case_id"]["12345"] == token
+    assert reloaded.token(12345.0, "case_id") == token
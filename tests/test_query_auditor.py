@@ -0,0 +1,65 @@
+"""
+Tests for the per-user differencing audit.
+"""
+
+import numpy as np
+import pytest
+from app.models.schemas import PrivacyLevel, QueryIntent
+from app.services import question_router as question_router_module
+from app.services.query_auditor import QueryAuditor, QueryRejected
+from tests.test_question_router import make_router
+
+WEIGHTS = np.array([50, 3, 20, 8], dtype=float)
+
+def test_reject_action_blocks_small_differences():
+    """Test that a population differing from an earlier one by fewer than k patients is rejected."""
+    auditor = QueryAuditor(k=10, action="reject")
+    everyone = np.array([[True, True, True, True]])
+    assert not auditor.review("u1", everyone, WEIGHTS).any()
+    with pytest.raises(QueryRejected):
+        auditor.review("u1", np.array([[True, False, True, True]]), WEIGHTS)
+
+    # 重複查詢與差異足夠大的查詢都可通過，其他使用者互不影響
+    assert not auditor.review("u1", everyone, WEIGHTS).any()
+    assert not auditor.review("u1", np.array([[False, True, True, True]]), WEIGHTS).any()
+    assert not auditor.review("u2", np.array([[True, False, True, True]]), WEIGHTS).any()
+    assert auditor.summary("u1") == {"user_id": "u1", "queries": 3, "populations": 2}
+
+def test_noise_action_flags_rows_without_recording_them():
+    """Test that flagged rows are returned for perturbation and not stored."""
+    auditor = QueryAuditor(k=10, action="noise")
+    auditor.review("u1", np.array([[True, True, False, False]]), WEIGHTS)
+    flags = auditor.review("u1", np.array([[True, False, False, False], [False, False, True, True]]), WEIGHTS)
+    assert flags.tolist() == [True, False]
+    assert auditor.summary("u1")["populations"] == 2
+
+def test_router_audits_cube_answers(monkeypatch):
+    """Test "AD patients" followed by "female AD patients" against the cube."""
+    monkeypatch.setattr(question_router_module, "query_auditor", QueryAuditor(k=6, action="reject"))
+    router = make_router()
+    everyone = QueryIntent(filters={"diagnosis": ["阿茲海默症"]})
+    women = QueryIntent(filters={"diagnosis": ["阿茲海默症"], "gender": ["女"]})
+
+    table = router.audit_table("u1", everyone, router.build_table(everyone, PrivacyLevel.K_ANONYMOUS))
+    assert table["patient_count"].tolist() == [10]
+    with pytest.raises(QueryRejected):
+        router.audit_table("u1", women, router.build_table(women, PrivacyLevel.K_ANONYMOUS))
+
+def test_noisy_answers_are_replayed_and_charged(monkeypatch, tmp_path):
+    """Test that a flagged population is noised once, replayed afterwards, and charged to the budget."""
+    from app.services.privacy_budget import PrivacyBudgetLedger
+    ledger = PrivacyBudgetLedger(tmp_path / "budget.sqlite3", budget=10.0)
+    monkeypatch.setattr(question_router_module, "query_auditor", QueryAuditor(k=6, action="noise"))
+    monkeypatch.setattr(question_router_module, "privacy_budget", ledger)
+    router = make_router()
+    everyone = QueryIntent(filters={"diagnosis": ["阿茲海默症"]})
+    women = QueryIntent(filters={"diagnosis": ["阿茲海默症"], "gender": ["女"]})
+
+    router.audit_table("u1", everyone, router.build_table(everyone, PrivacyLevel.K_ANONYMOUS))
+    assert ledger.spent("u1") == 0
+    answers = {
+        int(router.audit_table("u1", women, router.build_table(women, PrivacyLevel.K_ANONYMOUS), "job")["patient_count"].iloc[0])
+        for _ in range(20)
+    }
+    assert len(answers) == 1
+    assert ledger.spent("u1") == pytest.approx(question_router_module.settings.dp_epsilon)
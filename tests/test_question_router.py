@@ -0,0 +1,51 @@
+"""
+Tests for the fast-path question router.
+"""
+
+from app.models.schemas import OutputType, PrivacyLevel
+from app.services.cohort_cube import CohortCube
+from app.services.question_router import QuestionRouter
+from tests.test_cohort_cube import make_cohort
+
+def make_router():
+    return QuestionRouter(cube=CohortCube.from_dataframe(make_cohort(), k=3), threshold=0.6)
+
+def test_parse_intent():
+    """Test parsing dimensions, filters, measure and chart type."""
+    intent = make_router().parse("各年齡層女性病患人數折線圖")
+    assert intent.dimensions == ["age_group"]
+    assert intent.filters == {"gender": ["女"]}
+    assert intent.measure == "count"
+    assert intent.chart_type == "line"
+    assert intent.confidence >= 0.6
+
+def test_unsupported_question_falls_through(tmp_path):
+    """Test that questions the cube cannot answer return None."""
+    router = make_router()
+    assert router.answer("MMSE 平均分數與年齡相關性", [OutputType.TABLE], PrivacyLevel.PUBLIC, tmp_path) is None
+    assert router.answer("歷年病患分布", [OutputType.CODE], PrivacyLevel.PUBLIC, tmp_path) is None
+
+def test_answer_from_cube(tmp_path):
+    """Test answering a yearly distribution without the LLM path."""
+    router = make_router()
+    result = router.answer("歷年病患分布", [OutputType.TABLE, OutputType.EXPLANATION], PrivacyLevel.K_ANONYMOUS, tmp_path)
+    assert result["source"] == "cohort_cube"
+    assert result["artifacts"] == ["summary.csv", "explanation.txt"]
+    assert list(result["table"]["intake_year"]) == ["2018", "2021"]
+    assert (tmp_path / "summary.csv").exists()
+
+    router.record_fallback(2.0)
+    stats = router.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+    assert stats["latency_saved_seconds"] > 0
+
+def test_l_diverse_answer_merges_homogeneous_classes(tmp_path):
+    """Test that l_diverse fast-path tables are l-diverse in the severity they break down."""
+    router = make_router()
+    result = router.answer("各性別失智程度人數", [OutputType.TABLE], PrivacyLevel.L_DIVERSE, tmp_path)
+    table = result["table"]
+    assert set(table["gender"]) == {"*"}
+    assert table["patient_count"].sum() == 20
+    assert table["percentage"].notna().all()
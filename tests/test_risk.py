@@ -0,0 +1,36 @@
+"""
+Tests for the re-identification risk estimator.
+"""
+
+import numpy as np
+import pandas as pd
+from app.utils.risk import assess_files, assess_risk, class_counts
+
+def test_class_counts_match_groupby():
+    """Test that packed-key class sizes equal a pandas groupby."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"a": rng.integers(0, 7, 500), "b": rng.integers(0, 3, 500), "c": rng.integers(0, 50, 500)})
+    counts = class_counts([df[c].to_numpy() for c in df.columns])
+    expected = df.groupby(list(df.columns)).size().to_numpy()
+    assert sorted(counts.tolist()) == sorted(expected.tolist())
+
+def test_assess_risk_reports_uniques_and_worst_combinations(tmp_path):
+    """Test prosecutor/journalist risk, uniques and the worst-first ordering."""
+    df = pd.DataFrame({
+        "性別": ["男", "男", "女", "女", "女", "男"],
+        "醫院": ["A", "A", "A", "B", "B", "C"],
+        "APOE": ["e3/e3", "e3/e4", "e3/e3", "e3/e3", "e3/e3", None],
+    })
+    report = assess_risk(df, k=2, sampling_fraction=0.5)
+    overall = report["overall"]
+    assert overall["columns"] == ["性別", "APOE", "醫院"]
+    assert overall["uniques"] == 4
+    assert overall["prosecutor_max"] == 1.0
+    assert overall["journalist_max"] == 0.5
+    assert overall["records_below_k"] == round(4 / 6, 6)
+    shares = [r["unique_share"] for r in report["combinations"]]
+    assert shares == sorted(shares, reverse=True)
+
+    path = tmp_path / "release.csv"
+    df.assign(其他=range(6)).to_csv(path, index=False)
+    assert assess_files([path], k=2, sampling_fraction=0.5)["overall"] == overall
@@ -0,0 +1,48 @@
+"""
+Tests for the sandbox runner's SQL mode.
+"""
+
+import importlib.util
+from pathlib import Path
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+def _runner():
+    spec = importlib.util.spec_from_file_location("sandbox_runner", Path(__file__).parent.parent / "docker" / "sandbox_runner.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_sql_mode_only_releases_aggregates(tmp_path):
+    """Test that record-level SELECTs are rejected before any artifact is written."""
+    runner = _runner()
+    con = duckdb.connect()
+    con.execute("CREATE TABLE patients AS SELECT * FROM (VALUES ('男', 72, '113'), ('女', 85, '113')) t(性別, 年齡, year)")
+
+    allowed = [
+        "SELECT 性別, COUNT(*) AS n FROM patients GROUP BY 性別 ORDER BY n DESC",
+        "SELECT COUNT(*) FROM patients",
+        "WITH t AS (SELECT year, COUNT(*) AS n FROM patients GROUP BY year) SELECT * FROM t WHERE n > 0",
+        "SELECT year, ROUND(100.0 * COUNT(*) / SUM(COUNT(*)) OVER (), 1) AS pct FROM patients GROUP BY year",
+    ]
+    for sql in allowed:
+        runner.check_aggregate_sql(con, sql)
+
+    rejected = [
+        "SELECT * FROM patients",
+        "SELECT 性別, 年齡 FROM patients WHERE 年齡 > 80",
+        "SELECT *, COUNT(*) FROM patients GROUP BY ALL",
+        "SELECT 性別, COUNT(*) OVER (PARTITION BY 性別) FROM patients",
+        "SELECT 性別, COUNT(*) FROM patients GROUP BY 性別 UNION ALL SELECT 性別, 年齡 FROM patients",
+        "SELECT COUNT(*) FROM patients; SELECT * FROM patients",
+    ]
+    for sql in rejected:
+        with pytest.raises(ValueError):
+            runner.check_aggregate_sql(con, sql)
+
+    with pytest.raises(ValueError):
+        runner.run_sql(con, "SELECT * FROM patients", None, str(tmp_path / "artifacts"))
+    assert not (tmp_path / "artifacts").exists()
+    assert runner.run_sql(con, allowed[0], None, str(tmp_path / "artifacts")) == ["table"]
@@ -0,0 +1,26 @@
+"""
+Tests for the terminology indexes.
+"""
+
+from app.utils.terminology import DIAGNOSIS_SYSTEM, SEVERITY_SYSTEM, Terminology, get_terminology
+
+def test_map_value_uses_designations_and_cache():
+    """Test that source spellings map to canonical codes and unmapped values are cached as misses."""
+    terminology = get_terminology()
+    assert terminology.map_value(DIAGNOSIS_SYSTEM, "血管型失智症")["code"] == "VD"
+    assert terminology.map_value(DIAGNOSIS_SYSTEM, " 不確定或不知道 ")["code"] == "UNK"
+    assert terminology.map_value(SEVERITY_SYSTEM, "極輕度失智")["code"] == "0.5"
+    assert terminology.map_value(SEVERITY_SYSTEM, 2.0)["code"] == "2"
+    assert terminology.map_value(DIAGNOSIS_SYSTEM, "路易氏體") is None
+    assert (DIAGNOSIS_SYSTEM, "路易氏體") in terminology._mapped
+
+def test_nested_concepts_and_replaced_systems():
+    """Test that child concepts are indexed and re-adding a system drops its cached mappings."""
+    system = {"url": "s", "concept": [{"code": "A", "display": "a", "concept": [{"code": "A1", "display": "a1"}]}]}
+    terminology = Terminology([system])
+    assert terminology.lookup("s", "A1")["parameter"][2] == {"name": "display", "valueString": "a1"}
+    assert terminology.map_value("s", "B") is None
+
+    terminology.add_code_system({"url": "s", "concept": [{"code": "B", "display": "b"}]})
+    assert terminology.map_value("s", "B")["code"] == "B"
+    assert terminology.concept("s", "A") is None
@@ -8,15 +8,22 @@ import os
 import re
 import json
 import hashlib
+import math
+import time
 import requests
+import threading
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+from app.core.config import settings
+from app.services.job_events import etag_matches, job_etag, job_events, parse_last_event_id
+from app.utils.privacy import sanitize_artifacts
+
 # 配置
 DATASET_PATH = "data/alzheimers_cohort_v1"
 DATASET_FILE = "113.csv"  # 使用 113.csv 檔案
@@ -40,6 +47,7 @@ class WebClaudeService:
         timestamp = datetime.now().strftime('%H:%M:%S')
         line = "[{}] {}".format(timestamp, message)
         logs.append(line)
+        job_events.publish(job_id, 'log', {'message': message, 'line': line})
         # 同步輸出到終端機
         print("[job {}] {}".format(job_id, line))
 
@@ -265,6 +273,13 @@ with open('{}/explanation.txt'.format(ARTIFACT_DIR), 'w', encoding='utf-8') as f
             # 執行程式碼
             exec(code, exec_globals)
             
+            # 強制小格抑制：不論產生的程式碼是否自行處理，所有表格輸出都需經過檢查
+            privacy_level = self.jobs.get(job_id, {}).get('privacy_level', 'k_anonymous')
+            suppression = sanitize_artifacts(artifacts_dir, privacy_level)
+            suppressed = sum(r.get('primary', 0) + r.get('complementary', 0) for r in suppression.values())
+            if suppressed:
+                self._append_log(job_id, "小格抑制：已遮蔽 {} 個少於 {} 人的儲存格".format(suppressed, settings.k_anonymity))
+            
             # 檢查生成的檔案
             artifacts = []
             if artifacts_dir.exists():
@@ -285,8 +300,13 @@ with open('{}/explanation.txt'.format(ARTIFACT_DIR), 'w', encoding='utf-8') as f
                 'artifacts': []
             }
     
+    def job_state(self, job_id):
+        """工作目前狀態：processing、completed 或 failed"""
+        status = self.jobs[job_id]['execution_result'].get('status')
+        return {'success': 'completed', 'error': 'failed'}.get(status, 'processing')
+    
     def create_analysis(self, question, outputs, privacy_level):
-        """創建分析工作"""
+        """創建分析工作（背景執行緒執行，進度與產出以事件推送）"""
         
         job_id = "job_{}_{}".format(len(self.jobs) + 1, int(datetime.now().timestamp()))
         # 初始化工作（先寫入，以便即時追加日誌）
@@ -303,27 +323,45 @@ with open('{}/explanation.txt'.format(ARTIFACT_DIR), 'w', encoding='utf-8') as f
             'artifact_basename': artifact_basename
         }
         
+        job_events.publish(job_id, 'status', {'status': 'processing'})
         self._append_log(job_id, '收到分析請求')
-        self._append_log(job_id, '正在呼叫 Claude Code Server 產生程式碼')
         
-        # 生成程式碼
-        code_result = self.generate_code(question, outputs, privacy_level)
-        self.jobs[job_id]['code'] = code_result['code']
-        self.jobs[job_id]['code_hash'] = code_result['code_hash']
-        self._append_log(job_id, "程式碼來源: {}".format(code_result.get('source', 'unknown')))
-        
-        # 執行程式碼
-        self._append_log(job_id, '開始執行分析程式碼')
-        execution_result = self.execute_code(code_result['code'], job_id)
+        threading.Thread(target=self._run_analysis, args=(job_id,), daemon=True).start()
+        return job_id
+    
+    def _run_analysis(self, job_id):
+        """產生並執行分析程式碼"""
+        job = self.jobs[job_id]
+        question, outputs, privacy_level = job['question'], job['outputs'], job['privacy_level']
+        try:
+            self._append_log(job_id, '正在呼叫 Claude Code Server 產生程式碼')
+            
+            # 生成程式碼
+            code_result = self.generate_code(question, outputs, privacy_level)
+            self.jobs[job_id]['code'] = code_result['code']
+            self.jobs[job_id]['code_hash'] = code_result['code_hash']
+            self._append_log(job_id, "程式碼來源: {}".format(code_result.get('source', 'unknown')))
+            
+            # 執行程式碼
+            self._append_log(job_id, '開始執行分析程式碼')
+            execution_result = self.execute_code(code_result['code'], job_id)
+        except Exception as e:
+            execution_result = {'status': 'error', 'error': str(e), 'artifacts': []}
         self.jobs[job_id]['execution_result'] = execution_result
         
         if execution_result.get('status') == 'success':
             artifacts = execution_result.get('artifacts', [])
+            for name in artifacts:
+                job_events.publish(job_id, 'artifact', {'name': name, 'url': '/files/{}/{}'.format(job_id, name)})
             self._append_log(job_id, "分析完成，產出檔案: {}".format(', '.join(artifacts) if artifacts else '無'))
         else:
             self._append_log(job_id, "分析失敗: {}".format(execution_result.get('error', '未知錯誤')))
         
-        return job_id
+        # 結束狀態最後送出，事件串流隨之關閉
+        final = {'status': self.job_state(job_id)}
+        if execution_result.get('error'):
+            final['error'] = execution_result['error']
+        job_events.publish(job_id, 'status', final)
     
     def get_job_status(self, job_id):
         """獲取工作狀態"""
@@ -335,7 +373,7 @@ with open('{}/explanation.txt'.format(ARTIFACT_DIR), 'w', encoding='utf-8') as f
             {
                 'job_id': job_id,
                 'question': job_info['question'],
-                'status': 'completed',
+                'status': self.job_state(job_id),
                 'created_at': job_info['created_at'],
                 'artifacts': job_info['execution_result'].get('artifacts', [])
             }
@@ -376,13 +414,64 @@ def analyze():
 
 @app.route('/api/job/<job_id>')
 def get_job(job_id):
-    """獲取工作狀態"""
+    """獲取工作狀態（wait=秒數 可長輪詢至狀態改變；支援 ETag / If-None-Match）"""
     job_status = claude_service.get_job_status(job_id)
+    if 'error' in job_status:
+        return jsonify(job_status)
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    # nan / inf 會讓等待失去逾時上限
+    if not math.isfinite(wait):
+        return jsonify({'error': 'wait 必須是秒數'}), 400
+    wait = min(max(wait, 0), settings.long_poll_max_seconds)
+    if_none_match = request.headers.get('If-None-Match')
+    
     # 若工作存在，補上 job_id 方便前端組裝檔案連結
-    if 'error' not in job_status:
-        job_status_with_id = { 'job_id': job_id, **job_status }
-        return jsonify(job_status_with_id)
-    return jsonify(job_status)
+    response = jsonify({'job_id': job_id, **job_status})
+    etag = initial = job_etag(response.get_data())
+    deadline = time.monotonic() + wait
+    last_id = job_events.last_id(job_id)
+    # 等到狀態與客戶端持有的版本（或請求當下的狀態）不同、工作結束或逾時
+    while claude_service.job_state(job_id) == 'processing' and \
+            (etag_matches(if_none_match, etag) if if_none_match else etag == initial):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        job_events.wait(job_id, last_id, remaining)
+        last_id = job_events.last_id(job_id)
+        response = jsonify({'job_id': job_id, **claude_service.get_job_status(job_id)})
+        etag = job_etag(response.get_data())
+    
+    if etag_matches(if_none_match, etag):
+        response = Response(status=304)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/job/<job_id>/events')
+def job_event_stream(job_id):
+    """以 Server-Sent Events 推送工作狀態、日誌與產出檔案（支援 Last-Event-ID 續傳）"""
+    if job_id not in claude_service.jobs and not job_events.exists(job_id):
+        return jsonify({'error': '工作不存在'}), 404
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    
+    def stream(last_id):
+        yield 'retry: 3000\n\n'
+        while True:
+            events = job_events.wait(job_id, last_id, settings.sse_keepalive_seconds)
+            for event in events:
+                yield event.to_sse()
+                last_id = event.id
+            if not events:
+                if job_events.is_closed(job_id):
+                    break
+                # 閒置時送出註解行，避免代理伺服器切斷連線
+                yield ': keep-alive\n\n'
+    
+    return Response(stream_with_context(stream(last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/jobs')
 def list_jobs():